@@ -1,53 +1,448 @@
+import contextlib
 import flask
 from flask.json import jsonify
+import os
+import resource
+import struct
+import threading
+import time
 import uuid
+import checkpoint
 from model import Floor
+from arraymodel import ArrayFloor
+from partitioned import PartitionedFloor, TileError
+from delta import DeltaEncoder
+from recorder import TrajectoryReader
+from instrumentation import SamplingProfiler
+from runner import SessionManager, SessionLimitError, closeModel
 
-games = {}
+# Carpeta en la que se guardan los checkpoints de las sesiones (POST /<id>/checkpoint); al
+# arrancar el servidor se restauran todas las sesiones que haya en ella
+checkpointDir = os.environ.get("CHECKPOINT_DIR")
+
+# Una sesión eliminada no debe volver a aparecer al reiniciar el servidor, así que borramos su checkpoint
+def removeCheckpoint(session):
+    if(checkpointDir is None):
+        return
+    try:
+        os.remove(os.path.join(checkpointDir, f"{session.id}.ckpt"))
+    except FileNotFoundError:
+        '''La sesión nunca guardó un checkpoint'''
+
+# Límites del servidor; se pueden cambiar con variables de entorno
+games = SessionManager(
+    workers=int(os.environ.get("SIMULATION_WORKERS", os.cpu_count())),
+    maxSessions=int(os.environ.get("MAX_SESSIONS", 1000)),
+    idleTimeout=float(os.environ.get("SESSION_IDLE_TIMEOUT", 600)),
+    onRemove=removeCheckpoint,
+)
+
+# Celdas del grid más grande que se puede crear con POST /
+maxGridCells = int(os.environ.get("MAX_GRID_CELLS", 1000 * 1000))
+
+# Simulaciones con engine=particionado que pueden tener procesos al mismo tiempo
+maxPartitionedSessions = int(os.environ.get("MAX_PARTITIONED_SESSIONS", 4))
+partitionedLock = threading.Lock()
+
+# Máximo de steps que puede avanzar una sola petición a /<id>/advance y de frames que puede regresar
+maxAdvanceSteps = int(os.environ.get("MAX_ADVANCE_STEPS", 100000))
+maxAdvanceFrames = int(os.environ.get("MAX_ADVANCE_FRAMES", 1000))
+
+# Carpeta en la que se graban las trayectorias de las simulaciones creadas con grabar=1
+recordingDir = os.environ.get("RECORDING_DIR")
+# Con SIMULATION_INSTRUMENTATION=1 todas las simulaciones miden sus fases (si no, solo las creadas
+# con instrumentar=1) y con SIMULATION_PROFILER=1 además se muestrean con un profiler compartido
+instrumentAll = os.environ.get("SIMULATION_INSTRUMENTATION") == "1"
+profiler = SamplingProfiler() if os.environ.get("SIMULATION_PROFILER") == "1" else None
 
 app = flask.Flask(__name__)
 
+# Regresa la sesión con ese id o responde 404 si no existe (o ya fue eliminada)
+def getSession(id):
+    session = games.get(id)
+    if(session is None):
+        flask.abort(404)
+    return session
+
 @app.route("/", methods=["POST"])
 def create():
-    global games
+    form = flask.request.form
+
+    # Parámetros de la simulación; los que no se manden toman su valor por defecto
+    config = {
+        "cantidadCajas": form.get("cantidadCajas", 15, type=int),
+        "cantidadRobots": form.get("cantidadRobots", 5, type=int),
+        "ancho": form.get("ancho", 20, type=int),
+        "alto": form.get("alto", 20, type=int),
+        "capacidadStack": form.get("capacidadStack", 5, type=int),
+    }
+    # Con seed la simulación es reproducible
+    seed = form.get("seed", type=int)
+    # Steps por segundo con los que avanza la simulación en segundo plano (0 = tan rápido como se pueda)
+    ticksPerSecond = form.get("tps", 5, type=float)
+
     id = str(uuid.uuid4())
-    games[id] = Floor()
-    return "ok", 201, {'Location': f"/{id}"}
+    # Con grabar=1 se guarda la trayectoria en RECORDING_DIR para reproducirla con /<id>/replay
+    recording = None
+    if(form.get("grabar", 0, type=int)):
+        if(recordingDir is None):
+            return jsonify({"error": "El servidor no tiene configurado RECORDING_DIR"}), 409
+        recording = os.path.join(recordingDir, id)
+
+    instrument = instrumentAll or bool(form.get("instrumentar", 0, type=int))
 
+    engine = form.get("engine")
+    # Las simulaciones particionadas se cuentan y se crean con partitionedLock tomado, para que dos
+    # peticiones a la vez no pasen juntas de MAX_PARTITIONED_SESSIONS
+    with (partitionedLock if engine == "particionado" else contextlib.nullcontext()):
+        try:
+            if(config["ancho"] * config["alto"] > maxGridCells):
+                raise ValueError(f"El grid de {config['ancho']}x{config['alto']} pasa del máximo de {maxGridCells} celdas")
+            # El motor con arreglos de NumPy se puede pedir con engine=array
+            if(engine == "array"):
+                model = ArrayFloor(seed=seed, grabacion=recording, instrumentar=instrument, **config)
+            # Para grids muy grandes, engine=particionado reparte el grid entre particiones procesos
+            # (como máximo uno por CPU)
+            elif(engine == "particionado"):
+                particiones = form.get("particiones", os.cpu_count(), type=int)
+                if(particiones > os.cpu_count()):
+                    raise ValueError(f"No se pueden usar más de {os.cpu_count()} particiones")
+                if(activePartitionedSessions() >= maxPartitionedSessions):
+                    return jsonify({"error": f"Se alcanzó el máximo de {maxPartitionedSessions} simulaciones particionadas"}), 503
+                model = PartitionedFloor(seed=seed, grabacion=recording, instrumentar=instrument,
+                                         particiones=particiones, **config)
+            else:
+                model = Floor(estrategia=form.get("estrategia", "greedy"), seed=seed, grabacion=recording,
+                              instrumentar=instrument, asignacion=form.get("asignacion", "aleatoria"),
+                              actualizacion=form.get("actualizacion", "secuencial"), **config)
+        except ValueError as error:
+            return jsonify({"error": str(error)}), 400
+        # Sin espacio o sin descriptores para la grabación (o para la memoria compartida de las
+        # particiones) el problema es del servidor y no de los parámetros
+        except OSError as error:
+            return jsonify({"error": f"No se pudo crear la simulación: {error.strerror or error}"}), 503
+        if(instrument):
+            model.instrumentation.profiler = profiler
+
+        return createFromModel(model, ticksPerSecond, id)
+
+# Simulaciones particionadas que todavía tienen sus procesos (al terminar los liberan)
+def activePartitionedSessions():
+    return sum(1 for session in list(games.sessions.values())
+               if isinstance(session.model, PartitionedFloor) and session.model.finalizer.alive)
+
+# Hospeda el modelo en una sesión nueva y regresa su configuración para que el cliente sepa
+# cuántos robots, cajas y stacks crear
+def createFromModel(model, ticksPerSecond, id = None):
+    id = id or str(uuid.uuid4())
+    try:
+        games.create(id, model, ticksPerSecond)
+    except SessionLimitError as error:
+        # Nadie más va a usar el modelo, así que liberamos sus procesos y archivos desde ya
+        closeModel(model)
+        return jsonify({"error": str(error)}), 503
+    return jsonify({
+        "cantidadCajas": model.amountBoxes,
+        "cantidadRobots": model.amountRobots,
+        "ancho": model.x,
+        "alto": model.y,
+        "capacidadStack": model.stackCapacity,
+        "cantidadStacks": model.amountStacks,
+    }), 201, {'Location': f"/{id}"}
+
+# Regresa el último estado publicado por la simulación; ya no avanza el modelo en la petición
 @app.route("/<id>", methods=["GET"])
 def queryState(id):
-    global model
-    model = games[id]
-    model.step()
-
-    robots = []
-    boxes = []
-
-    for agent in model.schedule.agents:
-        if(str(type(agent).__name__) == "Robot"):
-            robots.append({
-                "x": float(agent.pos[0]), 
-                "y": float(agent.pos[1]), 
-                "hasBox" : agent.myBox != None
-            })
-        else:
-            boxes.append({
-                "x": float(agent.pos[0]), 
-                "y": float(agent.pos[1]), 
-                "height": float(agent.height)
-            })
-
-    stacks = []
-
-    for stack in model.boxStacks.keys():
-        stacks.append({"x": stack[0], "y": stack[1]})
+    return flask.Response(getSession(id).snapshot.json, mimetype="application/json")
+
+# Avanza la simulación en el servidor sin pasar por los ticks: steps=N steps seguidos o, sin steps,
+# hasta que termine (como máximo MAX_ADVANCE_STEPS). Lo que regresa depende de modo:
+#   - estado (por defecto): el estado final, igual que GET /<id>
+#   - frames: el estado inicial y uno cada every=k steps (y el final) con el formato de
+#     /<id>/stream; con format=binary en su codificación binaria. Cada frame se codifica en cuanto
+#     se muestrea y steps/every no puede pasar de MAX_ADVANCE_FRAMES
+#   - resultados: solo los contadores, sin robots ni cajas
+@app.route("/<id>/advance", methods=["POST"])
+def advance(id):
+    session = getSession(id)
+    args = flask.request.values
+    steps = args.get("steps", maxAdvanceSteps, type=int)
+    every = args.get("every", type=int)
+    mode = args.get("modo", "estado")
+    if(not 0 <= steps <= maxAdvanceSteps):
+        return jsonify({"error": f"steps debe estar entre 0 y {maxAdvanceSteps}"}), 400
+    if(mode not in ("estado", "frames", "resultados")):
+        return jsonify({"error": f"Modo desconocido: {mode}"}), 400
+    if(mode == "frames" and (every is None or every <= 0)):
+        return jsonify({"error": "El modo frames necesita every mayor que 0"}), 400
+    if(mode == "frames" and steps // every > maxAdvanceFrames):
+        return jsonify({"error": f"steps/every no puede pasar de {maxAdvanceFrames} frames"}), 400
+
+    # En modo frames los estados muestreados se codifican como deltas mientras avanza el modelo
+    binary = flask.request.args.get("format") == "binary"
+    try:
+        encoder = DeltaEncoder(binary, session.model.x, session.model.y)
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    parts = []
+    sample = lambda step, model: parts.append(encoder.delta(model.getState(), step))
+    first = session.snapshot
+    if(mode == "frames"):
+        parts.append(encoder.snapshot(first.state, first.step))
+    try:
+        count, wallTime = session.advance(steps, every if mode == "frames" else None, sample)
+    except TileError as error:
+        return jsonify({"error": str(error)}), 500
+    last = session.snapshot
+
+    if(mode == "resultados"):
+        model = session.model
+        completed = model.boxesStacked == model.amountBoxes
+        return jsonify({
+            "steps": count,
+            "step": last.step,
+            "completed": completed,
+            "completionStep": last.step if completed else None,
+            "totalMoves": model.totalMoves,
+            "boxesStacked": model.boxesStacked,
+            "wallTime": wallTime,
+            "isRunning": last.state["isRunning"],
+        })
+    if(mode == "estado"):
+        return flask.Response(last.json, mimetype="application/json")
+
+    if(last.step > encoder.step):
+        parts.append(encoder.delta(last.state, last.step))
+    if(binary):
+        return flask.Response(b"".join(parts), mimetype="application/octet-stream")
+    return flask.Response("".join(parts), mimetype="application/x-ndjson")
+
+@app.route("/<id>", methods=["DELETE"])
+def delete(id):
+    if(not games.delete(id)):
+        flask.abort(404)
+    return "", 204
+
+# Descarga un checkpoint binario (ver checkpoint.py) con el estado actual de la simulación
+@app.route("/<id>/checkpoint", methods=["GET"])
+def downloadCheckpoint(id):
+    try:
+        data = getSession(id).withModel(checkpoint.dumps)
+    except checkpoint.CheckpointError as error:
+        return jsonify({"error": str(error)}), 409
+    return flask.Response(data, mimetype="application/octet-stream")
+
+# Guarda el checkpoint de la simulación en CHECKPOINT_DIR para que sobreviva a un reinicio del servidor
+@app.route("/<id>/checkpoint", methods=["POST"])
+def saveCheckpoint(id):
+    session = getSession(id)
+    if(checkpointDir is None):
+        return jsonify({"error": "El servidor no tiene configurado CHECKPOINT_DIR"}), 409
+    # Validamos antes de abrir el archivo para no dejar un checkpoint vacío
+    try:
+        session.withModel(checkpoint.checkEngine)
+    except checkpoint.CheckpointError as error:
+        return jsonify({"error": str(error)}), 409
+    session.withModel(lambda model: checkpoint.save(model, os.path.join(checkpointDir, f"{id}.ckpt")))
+    return "", 204
+
+# Crea una simulación nueva a partir de un checkpoint mandado en el cuerpo de la petición; el grid
+# tiene el mismo límite de MAX_GRID_CELLS que en POST /
+@app.route("/restore", methods=["POST"])
+def restore():
+    try:
+        model = checkpoint.loads(flask.request.get_data(), maxGridCells)
+    except (ValueError, KeyError, struct.error) as error:
+        return jsonify({"error": f"Checkpoint inválido: {error}"}), 400
+    return createFromModel(model, flask.request.args.get("tps", 5, type=float))
+
+# Crea una simulación nueva que continúa desde el estado actual de otra. Con seed la copia toma
+# decisiones aleatorias distintas y con estrategia o asignacion (solo motor mesa) se mueve con otra
+# estrategia o reparte las cajas de otra forma
+@app.route("/<id>/fork", methods=["POST"])
+def fork(id):
+    session = getSession(id)
+    form = flask.request.form
+    seed = form.get("seed", type=int)
+    estrategia = form.get("estrategia")
+    asignacion = form.get("asignacion")
+    try:
+        model = session.withModel(lambda model: checkpoint.fork(model, seed, estrategia, asignacion))
+    except checkpoint.CheckpointError as error:
+        return jsonify({"error": str(error)}), 409
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    return createFromModel(model, form.get("tps", 5, type=float))
+
+# Eventos de la simulación (cajas recogidas y apiladas, stacks nuevas o llenas, robots sin tarea o
+# bloqueados) con número de secuencia mayor o igual a since. La respuesta incluye next, el since con
+# el que pedir los siguientes, así que un cliente no tiene que comparar estados para enterarse
+@app.route("/<id>/events", methods=["GET"])
+def events(id):
+    session = getSession(id)
+    if(session.events is None):
+        return jsonify({"error": "Este motor no emite eventos"}), 409
+    events, next = session.events.since(flask.request.args.get("since", 0, type=int))
+    return jsonify({"events": events, "next": next})
+
+# Transmite la simulación como un snapshot inicial seguido de un frame por cada snapshot nuevo con
+# solo lo que cambió. Con format=binary usa la codificación binaria de delta.py en lugar de NDJSON y
+# con steps=N se detiene después de N steps (si no, sigue hasta que termine la simulación). Con
+# events=1 (solo NDJSON) después de cada frame va una línea {"type": "events", "events": [...]}
+# con los eventos nuevos, si los hay
+@app.route("/<id>/stream", methods=["GET"])
+def streamState(id):
+    runner = getSession(id)
+    binary = flask.request.args.get("format") == "binary"
+    maxSteps = flask.request.args.get("steps", type=int)
+    withEvents = not binary and runner.events is not None and bool(flask.request.args.get("events", 0, type=int))
+    try:
+        encoder = DeltaEncoder(binary, runner.model.x, runner.model.y)
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    def generate():
+        snapshot = runner.snapshot
+        lastStep = snapshot.step + (maxSteps if maxSteps is not None else float("inf"))
+        nextEvent = runner.events.next if withEvents else 0
+        yield encoder.snapshot(snapshot.state, snapshot.step)
+        while(snapshot.step < lastStep):
+            # Mientras alguien vea la transmisión la sesión no se elimina por inactividad
+            runner.touch()
+            snapshot = runner.waitForStep(snapshot.step, timeout=1)
+            if(snapshot.step > encoder.step):
+                yield encoder.delta(snapshot.state, snapshot.step)
+                if(withEvents):
+                    events, nextEvent = runner.events.since(nextEvent)
+                    if(events):
+                        yield encoder.events(events)
+            elif(runner.finished):
+                break
+
+    mimetype = "application/octet-stream" if binary else "application/x-ndjson"
+    return flask.Response(flask.stream_with_context(generate()), mimetype=mimetype)
+
+# Reproduce la grabación de una simulación (aunque ya haya terminado o se haya eliminado) con el
+# mismo formato de frames que /<id>/stream, leyendo los frames del disco sin volver a correr el
+# modelo. Con start=N empieza en el frame N, con steps=N se detiene después de N frames y con
+# tps=F manda F frames por segundo (por defecto o con 0, tan rápido como se pueda)
+@app.route("/<id>/replay", methods=["GET"])
+def replay(id):
+    path = os.path.join(recordingDir, id) if recordingDir is not None else None
+    if(path is None or not os.path.isfile(os.path.join(path, "meta.json"))):
+        flask.abort(404)
+    reader = TrajectoryReader(path)
+    binary = flask.request.args.get("format") == "binary"
+    start = flask.request.args.get("start", 0, type=int)
+    maxSteps = flask.request.args.get("steps", type=int)
+    ticksPerSecond = flask.request.args.get("tps", 0, type=float)
+    if(not 0 <= start < len(reader)):
+        return jsonify({"error": f"La grabación solo tiene {len(reader)} frames"}), 416
+
+    def generate():
+        encoder = DeltaEncoder(binary)
+        interval = 1 / ticksPerSecond if ticksPerSecond else 0
+        lastFrame = start + maxSteps if maxSteps is not None else float("inf")
+        nextTick = time.perf_counter()
+        yield encoder.snapshot(reader.frame(start), start)
+        frame = start + 1
+        while(frame <= lastFrame):
+            # Si la simulación se sigue grabando, volvemos a mapear los archivos para ver los frames nuevos
+            if(frame >= len(reader)):
+                reader.refresh()
+                if(frame >= len(reader)):
+                    break
+            if(interval):
+                nextTick += interval
+                time.sleep(max(0, nextTick - time.perf_counter()))
+            yield encoder.delta(reader.frame(frame), frame)
+            frame += 1
+
+    mimetype = "application/octet-stream" if binary else "application/x-ndjson"
+    return flask.Response(flask.stream_with_context(generate()), mimetype=mimetype)
+
+# RSS actual del proceso en bytes (en Linux lo leemos de /proc; si no, usamos el máximo de getrusage)
+def residentMemory():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# Métricas del servidor en el formato de texto de Prometheus
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    activeSessions = len(games)
+    memory = residentMemory()
+    lines = [
+        "# HELP simulation_sessions_active Simulaciones hospedadas en este proceso",
+        "# TYPE simulation_sessions_active gauge",
+        f"simulation_sessions_active {activeSessions}",
+        "# HELP simulation_sessions_created_total Simulaciones creadas",
+        "# TYPE simulation_sessions_created_total counter",
+        f"simulation_sessions_created_total {games.createdTotal}",
+        "# HELP simulation_sessions_evicted_total Simulaciones eliminadas por inactividad o por el límite de sesiones",
+        "# TYPE simulation_sessions_evicted_total counter",
+        f"simulation_sessions_evicted_total {games.evictedTotal}",
+        "# HELP process_resident_memory_bytes Memoria residente del proceso",
+        "# TYPE process_resident_memory_bytes gauge",
+        f"process_resident_memory_bytes {memory}",
+        "# HELP simulation_session_memory_bytes Memoria residente promedio por simulación",
+        "# TYPE simulation_session_memory_bytes gauge",
+        f"simulation_session_memory_bytes {memory / activeSessions if activeSessions else 0}",
+    ]
+    lines += instrumentationMetrics()
+    lines += ["# HELP simulation_events_total Eventos emitidos por las simulaciones, por tipo",
+              "# TYPE simulation_events_total counter"]
+    lines += [f'simulation_events_total{{type="{kind}"}} {count}' for kind, count in games.eventCounts().items()]
+    return flask.Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+# Métricas de las simulaciones instrumentadas (activas y ya eliminadas)
+def instrumentationMetrics():
+    instrumentation = games.instrumentation()
+    lines = [
+        "# HELP simulation_instrumented_steps_total Steps de simulaciones instrumentadas",
+        "# TYPE simulation_instrumented_steps_total counter",
+        f"simulation_instrumented_steps_total {instrumentation.steps}",
+        "# HELP simulation_phase_seconds_total Tiempo de cada fase del step",
+        "# TYPE simulation_phase_seconds_total counter",
+    ]
+    lines += [f'simulation_phase_seconds_total{{phase="{phase}"}} {seconds}' for phase, seconds in instrumentation.phaseTime.items()]
+    for counter, metric, description in (("stackSearches", "simulation_stack_searches_total", "Búsquedas de la stack más cercana"),
+                                         ("blockedMoves", "simulation_blocked_moves_total", "Robots que no se pudieron mover"),
+                                         ("idleRobots", "simulation_idle_robot_steps_total", "Steps que terminaron robots sin caja")):
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter", f"{metric} {instrumentation.counts[counter]}"]
+    if(profiler is not None):
+        lines += ["# HELP simulation_profile_samples_total Muestras del profiler por función",
+                  "# TYPE simulation_profile_samples_total counter"]
+        lines += [f'simulation_profile_samples_total{{function="{function}"}} {samples}' for function, samples in profiler.top(20)]
+    return lines
+
+
+# Restaura las sesiones guardadas en CHECKPOINT_DIR, conservando su id. Los checkpoints que no se
+# pueden leer o que ya no caben (MAX_SESSIONS) se reportan en el log y se dejan en la carpeta
+def restoreCheckpoints():
+    if(checkpointDir is None):
+        return
+    os.makedirs(checkpointDir, exist_ok=True)
+    for fileName in sorted(os.listdir(checkpointDir)):
+        if(not fileName.endswith(".ckpt")):
+            continue
+        try:
+            model = checkpoint.load(os.path.join(checkpointDir, fileName), maxGridCells)
+        # Un archivo que no se puede cargar no debe impedir que se restauren los demás
+        except Exception as error:
+            app.logger.warning("No se pudo restaurar el checkpoint %s: %s", fileName, error)
+            continue
+        try:
+            games.create(fileName[:-len(".ckpt")], model)
+        except SessionLimitError as error:
+            closeModel(model)
+            app.logger.warning("No se restauró el checkpoint %s: %s", fileName, error)
 
-    return jsonify({
-        "robots": robots, 
-        "boxes": boxes, 
-        "stacks": stacks, 
-        "isRunning": model.running
-    })
 
+if __name__ == "__main__":
+    restoreCheckpoints()
+    # Cada petición se atiende en su propio hilo; los steps los hacen los workers de SessionManager
+    app.run(threaded=True)
 
-app.run()
\ No newline at end of file
@@ -0,0 +1,423 @@
+import time
+
+import numpy as np
+
+from recorder import TrajectoryRecorder
+from instrumentation import Instrumentation
+
+# Estados posibles de una celda del grid (sin contar a los robots, que se guardan en su propio arreglo)
+EMPTY = 0
+BOX = 1
+STACK = 2
+
+# Estados posibles de una caja
+LOOSE = 0
+MOVING = 1
+STACKED = 2
+
+# Desplazamientos de la vecindad de Von Neumann, en el mismo orden en que los regresa get_neighborhood de Mesa
+OFFSETS = np.array([(-1, 0), (0, -1), (0, 1), (1, 0)], dtype=np.int32)
+
+# Bytes que pueden ocupar a la vez las distancias entre un bloque de robots y todas las stacks al
+# buscar la más cercana; el tamaño del bloque depende de cuántas stacks haya
+SEARCH_BUDGET = 32 * 1024 * 1024
+
+
+# Reglas de los robots que comparten ArrayFloor y los tiles de PartitionedFloor. Las clases que
+# las usan tienen los arreglos del estado como atributos (cellState, robotGrid, robotPos, stackPos,
+# ...), numStacks, stackCapacity y random.
+class FloorRules:
+
+    # Vecinos de cada posición y lo que hay en ellos al inicio del step
+    def neighborhood(self, positions):
+        neighbors = positions[:, None, :] + OFFSETS[None, :, :]
+        inside = (neighbors[..., 0] >= 0) & (neighbors[..., 0] < self.x) & (neighbors[..., 1] >= 0) & (neighbors[..., 1] < self.y)
+        nx = np.clip(neighbors[..., 0], 0, self.x - 1)
+        ny = np.clip(neighbors[..., 1], 0, self.y - 1)
+        cells = self.cellState[nx, ny]
+        free = inside & (cells == EMPTY) & (self.robotGrid[nx, ny] == -1)
+        return neighbors, inside, nx, ny, cells, free
+
+    # Filas que tienen alguna caja suelta vecina y la primera de esas cajas
+    def firstLooseBoxes(self, looseBoxes, nx, ny):
+        rows = np.flatnonzero(looseBoxes.any(axis=1))
+        first = looseBoxes[rows].argmax(axis=1)
+        return rows, self.boxGrid[nx[rows, first], ny[rows, first]]
+
+    # Robots vacíos que caminan al azar sin regresar a su posición anterior
+    def walkMoves(self, robots, neighbors, free):
+        candidates = free & ~np.all(neighbors == self.robotLast[robots, None, :], axis=2)
+        self.robotLast[robots] = self.robotPos[robots]
+        return self.randomMoves(neighbors, candidates)
+
+    # Máscara de las filas con algún vecino válido y el vecino que eligió cada una de ellas
+    def randomMoves(self, neighbors, valid):
+        choice, hasMove = self.randomChoice(valid)
+        return hasMove, neighbors[hasMove, choice[hasMove]]
+
+    # Elige al azar uno de los vecinos válidos de cada fila; también indica qué filas tenían alguno
+    def randomChoice(self, valid):
+        scores = self.random.random(valid.shape)
+        scores[~valid] = -1.0
+        return scores.argmax(axis=1), valid.any(axis=1)
+
+    # Robots con caja: regresa los que están al lado de su stack (y pueden dejarla), los que se
+    # acercan a ella y la celda a la que se mueve cada uno de estos. Los que no tienen stack o
+    # cuya stack se llenó buscan otra; si todas están llenas esperan a que se cree una nueva
+    def stackMoves(self, robots, neighbors, inside, free):
+        targets = self.robotTarget[robots]
+        lost = (targets == -1) | (self.stackCount[np.maximum(targets, 0)] >= self.stackCapacity)
+        if(lost.any()):
+            self.retarget(robots[lost])
+        hasTarget = self.robotTarget[robots] >= 0
+        robots, neighbors, inside, free = robots[hasTarget], neighbors[hasTarget], inside[hasTarget], free[hasTarget]
+        targetPos = self.stackPos[self.robotTarget[robots]]
+
+        # Si la stack es vecina dejamos la caja, si no avanzamos al vecino libre más cercano a ella
+        adjacent = (np.all(neighbors == targetPos[:, None, :], axis=2) & inside).any(axis=1)
+        far = ~adjacent
+        distances = ((neighbors[far] - targetPos[far][:, None, :])**2).sum(axis=2).astype(np.float64)
+        distances[~free[far]] = np.inf
+        best = distances.argmin(axis=1)
+        hasMove = np.isfinite(distances[np.arange(len(best)), best])
+        return robots[adjacent], robots[far][hasMove], neighbors[far][hasMove, best[hasMove]]
+
+    def retarget(self, robots):
+        self.robotTarget[robots] = self.findStacks(self.robotPos[robots])
+
+    # Regresa el índice de la stack no llena más cercana a cada posición (-1 si no hay ninguna)
+    def findStacks(self, positions):
+        available = np.flatnonzero(self.stackCount[:self.numStacks] < self.stackCapacity)
+        if(len(available) == 0):
+            return np.full(len(positions), -1, dtype=np.int32)
+        stacks = self.stackPos[available].astype(np.int64)
+        result = np.empty(len(positions), dtype=np.int32)
+        # Cada par robot-stack ocupa dos int64 (las diferencias en x y en y)
+        chunkSize = max(1, SEARCH_BUDGET // (16 * len(available)))
+        for start in range(0, len(positions), chunkSize):
+            chunk = positions[start:start + chunkSize].astype(np.int64)
+            distances = chunk[:, 0, None] - stacks[None, :, 0]
+            np.square(distances, out=distances)
+            dy = chunk[:, 1, None] - stacks[None, :, 1]
+            np.square(dy, out=dy)
+            distances += dy
+            result[start:start + chunkSize] = available[distances.argmin(axis=1)]
+        return result
+
+    # Los robots que están al lado de su stack dejan la caja, siempre que la stack todavía tenga
+    # lugar; regresa los que sí la dejaron
+    def dropBoxes(self, droppers, priority):
+        if(len(droppers) == 0):
+            return droppers
+        targets = self.robotTarget[droppers]
+        order = np.lexsort((priority[droppers], targets))
+        droppers = droppers[order]
+        targets = targets[order]
+
+        # Lugar que ocupa cada robot en la fila de su stack
+        _, firstIndex, counts = np.unique(targets, return_index=True, return_counts=True)
+        rank = np.arange(len(targets)) - np.repeat(firstIndex, counts)
+        slot = self.stackCount[targets] + rank
+        accepted = slot < self.stackCapacity
+
+        droppers = droppers[accepted]
+        targets = targets[accepted]
+        boxes = self.robotBox[droppers]
+
+        self.boxPos[boxes] = self.stackPos[targets]
+        self.boxState[boxes] = STACKED
+        self.boxHeight[boxes] = slot[accepted]
+        np.add.at(self.stackCount, targets, 1)
+        self.robotBox[droppers] = -1
+        self.robotTarget[droppers] = -1
+        return droppers
+
+    # Configuración que aceptan tanto Floor como ArrayFloor (y PartitionedFloor); lanza ValueError
+    # con el primer parámetro inválido
+    @staticmethod
+    def checkConfiguration(cantidadCajas, cantidadRobots, ancho, alto, capacidadStack):
+        if(ancho <= 0 or alto <= 0):
+            raise ValueError(f"El grid debe tener al menos una celda de ancho y de alto, no {ancho}x{alto}")
+        if(cantidadCajas < 0 or cantidadRobots < 0):
+            raise ValueError(f"Las cantidades de cajas y robots no pueden ser negativas ({cantidadCajas} cajas, {cantidadRobots} robots)")
+        if(capacidadStack < 1):
+            raise ValueError(f"La capacidad de las stacks debe ser al menos 1, no {capacidadStack}")
+        if(cantidadCajas + cantidadRobots > ancho * alto):
+            raise ValueError(f"No caben {cantidadCajas} cajas y {cantidadRobots} robots en un grid de {ancho}x{alto}")
+
+    # Máscara con el elemento de mayor prioridad (menor valor) para cada llave repetida
+    @staticmethod
+    def firstByKey(keys, priority):
+        order = np.lexsort((priority, keys))
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[order][1:] != keys[order][:-1]
+        mask = np.zeros(len(keys), dtype=bool)
+        mask[order[first]] = True
+        return mask
+
+
+# Versión de Floor en la que todo el estado vive en arreglos de NumPy y las reglas de los robots
+# se evalúan para todos a la vez en cada step. Los conflictos (dos robots que quieren la misma
+# celda, caja o lugar en una stack) se resuelven con una prioridad aleatoria por step, igual que
+# el orden aleatorio de RandomActivation.
+class ArrayFloor(FloorRules):
+
+    def __init__(self, cantidadCajas = 15, tiempoMaximo = 60, cantidadRobots = 5, ancho = 20, alto = 20, capacidadStack = 5, seed = None, pasosMaximos = None, grabacion = None,
+                 instrumentar = False):
+        self.random = np.random.default_rng(seed)
+        self.running = True
+
+        self.x = ancho
+        self.y = alto
+
+        FloorRules.checkConfiguration(cantidadCajas, cantidadRobots, ancho, alto, capacidadStack)
+
+        self.amountRobots = cantidadRobots
+        self.amountBoxes = cantidadCajas
+        self.stackCapacity = capacidadStack
+
+        # Calculamos la cantidad de stacks necesarias para que quepan todas las cajas
+        self.amountStacks = self.amountBoxes // self.stackCapacity + (0 if self.amountBoxes%self.stackCapacity == 0 else 1)
+
+        self.boxesStacked = 0
+        self.totalMoves = 0
+
+        self.simulationStarted = False
+        self.startTime = 0
+        self.maxTime = tiempoMaximo
+        self.maxSteps = pasosMaximos
+        self.actualTime = 0
+        self.steps = 0
+
+        # Grids con el estado de cada celda, el robot que la ocupa y la caja suelta que contiene (-1 si no hay)
+        self.cellState = np.full((self.x, self.y), EMPTY, dtype=np.int8)
+        self.robotGrid = np.full((self.x, self.y), -1, dtype=np.int32)
+        self.boxGrid = np.full((self.x, self.y), -1, dtype=np.int32)
+        self.stackGrid = np.full((self.x, self.y), -1, dtype=np.int32)
+
+        # Estado de los robots: posición, última posición, caja que cargan y stack a la que se dirigen
+        self.robotPos = np.zeros((self.amountRobots, 2), dtype=np.int32)
+        self.robotBox = np.full(self.amountRobots, -1, dtype=np.int32)
+        self.robotTarget = np.full(self.amountRobots, -1, dtype=np.int32)
+
+        # Estado de las cajas
+        self.boxPos = np.zeros((self.amountBoxes, 2), dtype=np.int32)
+        self.boxState = np.full(self.amountBoxes, LOOSE, dtype=np.int8)
+        self.boxHeight = np.zeros(self.amountBoxes, dtype=np.float32)
+
+        # Estado de las stacks, en el orden en el que se van creando
+        self.stackPos = np.zeros((self.amountStacks, 2), dtype=np.int32)
+        self.stackCount = np.zeros(self.amountStacks, dtype=np.int32)
+        self.numStacks = 0
+
+        # Elegimos las celdas iniciales sin repetir; primero van los robots y luego las cajas
+        randomNumsList = self.random.choice(self.x*self.y, self.amountRobots + self.amountBoxes, replace=False)
+        positions = np.stack((randomNumsList % self.x, randomNumsList // self.x), axis=1).astype(np.int32)
+
+        self.robotPos[:] = positions[:self.amountRobots]
+        self.robotLast = self.robotPos.copy()
+        self.robotGrid[self.robotPos[:, 0], self.robotPos[:, 1]] = np.arange(self.amountRobots, dtype=np.int32)
+
+        self.boxPos[:] = positions[self.amountRobots:]
+        self.cellState[self.boxPos[:, 0], self.boxPos[:, 1]] = BOX
+        self.boxGrid[self.boxPos[:, 0], self.boxPos[:, 1]] = np.arange(self.amountBoxes, dtype=np.int32)
+
+        # Con instrumentar=True se mide el step y se cuentan búsquedas, bloqueos y robots sin caja
+        self.instrumentation = Instrumentation() if instrumentar else None
+        # Los robots se evalúan en bloque, así que este motor no emite eventos individuales (ver events.py)
+        self.events = None
+
+        # Con grabacion (un directorio) se guarda la trayectoria de cada step para poder reproducirla
+        self.recorder = None
+        if(grabacion is not None):
+            self.recorder = TrajectoryRecorder(grabacion, self.x, self.y, self.amountRobots, self.amountBoxes)
+            self.recordStep()
+
+    # Diccionario con la posición de cada stack y la cantidad de cajas que tiene, igual que en Floor
+    @property
+    def boxStacks(self):
+        return {(int(pos[0]), int(pos[1])): int(cant) for pos, cant in zip(self.stackPos[:self.numStacks], self.stackCount[:self.numStacks])}
+
+    def step(self):
+        if(not self.simulationStarted):
+            self.startTime = time.time()
+            self.simulationStarted = True
+
+        if(self.instrumentation is None):
+            self.moveRobots()
+        else:
+            profiler = self.instrumentation.profiler
+            if(profiler is not None):
+                profiler.enter()
+            start = time.perf_counter()
+            self.moveRobots()
+            self.instrumentation.add("step", time.perf_counter() - start)
+            self.instrumentation.steps += 1
+            if(profiler is not None):
+                profiler.exit()
+        self.steps += 1
+        self.actualTime = round(time.time() - self.startTime)
+
+        if(self.boxesStacked == self.amountBoxes or self.limitReached()):
+            self.running = False
+
+        if(self.recorder is not None):
+            self.recordStep()
+
+    def recordStep(self):
+        self.recorder.record(self.robotPos, self.robotBox >= 0, self.boxPos, self.boxHeight,
+                             self.stackPos[:self.numStacks], self.running)
+
+    # Con pasosMaximos el límite es la cantidad de steps; si no, el tiempo máximo en segundos
+    def limitReached(self):
+        if(self.maxSteps is not None):
+            return self.steps >= self.maxSteps
+        return self.maxTime is not None and self.startTime + self.maxTime < time.time()
+
+    def moveRobots(self):
+        amountRobots = self.amountRobots
+
+        # Prioridad aleatoria de cada robot en este step (menor valor = se mueve primero)
+        priority = np.empty(amountRobots, dtype=np.int64)
+        priority[self.random.permutation(amountRobots)] = np.arange(amountRobots)
+
+        # Vecinos de cada robot y lo que hay en ellos al inicio del step
+        neighbors, inside, nx, ny, cells, free = self.neighborhood(self.robotPos)
+
+        # Celda a la que quiere ir cada robot (por defecto se queda en su lugar)
+        destination = self.robotPos.copy()
+        wantsMove = np.zeros(amountRobots, dtype=bool)
+
+        carrying = self.robotBox >= 0
+
+        # Robots vacíos: si tienen una caja suelta al lado la recogen, si no caminan al azar
+        looseBoxes = inside & (cells == BOX) & ~carrying[:, None]
+        pickers, pickedBoxes = self.firstLooseBoxes(looseBoxes, nx, ny)
+        if(len(pickers) > 0):
+            # Si varios robots quieren la misma caja, se la queda el de mayor prioridad
+            winners = self.firstByKey(pickedBoxes, priority[pickers])
+            pickers = pickers[winners]
+            pickedBoxes = pickedBoxes[winners]
+            destination[pickers] = self.boxPos[pickedBoxes]
+
+        walkers = np.ones(amountRobots, dtype=bool)
+        walkers[carrying] = False
+        walkers[pickers] = False
+        walkers = np.flatnonzero(walkers)
+        if(len(walkers) > 0):
+            hasMove, moves = self.walkMoves(walkers, neighbors[walkers], free[walkers])
+            walkers = walkers[hasMove]
+            destination[walkers] = moves
+            wantsMove[walkers] = True
+
+        carriers = np.flatnonzero(carrying)
+
+        # Mientras falten stacks, los robots con caja (por orden de prioridad) crean una en su posición
+        creators = np.empty(0, dtype=np.int64)
+        missingStacks = self.amountStacks - self.numStacks
+        if(missingStacks > 0 and len(carriers) > 0):
+            creators = carriers[np.argsort(priority[carriers], kind="stable")[:missingStacks]]
+            carriers = np.setdiff1d(carriers, creators)
+            hasMove, moves = self.randomMoves(neighbors[creators], free[creators])
+            movers = creators[hasMove]
+            destination[movers] = moves
+            wantsMove[movers] = True
+
+        droppers = np.empty(0, dtype=np.int64)
+        if(len(carriers) > 0):
+            droppers, movers, moves = self.stackMoves(carriers, neighbors[carriers], inside[carriers], free[carriers])
+            destination[movers] = moves
+            wantsMove[movers] = True
+
+        # Si varios robots quieren la misma celda libre, se la queda el de mayor prioridad
+        movers = np.flatnonzero(wantsMove)
+        if(len(movers) > 0):
+            cellIds = destination[movers, 0].astype(np.int64) * self.y + destination[movers, 1]
+            losers = movers[~self.firstByKey(cellIds, priority[movers])]
+            destination[losers] = self.robotPos[losers]
+            wantsMove[losers] = False
+
+        self.createStacks(creators)
+        self.boxesStacked += len(self.dropBoxes(droppers, priority))
+
+        # Recogemos las cajas: la celda deja de tener una caja suelta y la caja viaja con el robot
+        if(len(pickers) > 0):
+            self.cellState[self.boxPos[pickedBoxes, 0], self.boxPos[pickedBoxes, 1]] = EMPTY
+            self.boxGrid[self.boxPos[pickedBoxes, 0], self.boxPos[pickedBoxes, 1]] = -1
+            self.boxState[pickedBoxes] = MOVING
+            self.boxHeight[pickedBoxes] = 3.5
+            self.robotBox[pickers] = pickedBoxes
+            wantsMove[pickers] = True
+
+        # Movemos a los robots (y a las cajas que cargan) a su nueva posición
+        movers = np.flatnonzero(wantsMove)
+        self.robotGrid[self.robotPos[movers, 0], self.robotPos[movers, 1]] = -1
+        self.robotPos[movers] = destination[movers]
+        self.robotGrid[self.robotPos[movers, 0], self.robotPos[movers, 1]] = movers
+        loaded = movers[self.robotBox[movers] >= 0]
+        self.boxPos[self.robotBox[loaded]] = self.robotPos[loaded]
+
+        self.totalMoves += len(movers)
+
+        if(self.instrumentation is not None):
+            # Bloqueados: los que no se movieron sin haber dejado o apilado una caja
+            stayed = np.ones(amountRobots, dtype=bool)
+            stayed[movers] = False
+            stayed[droppers] = False
+            stayed[creators] = False
+            self.instrumentation.count("blockedMoves", int(stayed.sum()))
+            self.instrumentation.count("idleRobots", int((self.robotBox < 0).sum()))
+
+    # Los robots que crean una stack dejan su caja como la primera de ella
+    def createStacks(self, creators):
+        if(len(creators) == 0):
+            return
+        boxes = self.robotBox[creators]
+        positions = self.robotPos[creators]
+        ids = np.arange(self.numStacks, self.numStacks + len(creators))
+
+        self.stackPos[ids] = positions
+        self.stackCount[ids] = 1
+        self.stackGrid[positions[:, 0], positions[:, 1]] = ids
+        self.cellState[positions[:, 0], positions[:, 1]] = STACK
+        self.numStacks += len(creators)
+
+        self.boxState[boxes] = STACKED
+        self.boxHeight[boxes] = 0.0
+        self.robotBox[creators] = -1
+        self.robotTarget[creators] = -1
+        self.boxesStacked += len(creators)
+
+    # Medimos la búsqueda de stacks cuando el modelo está instrumentado
+    def retarget(self, robots):
+        if(self.instrumentation is None):
+            super().retarget(robots)
+            return
+        start = time.perf_counter()
+        super().retarget(robots)
+        self.instrumentation.add("findStack", time.perf_counter() - start)
+        self.instrumentation.count("stackSearches", len(robots))
+
+    # Estado de la simulación con el mismo formato que regresa la API
+    def getState(self):
+        return self.stateFromCopy(self.copyState())
+
+    # Copia de los arreglos del estado, mucho más barata que getState; la API publica una en cada
+    # step y solo arma los diccionarios (con stateFromCopy) si alguien la lee
+    def copyState(self):
+        return (self.robotPos.copy(), self.robotBox.copy(), self.boxPos.copy(), self.boxHeight.copy(),
+                self.stackPos[:self.numStacks].copy(), self.running)
+
+    @staticmethod
+    def stateFromCopy(copy):
+        robotPos, robotBox, boxPos, boxHeight, stackPos, running = copy
+        robots = [{"x": float(pos[0]), "y": float(pos[1]), "hasBox": bool(box >= 0)} for pos, box in zip(robotPos.tolist(), robotBox.tolist())]
+        boxes = [{"x": float(pos[0]), "y": float(pos[1]), "height": float(height)} for pos, height in zip(boxPos.tolist(), boxHeight.tolist())]
+        stacks = [{"x": int(pos[0]), "y": int(pos[1])} for pos in stackPos.tolist()]
+
+        return {
+            "robots": robots,
+            "boxes": boxes,
+            "stacks": stacks,
+            "isRunning": running
+        }
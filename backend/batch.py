@@ -0,0 +1,125 @@
+# Corredor de simulaciones sin interfaz: barre combinaciones de cajas, robots y tamaño del grid
+# sobre varias semillas, corre cada Floor hasta terminar en un pool de procesos y va escribiendo
+# cada resultado en un CSV conforme termina, sin guardarlos todos en memoria.
+
+import argparse
+import csv
+import itertools
+import os
+import time
+from multiprocessing import Pool
+
+from model import Floor
+from arraymodel import ArrayFloor
+from instrumentation import Instrumentation
+
+COLUMNS = ["engine", "estrategia", "asignacion", "actualizacion", "cantidadCajas", "cantidadRobots", "ancho", "alto", "seed",
+           "steps", "totalMoves", "boxesStacked", "completed", "wallTime"]
+
+
+def runToCompletion(model, maxSteps = 100000):
+    steps = 0
+    start = time.perf_counter()
+    while(model.running and steps < maxSteps):
+        model.step()
+        steps += 1
+    return steps, time.perf_counter() - start
+
+
+def createModel(engine, cantidadCajas, cantidadRobots, ancho, alto, seed, estrategia, tiempoMaximo, maxSteps, instrumentar = False,
+                asignacion = "aleatoria", actualizacion = "secuencial"):
+    if(engine == "array"):
+        return ArrayFloor(cantidadCajas, tiempoMaximo, cantidadRobots, ancho, alto, seed=seed, pasosMaximos=maxSteps,
+                          instrumentar=instrumentar)
+    return Floor(cantidadCajas, tiempoMaximo, estrategia=estrategia, seed=seed, pasosMaximos=maxSteps,
+                 cantidadRobots=cantidadRobots, ancho=ancho, alto=alto, instrumentar=instrumentar, asignacion=asignacion,
+                 actualizacion=actualizacion)
+
+
+# Corre una simulación completa; se ejecuta dentro de los procesos del pool
+def runOne(params):
+    model = createModel(params["engine"], params["cantidadCajas"], params["cantidadRobots"], params["ancho"],
+                        params["alto"], params["seed"], params["estrategia"], params["tiempoMaximo"], params["maxSteps"],
+                        params.get("instrumentar", False), params.get("asignacion", "aleatoria"),
+                        params.get("actualizacion", "secuencial"))
+    steps, wallTime = runToCompletion(model, params["maxSteps"])
+
+    result = {column: params[column] for column in COLUMNS if column in params}
+    result.update({
+        "steps": steps,
+        "totalMoves": model.totalMoves,
+        "boxesStacked": model.boxesStacked,
+        "completed": model.boxesStacked == model.amountBoxes,
+        "wallTime": wallTime,
+    })
+    # La instrumentación no va en el CSV; runBatch la acumula para el resumen
+    if(model.instrumentation is not None):
+        result["instrumentation"] = model.instrumentation
+    return result
+
+
+# Generador con los parámetros de cada corrida del barrido
+def sweep(cajas, robots, tamanos, seeds, engine = "mesa", estrategia = "greedy", tiempoMaximo = None, maxSteps = 100000,
+          instrumentar = False, asignacion = "aleatoria", actualizacion = "secuencial"):
+    for cantidadCajas, cantidadRobots, tamano, seed in itertools.product(cajas, robots, tamanos, seeds):
+        yield {
+            "engine": engine,
+            "estrategia": estrategia,
+            "asignacion": asignacion,
+            "actualizacion": actualizacion,
+            "cantidadCajas": cantidadCajas,
+            "cantidadRobots": cantidadRobots,
+            "ancho": tamano,
+            "alto": tamano,
+            "seed": seed,
+            "tiempoMaximo": tiempoMaximo,
+            "maxSteps": maxSteps,
+            "instrumentar": instrumentar,
+        }
+
+
+# Corre todas las simulaciones del barrido en paralelo y escribe cada resultado en cuanto llega. Si
+# se pasa instrumentation, ahí se acumulan los tiempos por fase de las corridas instrumentadas
+def runBatch(runs, outPath, workers = None, chunksize = 1, instrumentation = None):
+    count = 0
+    with open(outPath, "w", newline="") as outFile, Pool(workers or os.cpu_count()) as pool:
+        writer = csv.DictWriter(outFile, fieldnames=COLUMNS)
+        writer.writeheader()
+        for result in pool.imap_unordered(runOne, runs, chunksize):
+            runInstrumentation = result.pop("instrumentation", None)
+            if(instrumentation is not None and runInstrumentation is not None):
+                instrumentation.merge(runInstrumentation)
+            writer.writerow(result)
+            outFile.flush()
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Corre un barrido de simulaciones de Floor en paralelo")
+    parser.add_argument("--cajas", type=int, nargs="+", default=[15])
+    parser.add_argument("--robots", type=int, nargs="+", default=[5])
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[20], help="lado del grid cuadrado")
+    parser.add_argument("--seeds", type=int, default=10, help="cantidad de semillas por combinación")
+    parser.add_argument("--engine", choices=["mesa", "array"], default="mesa")
+    parser.add_argument("--estrategia", choices=["greedy", "bfs"], default="greedy")
+    parser.add_argument("--asignacion", choices=["aleatoria", "central"], default="aleatoria",
+                        help="cómo encuentran cajas los robots (solo motor mesa)")
+    parser.add_argument("--actualizacion", choices=["secuencial", "simultanea"], default="secuencial",
+                        help="si los robots se mueven uno por uno o todos a la vez (solo motor mesa)")
+    parser.add_argument("--tiempo-maximo", type=int, default=None, help="límite en segundos; por defecto solo se limita por steps")
+    parser.add_argument("--max-steps", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="resultados.csv")
+    parser.add_argument("--instrumentar", action="store_true", help="mide las fases del step e imprime un resumen al final")
+    args = parser.parse_args()
+
+    runs = sweep(args.cajas, args.robots, args.tamanos, range(args.seeds), args.engine, args.estrategia,
+                 args.tiempo_maximo, args.max_steps, args.instrumentar, args.asignacion,
+                 args.actualizacion)
+    instrumentation = Instrumentation() if args.instrumentar else None
+    start = time.perf_counter()
+    count = runBatch(runs, args.out, args.workers, instrumentation=instrumentation)
+    print(f"{count} simulaciones en {time.perf_counter() - start:.2f} s -> {args.out}")
+    if(instrumentation is not None):
+        print(instrumentation.format())
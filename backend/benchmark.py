@@ -0,0 +1,307 @@
+# Benchmarks de la simulación:
+#   - estrategias: compara "greedy" contra "bfs" con varias simulaciones completas
+#   - suite: microbenchmarks de Robot.getMove, Robot.findStack y Floor.step, tiempo hasta
+#     terminar con distintos tamaños de grid y cantidades de cajas/robots, y throughput de
+#     queryState con el cliente de pruebas de Flask. Cada benchmark reporta operaciones por
+#     segundo, memoria reservada y cuánto creció el RSS máximo; los resultados se guardan en
+#     JSON y se pueden comparar contra una corrida anterior para detectar regresiones en CI.
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from model import Floor
+from arraymodel import ArrayFloor
+from partitioned import PartitionedFloor
+from batch import runToCompletion
+
+
+def compareStrategies(runs = 20, cantidadCajas = 15, maxSteps = 100000):
+    results = {}
+    for strategy in ("greedy", "bfs"):
+        totalSteps = 0
+        totalMoves = 0
+        totalTime = 0.0
+        # Usamos las mismas semillas con ambas estrategias para comparar escenarios idénticos
+        for seed in range(runs):
+            model = Floor(cantidadCajas, None, estrategia=strategy, seed=seed, pasosMaximos=maxSteps)
+            steps, wallTime = runToCompletion(model)
+            totalSteps += steps
+            totalMoves += model.totalMoves
+            totalTime += wallTime
+        results[strategy] = {
+            "steps": totalSteps / runs,
+            "totalMoves": totalMoves / runs,
+            "wallTime": totalTime / runs,
+        }
+    return results
+
+
+# RSS actual y máximo (VmRSS y VmHWM) del proceso en KB, o None si no hay /proc (fuera de Linux)
+def residentMemory():
+    try:
+        with open("/proc/self/status") as status:
+            values = dict(line.split(":", 1) for line in status)
+    except OSError:
+        return None
+    return int(values["VmRSS"].split()[0]), int(values["VmHWM"].split()[0])
+
+
+# Reinicia el RSS máximo del proceso al RSS actual, para medir solo el de lo que corra después, y
+# regresa el RSS actual en KB. ru_maxrss no sirve porque nunca baja: después del primer benchmark
+# grande todos los demás reportarían ese máximo. Regresa None si el sistema no lo permite
+def resetPeakRss():
+    try:
+        with open("/proc/self/clear_refs", "w") as clearRefs:
+            clearRefs.write("5")
+    except OSError:
+        return None
+    memory = residentMemory()
+    return memory[0] if memory is not None else None
+
+
+# setup regresa la función que se mide o una tupla (función, teardown) si hay que liberar algo
+# después de cada corrida (p. ej. las sesiones de la API, que si no siguen avanzando en sus workers)
+def prepare(setup):
+    prepared = setup()
+    return prepared if isinstance(prepared, tuple) else (prepared, None)
+
+
+# Corre un benchmark. setup() prepara el estado (fuera de la medición) y regresa una función
+# que al llamarse hace las operaciones a medir y regresa cuántas hizo. Se mide una vez sin
+# tracemalloc para el tiempo y otra con él para la memoria, cada una con un setup nuevo. El RSS
+# que se reporta es lo que creció el RSS máximo durante run(), sobre el RSS que había antes.
+def measure(setup, repeat = 5):
+    best = None
+    ops = 0
+    rssGrowth = None
+    for _ in range(repeat):
+        run, teardown = prepare(setup)
+        baseline = resetPeakRss()
+        start = time.perf_counter()
+        ops = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        if(baseline is not None):
+            rssGrowth = max(rssGrowth or 0, residentMemory()[1] - baseline)
+        if(teardown is not None):
+            teardown()
+
+    run, teardown = prepare(setup)
+    tracemalloc.start()
+    run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if(teardown is not None):
+        teardown()
+
+    return {
+        "ops": ops,
+        "seconds": best,
+        "opsPerSecond": ops / best if best > 0 else float("inf"),
+        "allocatedBytes": current,
+        "peakAllocatedBytes": peak,
+        "peakRssGrowthKb": rssGrowth,
+    }
+
+
+# Avanza un modelo hasta que algún robot tenga caja y ya existan todas las stacks
+def warmUp(seed):
+    model = Floor(15, None, seed=seed, pasosMaximos=100000)
+    while(model.running):
+        carrying = [robot for robot in model.robots if robot.myBox is not None]
+        if(carrying and len(model.boxStacks) == model.amountStacks):
+            return model, carrying[0]
+        model.step()
+    return model, None
+
+
+def benchGetMove(models = 50):
+    def setup():
+        robots = []
+        for seed in range(models):
+            model = Floor(15, None, seed=seed)
+            for _ in range(20):
+                model.step()
+            robots += model.robots
+        moves = [(robot, robot.model.grid.get_neighborhood(robot.pos, moore=False)) for robot in robots]
+
+        def run():
+            for robot, nextMoves in moves:
+                robot.getMove(nextMoves)
+            return len(moves)
+        return run
+    return setup
+
+
+def benchFindStack(calls = 20000):
+    def setup():
+        seed = 0
+        model, robot = warmUp(seed)
+        while(robot is None):
+            seed += 1
+            model, robot = warmUp(seed)
+
+        def run():
+            for _ in range(calls):
+                robot.findStack()
+            return calls
+        return run
+    return setup
+
+
+def benchFloorStep(steps = 200, estrategia = "greedy"):
+    def setup():
+        model = Floor(15, None, estrategia=estrategia, seed=0)
+
+        def run():
+            count = 0
+            while(model.running and count < steps):
+                model.step()
+                count += 1
+            return count
+        return run
+    return setup
+
+
+# Tiempo hasta terminar una simulación completa; las operaciones son los steps que tomó
+def benchCompletion(createModel, seeds = 3):
+    def setup():
+        models = [createModel(seed) for seed in range(seeds)]
+
+        def run():
+            return sum(runToCompletion(model)[0] for model in models)
+        return run
+    return setup
+
+
+# GET /<id> con el cliente de pruebas de Flask. Con cached=True el snapshot ya está serializado y
+# se mide solo la lectura; si no, cada petición lee un snapshot nuevo y paga armar el estado y su
+# JSON, como la primera lectura después de cada step. La sesión se crea con un tps muy bajo para
+# que ningún worker la avance durante la medición ni en los benchmarks que siguen
+def benchQueryState(requests = 300, engine = "mesa", cached = True):
+    import api
+    from runner import Snapshot
+
+    def setup():
+        client = api.app.test_client()
+        location = client.post("/", data={"seed": 0, "engine": engine, "tps": 0.001}).headers["Location"]
+        session = api.games.get(location[1:])
+        if(cached):
+            session.snapshot.json
+            snapshots = [session.snapshot] * requests
+        else:
+            snapshots = [session.withModel(lambda model: Snapshot(session.steps, model)) for _ in range(requests)]
+
+        def run():
+            for snapshot in snapshots:
+                session.snapshot = snapshot
+                client.get(location)
+            return requests
+
+        def teardown():
+            client.delete(location)
+        return run, teardown
+    return setup
+
+
+def suite():
+    benchmarks = {
+        "getMove": benchGetMove(),
+        "findStack": benchFindStack(),
+        "floorStep/greedy": benchFloorStep(),
+        "floorStep/bfs": benchFloorStep(estrategia="bfs"),
+        "queryState/mesa/cached": benchQueryState(),
+        "queryState/mesa/first": benchQueryState(cached=False),
+        "queryState/array/cached": benchQueryState(engine="array"),
+        "queryState/array/first": benchQueryState(engine="array", cached=False),
+    }
+    for side, cantidadRobots, cantidadCajas in ((20, 5, 15), (20, 5, 45), (20, 5, 90), (100, 50, 500)):
+        benchmarks[f"completion/mesa/{side}x{side}/{cantidadRobots}robots/{cantidadCajas}cajas"] = benchCompletion(
+            lambda seed, side=side, robots=cantidadRobots, cajas=cantidadCajas: Floor(cajas, None, seed=seed, pasosMaximos=20000,
+                                                                                       cantidadRobots=robots, ancho=side, alto=side))
+    # Con grids grandes limitamos los steps para que una corrida atorada no domine la suite
+    for side, cantidadRobots, cantidadCajas in ((20, 5, 15), (100, 50, 500), (200, 200, 1000)):
+        benchmarks[f"completion/array/{side}x{side}/{cantidadRobots}robots/{cantidadCajas}cajas"] = benchCompletion(
+            lambda seed, side=side, robots=cantidadRobots, cajas=cantidadCajas: ArrayFloor(cajas, None, robots, side, side, seed=seed, pasosMaximos=20000),
+            seeds=1)
+
+    results = {}
+    for name, setup in benchmarks.items():
+        results[name] = measure(setup, repeat=3)
+        print(f"{name:>45}: {results[name]['opsPerSecond']:12.1f} ops/s, "
+              f"{results[name]['peakAllocatedBytes'] / 1024:10.1f} KB reservados, {results[name]['peakRssGrowthKb']} KB más de RSS")
+    return results
+
+
+# Steps por segundo de PartitionedFloor con distintas cantidades de particiones sobre el mismo grid,
+# comparados contra ArrayFloor en un solo proceso
+def benchPartitions(particiones, side = 1000, cantidadRobots = 20000, cantidadCajas = 50000, steps = 50):
+    results = {}
+    for count in [0] + list(particiones):
+        if(count == 0):
+            model = ArrayFloor(cantidadCajas, None, cantidadRobots, side, side, seed=0)
+        else:
+            model = PartitionedFloor(cantidadCajas, None, cantidadRobots, side, side, seed=0, particiones=count)
+        model.step()
+        start = time.perf_counter()
+        for _ in range(steps):
+            model.step()
+        results[count] = steps / (time.perf_counter() - start)
+        if(count > 0):
+            model.close()
+    return results
+
+
+# Regresa los benchmarks cuyo throughput bajó más que threshold (fracción) respecto a baseline
+def findRegressions(results, baseline, threshold = 0.2):
+    regressions = []
+    for name, result in results.items():
+        if(name in baseline and result["opsPerSecond"] < baseline[name]["opsPerSecond"] * (1 - threshold)):
+            regressions.append((name, baseline[name]["opsPerSecond"], result["opsPerSecond"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks de la simulación de robots apiladores")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    strategiesParser = commands.add_parser("estrategias", help="compara las estrategias de movimiento de Floor")
+    strategiesParser.add_argument("--runs", type=int, default=20)
+    strategiesParser.add_argument("--cajas", type=int, default=15)
+
+    suiteParser = commands.add_parser("suite", help="corre todos los benchmarks y guarda los resultados")
+    suiteParser.add_argument("--out", default="benchmark.json")
+    suiteParser.add_argument("--compare", default=None, help="JSON de una corrida anterior contra la cual comparar")
+    suiteParser.add_argument("--threshold", type=float, default=0.2, help="caída de ops/s tolerada antes de marcar regresión")
+    partitionsParser = commands.add_parser("particiones", help="escalamiento de PartitionedFloor con la cantidad de procesos")
+    partitionsParser.add_argument("--particiones", type=int, nargs="+", default=[1, 2, 4, 8])
+    partitionsParser.add_argument("--lado", type=int, default=1000)
+    partitionsParser.add_argument("--robots", type=int, default=20000)
+    partitionsParser.add_argument("--cajas", type=int, default=50000)
+    args = parser.parse_args()
+
+    if(args.command == "estrategias"):
+        for strategy, result in compareStrategies(args.runs, args.cajas).items():
+            print(f"{strategy:>6}: {result['steps']:.1f} steps, {result['totalMoves']:.1f} movimientos, {result['wallTime']*1000:.2f} ms")
+    elif(args.command == "particiones"):
+        results = benchPartitions(args.particiones, args.lado, args.robots, args.cajas)
+        for count, stepsPerSecond in results.items():
+            name = "ArrayFloor" if count == 0 else f"{count} particiones"
+            print(f"{name:>14}: {stepsPerSecond:8.2f} steps/s ({stepsPerSecond / results[0]:.2f}x)")
+    else:
+        results = suite()
+        with open(args.out, "w") as outFile:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, outFile, indent=2)
+
+        if(args.compare is not None):
+            with open(args.compare) as baselineFile:
+                baseline = json.load(baselineFile)["results"]
+            regressions = findRegressions(results, baseline, args.threshold)
+            for name, before, after in regressions:
+                print(f"REGRESIÓN {name}: {before:.1f} -> {after:.1f} ops/s")
+            if(regressions):
+                sys.exit(1)
@@ -0,0 +1,496 @@
+import json
+import mmap
+import os
+import random
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+from model import Floor, Robot, Box, checkBfsSize
+from arraymodel import ArrayFloor, FloorRules, BOX, STACK, LOOSE, STACKED
+from partitioned import PartitionedFloor
+
+# Formato de los checkpoints (versión 1), todo en little-endian:
+#   - encabezado fijo PREAMBLE: magic, versión, motor (Floor o ArrayFloor) y longitud del JSON
+#   - JSON con la configuración, los contadores, el estado del generador aleatorio y la lista de
+#     arreglos (nombre, dtype, shape y offset desde el inicio del archivo)
+#   - los arreglos de NumPy, cada uno alineado a 8 bytes
+# Como los arreglos se leen con np.frombuffer en su offset, un checkpoint se puede cargar desde un
+# mmap sin copiar el archivo completo a memoria.
+# Los checkpoints pueden venir de un cliente (POST /restore), así que antes de crear el modelo se
+# valida todo el encabezado y que los arreglos tengan los nombres, dtypes, formas y valores que
+# espera cada motor; cualquier problema es un CheckpointError.
+# PartitionedFloor no tiene checkpoints: el estado de los generadores de sus tiles vive en otros
+# procesos, así que restaurarlo como ArrayFloor cambiaría de motor sin avisar.
+
+MAGIC = b"BSCK"
+VERSION = 1
+PREAMBLE = struct.Struct("<4sHBxI")
+ALIGNMENT = 8
+
+FLOOR = 0
+ARRAY_FLOOR = 1
+
+
+class CheckpointError(ValueError):
+    pass
+
+
+def dumps(model):
+    checkEngine(model)
+    if(isinstance(model, ArrayFloor)):
+        engine = ARRAY_FLOOR
+        header, arrays = describeArrayFloor(model)
+    else:
+        engine = FLOOR
+        header, arrays = describeFloor(model)
+    return pack(engine, header, arrays)
+
+
+# Junta el preámbulo, el encabezado JSON y los arreglos en los bytes del checkpoint
+def pack(engine, header, arrays):
+    # Calculamos los offsets de los arreglos antes de escribir el JSON que los contiene; como el
+    # JSON cambia de tamaño con los offsets, lo repetimos hasta que el tamaño se estabilice
+    headerLength = 0
+    while(True):
+        offset = align(PREAMBLE.size + headerLength)
+        header["arrays"] = []
+        for name, array in arrays.items():
+            header["arrays"].append({"name": name, "dtype": array.dtype.str, "shape": list(array.shape), "offset": offset})
+            offset = align(offset + array.nbytes)
+        headerBytes = json.dumps(header, separators=(",", ":")).encode()
+        if(len(headerBytes) == headerLength):
+            break
+        headerLength = len(headerBytes)
+
+    buffer = bytearray(offset)
+    PREAMBLE.pack_into(buffer, 0, MAGIC, VERSION, engine, len(headerBytes))
+    buffer[PREAMBLE.size:PREAMBLE.size + len(headerBytes)] = headerBytes
+    for description, array in zip(header["arrays"], arrays.values()):
+        start = description["offset"]
+        buffer[start:start + array.nbytes] = np.ascontiguousarray(array).tobytes()
+    return bytes(buffer)
+
+
+# Con maxCells se rechazan los checkpoints con un grid de más celdas antes de crear el modelo, igual
+# que POST / con MAX_GRID_CELLS
+def loads(buffer, maxCells = None):
+    if(len(buffer) < PREAMBLE.size):
+        raise CheckpointError("El checkpoint está incompleto")
+    magic, version, engine, headerLength = PREAMBLE.unpack_from(buffer, 0)
+    if(magic != MAGIC):
+        raise CheckpointError("El archivo no es un checkpoint de la simulación")
+    if(version != VERSION):
+        raise CheckpointError(f"Versión de checkpoint no soportada: {version}")
+
+    if(engine not in (FLOOR, ARRAY_FLOOR)):
+        raise CheckpointError(f"Motor desconocido en el checkpoint: {engine}")
+
+    header = json.loads(bytes(buffer[PREAMBLE.size:PREAMBLE.size + headerLength]))
+    if(not isinstance(header, dict)):
+        raise CheckpointError("El encabezado del checkpoint no es un objeto")
+    checkGridSize(header, maxCells)
+    checkHeader(engine, header)
+    arrays = {}
+    for description in header["arrays"]:
+        dtype, shape = np.dtype(description["dtype"]), description["shape"]
+        if(description["offset"] + dtype.itemsize * int(np.prod(shape)) > len(buffer)):
+            raise CheckpointError(f"El arreglo {description['name']} pasa del final del checkpoint")
+        arrays[description["name"]] = np.frombuffer(buffer, dtype, int(np.prod(shape)), description["offset"]).reshape(shape)
+    checkArrays(engine, header, arrays)
+
+    if(engine == ARRAY_FLOOR):
+        return restoreArrayFloor(header, arrays)
+    return restoreFloor(header, arrays)
+
+
+# Escribe el checkpoint en un archivo temporal de la misma carpeta y lo mueve sobre path al
+# terminar, para que un error a media escritura (p. ej. el disco lleno) no deje un checkpoint
+# truncado en lugar del anterior
+def save(model, path):
+    data = dumps(model)
+    descriptor, temporaryPath = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as checkpointFile:
+            checkpointFile.write(data)
+            checkpointFile.flush()
+            os.fsync(checkpointFile.fileno())
+        os.replace(temporaryPath, path)
+    except BaseException:
+        os.remove(temporaryPath)
+        raise
+
+
+# Carga un checkpoint de disco leyendo sus arreglos directamente de un mmap del archivo
+def load(path, maxCells = None):
+    with open(path, "rb") as checkpointFile:
+        with mmap.mmap(checkpointFile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return loads(buffer, maxCells)
+
+
+# Copia independiente del modelo en su estado actual, sin pasar por bytes. Con seed se vuelve a
+# sembrar el generador aleatorio para que la copia tome un camino distinto al original, y con
+# estrategia o asignacion (solo Floor) la copia continúa con otra estrategia de movimiento o de
+# asignación de cajas
+def fork(model, seed = None, estrategia = None, asignacion = None):
+    checkEngine(model)
+    if(isinstance(model, ArrayFloor)):
+        header, arrays = describeArrayFloor(model)
+        copy = restoreArrayFloor(header, arrays)
+    else:
+        header, arrays = describeFloor(model)
+        if(estrategia is not None):
+            header["estrategia"] = estrategia
+        if(asignacion is not None):
+            header["asignacion"] = asignacion
+        copy = restoreFloor(header, arrays)
+
+    if(seed is not None):
+        copy.random = np.random.default_rng(seed) if isinstance(copy, ArrayFloor) else type(copy.random)(seed)
+    return copy
+
+
+def checkEngine(model):
+    if(isinstance(model, PartitionedFloor)):
+        raise CheckpointError("Las simulaciones particionadas no se pueden guardar ni copiar")
+
+
+def checkGridSize(header, maxCells):
+    x, y = header.get("ancho"), header.get("alto")
+    if(type(x) is not int or type(y) is not int):
+        raise CheckpointError("El checkpoint no tiene un tamaño de grid válido")
+    if(maxCells is not None and x * y > maxCells):
+        raise CheckpointError(f"El grid de {x}x{y} pasa del máximo de {maxCells} celdas")
+
+
+# Arreglos de cada motor: nombre -> (dtype, forma). En Floor solo se guardan las stacks que ya
+# existen, así que su cantidad (None) puede ir de 0 a amountStacks
+def arrayLayout(engine, header):
+    robots, boxes, stacks = header["cantidadRobots"], header["cantidadCajas"], header["amountStacks"]
+    if(engine == ARRAY_FLOOR):
+        return {
+            "robotPos": ("<i4", [robots, 2]),
+            "robotLast": ("<i4", [robots, 2]),
+            "robotBox": ("<i4", [robots]),
+            "robotTarget": ("<i4", [robots]),
+            "boxPos": ("<i4", [boxes, 2]),
+            "boxState": ("|i1", [boxes]),
+            "boxHeight": ("<f4", [boxes]),
+            "stackPos": ("<i4", [stacks, 2]),
+            "stackCount": ("<i4", [stacks]),
+        }
+    return {
+        "robots": ("<i8", [robots, 8]),
+        "boxes": ("<i8", [boxes, 5]),
+        "boxHeight": ("<f8", [boxes]),
+        "targetBoxes": ("<i8", [robots]),
+        "robotBlocked": ("|b1", [robots]),
+        "stackPos": ("<i4", [None, 2]),
+        "stackCount": ("<i4", [None]),
+    }
+
+# Arreglos que pueden faltar en los checkpoints de versiones anteriores de Floor
+OPTIONAL_ARRAYS = {"targetBoxes", "robotBlocked"}
+
+
+def isInt(value):
+    return type(value) is int
+
+
+def isNumber(value):
+    return type(value) in (int, float)
+
+
+def checkHeader(engine, header):
+    for key in ("cantidadRobots", "cantidadCajas", "amountStacks", "totalMoves", "boxesStacked", "steps"):
+        if(not isInt(header.get(key)) or header[key] < 0):
+            raise CheckpointError(f"{key} debe ser un entero no negativo")
+    capacity = header.get("capacidadStack")
+    if(not isInt(capacity)):
+        raise CheckpointError("capacidadStack debe ser un entero")
+    robots, boxes = header["cantidadRobots"], header["cantidadCajas"]
+    try:
+        FloorRules.checkConfiguration(boxes, robots, header["ancho"], header["alto"], capacity)
+    except ValueError as error:
+        raise CheckpointError(str(error)) from error
+    if(header["amountStacks"] != -(-boxes // capacity)):
+        raise CheckpointError("amountStacks no corresponde a las cajas y la capacidad de las stacks")
+    if(header["boxesStacked"] > boxes):
+        raise CheckpointError("boxesStacked no puede pasar de cantidadCajas")
+    if(header.get("pasosMaximos") is not None and (not isInt(header["pasosMaximos"]) or header["pasosMaximos"] < 0)):
+        raise CheckpointError("pasosMaximos debe ser null o un entero no negativo")
+    if(header.get("tiempoMaximo") is not None and not isNumber(header["tiempoMaximo"])):
+        raise CheckpointError("tiempoMaximo debe ser null o un número")
+    for key in ("running", "simulationStarted"):
+        if(type(header.get(key)) is not bool):
+            raise CheckpointError(f"{key} debe ser true o false")
+    if(not isNumber(header.get("actualTime"))):
+        raise CheckpointError("actualTime debe ser un número")
+
+    if(engine == ARRAY_FLOOR):
+        if(not isInt(header.get("numStacks")) or not 0 <= header["numStacks"] <= header["amountStacks"]):
+            raise CheckpointError("numStacks debe ser un entero entre 0 y amountStacks")
+        try:
+            np.random.default_rng().bit_generator.state = header.get("random")
+        except (TypeError, ValueError, KeyError) as error:
+            raise CheckpointError(f"El estado del generador aleatorio no es válido: {error}")
+    else:
+        if(not isNumber(header.get("time"))):
+            raise CheckpointError("time debe ser un número")
+        if(not isInt(header.get("currentId")) or header["currentId"] < 0):
+            raise CheckpointError("currentId debe ser un entero no negativo")
+        eventCounts = header.get("eventCounts", {})
+        if(not isinstance(eventCounts, dict) or not all(isInt(count) and count >= 0 for count in eventCounts.values())):
+            raise CheckpointError("eventCounts debe ser un objeto con enteros no negativos")
+        state = header.get("random")
+        if(not isinstance(state, list) or len(state) != 3 or not isInt(state[0]) or not isinstance(state[1], list)
+           or not all(isInt(value) for value in state[1]) or not (state[2] is None or isNumber(state[2]))):
+            raise CheckpointError("El estado del generador aleatorio no es válido")
+        try:
+            random.Random().setstate((state[0], tuple(state[1]), state[2]))
+        except (TypeError, ValueError, OverflowError) as error:
+            raise CheckpointError(f"El estado del generador aleatorio no es válido: {error}")
+
+    descriptions = header.get("arrays")
+    if(not isinstance(descriptions, list)):
+        raise CheckpointError("arrays debe ser una lista")
+    layout = arrayLayout(engine, header)
+    names = set()
+    stackCounts = set()
+    for description in descriptions:
+        if(not isinstance(description, dict)):
+            raise CheckpointError("Cada elemento de arrays debe ser un objeto")
+        name = description.get("name")
+        if(name not in layout or name in names):
+            raise CheckpointError(f"Arreglo desconocido o repetido en el checkpoint: {name}")
+        names.add(name)
+        dtype, expected = layout[name]
+        if(description.get("dtype") != dtype):
+            raise CheckpointError(f"El arreglo {name} debe tener dtype {dtype}")
+        shape = description.get("shape")
+        if(not isinstance(shape, list) or len(shape) != len(expected) or not all(isInt(size) and size >= 0 for size in shape)
+           or any(size != wanted for size, wanted in zip(shape, expected) if wanted is not None)):
+            raise CheckpointError(f"La forma del arreglo {name} no corresponde a la configuración del checkpoint")
+        if(None in expected):
+            stackCounts.add(shape[0])
+        if(not isInt(description.get("offset")) or description["offset"] < 0):
+            raise CheckpointError(f"El offset del arreglo {name} debe ser un entero no negativo")
+    missing = set(layout) - OPTIONAL_ARRAYS - names
+    if(missing):
+        raise CheckpointError(f"Faltan arreglos en el checkpoint: {', '.join(sorted(missing))}")
+    if(len(stackCounts) > 1 or any(count > header["amountStacks"] for count in stackCounts)):
+        raise CheckpointError("stackPos y stackCount deben tener la misma cantidad de stacks, como máximo amountStacks")
+
+
+# Las posiciones deben estar dentro del grid y los índices deben apuntar a cajas o stacks que existan
+def checkArrays(engine, header, arrays):
+    x, y = header["ancho"], header["alto"]
+    boxes, capacity = header["cantidadCajas"], header["capacidadStack"]
+
+    def inGrid(name, positions):
+        if(not ((positions[:, 0] >= 0) & (positions[:, 0] < x) & (positions[:, 1] >= 0) & (positions[:, 1] < y)).all()):
+            raise CheckpointError(f"{name} tiene posiciones fuera del grid")
+
+    def inRange(name, values, low, high):
+        if(not ((values >= low) & (values < high)).all()):
+            raise CheckpointError(f"{name} tiene valores fuera del rango [{low}, {high})")
+
+    if(engine == ARRAY_FLOOR):
+        numStacks = header["numStacks"]
+        inGrid("robotPos", arrays["robotPos"])
+        inGrid("boxPos", arrays["boxPos"])
+        inGrid("stackPos", arrays["stackPos"][:numStacks])
+        inRange("robotBox", arrays["robotBox"], -1, boxes)
+        inRange("robotTarget", arrays["robotTarget"], -1, numStacks)
+        inRange("boxState", arrays["boxState"], LOOSE, STACKED + 1)
+        inRange("stackCount", arrays["stackCount"], 0, capacity + 1)
+    else:
+        inGrid("robots", arrays["robots"][:, 1:3])
+        inRange("robots", arrays["robots"][:, 3], -1, boxes)
+        inGrid("boxes", arrays["boxes"][:, 1:3])
+        if("targetBoxes" in arrays):
+            inRange("targetBoxes", arrays["targetBoxes"], -1, boxes)
+        inGrid("stackPos", arrays["stackPos"])
+        inRange("stackCount", arrays["stackCount"], 0, capacity + 1)
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def commonHeader(model):
+    return {
+        "ancho": model.x,
+        "alto": model.y,
+        "cantidadRobots": model.amountRobots,
+        "cantidadCajas": model.amountBoxes,
+        "capacidadStack": model.stackCapacity,
+        "amountStacks": model.amountStacks,
+        "tiempoMaximo": model.maxTime,
+        "pasosMaximos": model.maxSteps,
+        "running": model.running,
+        "totalMoves": model.totalMoves,
+        "boxesStacked": model.boxesStacked,
+        "simulationStarted": model.simulationStarted,
+        "actualTime": model.actualTime,
+    }
+
+
+def restoreCommon(model, header):
+    model.amountRobots = header["cantidadRobots"]
+    model.amountBoxes = header["cantidadCajas"]
+    model.amountStacks = header["amountStacks"]
+    model.running = header["running"]
+    model.totalMoves = header["totalMoves"]
+    model.boxesStacked = header["boxesStacked"]
+    # El tiempo transcurrido sigue contando desde donde se quedó
+    if(header["simulationStarted"]):
+        model.simulationStarted = True
+        model.actualTime = header["actualTime"]
+        model.startTime = time.time() - model.actualTime
+
+
+def describeFloor(model):
+    header = commonHeader(model)
+    version, internalState, gauss = model.random.getstate()
+    header.update({
+        "estrategia": model.strategy,
+        "asignacion": model.assignment,
+        "actualizacion": model.update,
+        "eventCounts": model.events.counts,
+        "steps": model.schedule.steps,
+        "time": model.schedule.time,
+        "currentId": model.current_id,
+        "random": [version, list(internalState), gauss],
+    })
+
+    boxIndex = {box: i for i, box in enumerate(model.boxes)}
+    robots = np.array([
+        (robot.unique_id, robot.pos[0], robot.pos[1], boxIndex[robot.myBox] if robot.myBox is not None else -1,
+         robot.closestStackPos[0], robot.closestStackPos[1], robot.lastPos[0], robot.lastPos[1])
+        for robot in model.schedule.agents
+    ], dtype=np.int64).reshape(-1, 8)
+    boxes = np.array([(box.unique_id, box.pos[0], box.pos[1], box.isMoving, box.isStacked) for box in model.boxes],
+                     dtype=np.int64).reshape(-1, 5)
+
+    arrays = {
+        "robots": robots,
+        "boxes": boxes,
+        "boxHeight": np.array([box.height for box in model.boxes], dtype=np.float64),
+        # Caja asignada por el despachador central a cada robot (-1 si no tiene)
+        "targetBoxes": np.array([boxIndex[robot.targetBox] if robot.targetBox is not None else -1
+                                 for robot in model.schedule.agents], dtype=np.int64),
+        # Robots que perdieron un conflicto en el último step simultáneo
+        "robotBlocked": np.array([robot.blocked for robot in model.schedule.agents], dtype=np.bool_),
+        "stackPos": np.array(list(model.boxStacks.keys()), dtype=np.int32).reshape(-1, 2),
+        "stackCount": np.array(list(model.boxStacks.values()), dtype=np.int32),
+    }
+    return header, arrays
+
+
+def restoreFloor(header, arrays):
+    model = Floor(0, header["tiempoMaximo"], header["estrategia"], None, header["pasosMaximos"],
+                  0, header["ancho"], header["alto"], header["capacidadStack"], asignacion=header.get("asignacion", "aleatoria"),
+                  actualizacion=header.get("actualizacion", "secuencial"))
+    restoreCommon(model, header)
+    # El modelo se creó sin cajas, así que el límite de stacks de bfs se revisa aquí
+    if(model.strategy == "bfs"):
+        checkBfsSize(model.x, model.y, model.amountStacks)
+    model.stackIndex = type(model.stackIndex).forGrid(model.x, model.y, model.amountStacks)
+    model.schedule.steps = header["steps"]
+    model.schedule.time = header["time"]
+
+    version, internalState, gauss = header["random"]
+    model.random.setstate((version, tuple(internalState), gauss))
+
+    for (uniqueId, x, y, isMoving, isStacked), height in zip(arrays["boxes"].tolist(), arrays["boxHeight"].tolist()):
+        box = Box(model, (x, y))
+        box.unique_id = uniqueId
+        box.isMoving = bool(isMoving)
+        box.isStacked = bool(isStacked)
+        box.height = height
+        model.boxes.append(box)
+        model.grid.place_agent(box, box.pos)
+        if(model.distanceFields is not None and not box.isMoving and not box.isStacked):
+            model.distanceFields.blockCell(box.pos)
+
+    # Los robots se agregan al schedule en el mismo orden para que RandomActivation los baraje igual
+    targetBoxes = arrays["targetBoxes"].tolist() if "targetBoxes" in arrays else [-1] * len(arrays["robots"])
+    robotBlocked = arrays["robotBlocked"].tolist() if "robotBlocked" in arrays else [False] * len(arrays["robots"])
+    for (uniqueId, x, y, boxId, closestX, closestY, lastX, lastY), targetId, blocked in zip(arrays["robots"].tolist(), targetBoxes, robotBlocked):
+        robot = Robot(model, (x, y))
+        robot.unique_id = uniqueId
+        robot.myBox = model.boxes[boxId] if boxId >= 0 else None
+        robot.targetBox = model.boxes[targetId] if targetId >= 0 else None
+        robot.closestStackPos = (closestX, closestY)
+        robot.lastPos = (lastX, lastY)
+        robot.blocked = blocked
+        model.robots.append(robot)
+        model.grid.place_agent(robot, robot.pos)
+        model.schedule.add(robot)
+
+    # Las stacks llenas también bloquean el paso aunque ya no tengan campo de distancias
+    for (x, y), count in zip(arrays["stackPos"].tolist(), arrays["stackCount"].tolist()):
+        model.boxStacks[(x, y)] = count
+        if(model.distanceFields is not None):
+            model.distanceFields.blockCell((x, y))
+        if(count < model.stackCapacity):
+            model.stackIndex.add((x, y))
+            if(model.distanceFields is not None):
+                model.distanceFields.addStack((x, y))
+
+    # Los contadores incrementales se recalculan a partir de los agentes
+    model.events.counts.update(header.get("eventCounts", {}))
+    model.idleRobots = sum(1 for robot in model.robots if robot.myBox is None)
+    model.fullStacks = sum(1 for count in model.boxStacks.values() if count >= model.stackCapacity)
+
+    model.current_id = header["currentId"]
+    if(model.dispatcher is not None):
+        model.dispatcher.rebuild()
+    return model
+
+
+def describeArrayFloor(model):
+    header = commonHeader(model)
+    header.update({
+        "steps": model.steps,
+        "numStacks": model.numStacks,
+        "random": model.random.bit_generator.state,
+    })
+    arrays = {
+        "robotPos": model.robotPos,
+        "robotLast": model.robotLast,
+        "robotBox": model.robotBox,
+        "robotTarget": model.robotTarget,
+        "boxPos": model.boxPos,
+        "boxState": model.boxState,
+        "boxHeight": model.boxHeight,
+        "stackPos": model.stackPos,
+        "stackCount": model.stackCount,
+    }
+    return header, arrays
+
+
+def restoreArrayFloor(header, arrays):
+    model = ArrayFloor(0, header["tiempoMaximo"], 0, header["ancho"], header["alto"], header["capacidadStack"],
+                       None, header["pasosMaximos"])
+    restoreCommon(model, header)
+    model.steps = header["steps"]
+    model.numStacks = header["numStacks"]
+    model.random.bit_generator.state = header["random"]
+
+    # Copiamos los arreglos porque el modelo los modifica y los del checkpoint pueden ser de solo lectura
+    for name, array in arrays.items():
+        setattr(model, name, array.copy())
+
+    # Los grids densos no se guardan; se reconstruyen a partir de las posiciones
+    model.robotGrid[model.robotPos[:, 0], model.robotPos[:, 1]] = np.arange(model.amountRobots, dtype=np.int32)
+    loose = np.flatnonzero(model.boxState == LOOSE)
+    model.cellState[model.boxPos[loose, 0], model.boxPos[loose, 1]] = BOX
+    model.boxGrid[model.boxPos[loose, 0], model.boxPos[loose, 1]] = loose
+    stacks = model.stackPos[:model.numStacks]
+    model.cellState[stacks[:, 0], stacks[:, 1]] = STACK
+    model.stackGrid[stacks[:, 0], stacks[:, 1]] = np.arange(model.numStacks, dtype=np.int32)
+    return model
@@ -0,0 +1,97 @@
+import json
+import struct
+
+# Codificación de la simulación como un flujo de frames: primero un snapshot completo y después,
+# por cada step, solo los robots y cajas que cambiaron (posición, hasBox o height) y las stacks
+# nuevas. Hay dos formatos:
+#   - NDJSON: un objeto JSON por línea
+#       {"type": "snapshot", "step": 0, "robots": [[i, x, y, hasBox], ...],
+#        "boxes": [[i, x, y, height], ...], "stacks": [[x, y], ...], "isRunning": true}
+#       {"type": "delta", "step": 1, ...mismos campos, solo con lo que cambió...}
+#       {"type": "events", "step": 1, "events": [...]}  (opcional, los eventos de events.py)
+#   - binario: cada frame va precedido de su longitud (uint32) y empieza con el encabezado
+#       FRAME_HEADER = tipo (0 snapshot, 1 delta), step, #robots, #cajas, #stacks, isRunning
+#     seguido de los registros ROBOT_RECORD, BOX_RECORD y STACK_RECORD. Todo en little-endian.
+#     Las coordenadas van en uint16, así que solo sirve para grids de hasta MAX_BINARY_SIDE de lado.
+
+SNAPSHOT = 0
+DELTA = 1
+
+FRAME_HEADER = struct.Struct("<BIIII?")
+ROBOT_RECORD = struct.Struct("<IHH?")
+BOX_RECORD = struct.Struct("<IHHf")
+STACK_RECORD = struct.Struct("<HH")
+FRAME_LENGTH = struct.Struct("<I")
+
+# Lado más grande de un grid cuyas coordenadas caben en los registros binarios
+MAX_BINARY_SIDE = 65536
+
+
+def robotRecord(robot):
+    return (int(robot["x"]), int(robot["y"]), robot["hasBox"])
+
+
+def boxRecord(box):
+    return (int(box["x"]), int(box["y"]), box["height"])
+
+
+class DeltaEncoder:
+
+    # ancho y alto son los del grid; con binary se revisa que sus coordenadas quepan en los registros
+    def __init__(self, binary = False, ancho = None, alto = None):
+        if(binary and max(ancho or 0, alto or 0) > MAX_BINARY_SIDE):
+            raise ValueError(f"El grid de {ancho}x{alto} es demasiado grande para la codificación binaria")
+        self.binary = binary
+        self.step = 0
+        self.robots = []
+        self.boxes = []
+        self.stackCount = 0
+
+    # Primer frame: el estado completo (el que regresa getState de los modelos)
+    def snapshot(self, state, step = 0):
+        self.step = step
+        self.robots = [robotRecord(robot) for robot in state["robots"]]
+        self.boxes = [boxRecord(box) for box in state["boxes"]]
+        self.stackCount = len(state["stacks"])
+
+        return self.encode(SNAPSHOT, list(enumerate(self.robots)), list(enumerate(self.boxes)),
+                           [(stack["x"], stack["y"]) for stack in state["stacks"]], state["isRunning"])
+
+    # Frames siguientes: solo lo que cambió desde el frame anterior (que puede ser de varios steps atrás)
+    def delta(self, state, step = None):
+        self.step = self.step + 1 if step is None else step
+
+        robots = [robotRecord(robot) for robot in state["robots"]]
+        boxes = [boxRecord(box) for box in state["boxes"]]
+        changedRobots = [(i, robot) for i, (robot, before) in enumerate(zip(robots, self.robots)) if robot != before]
+        changedBoxes = [(i, box) for i, (box, before) in enumerate(zip(boxes, self.boxes)) if box != before]
+        # Las stacks nunca se mueven ni desaparecen, así que solo mandamos las nuevas
+        newStacks = [(stack["x"], stack["y"]) for stack in state["stacks"][self.stackCount:]]
+
+        self.robots = robots
+        self.boxes = boxes
+        self.stackCount = len(state["stacks"])
+
+        return self.encode(DELTA, changedRobots, changedBoxes, newStacks, state["isRunning"])
+
+    # Línea con eventos del último step (solo en NDJSON)
+    def events(self, events):
+        return json.dumps({"type": "events", "step": self.step, "events": events}, separators=(",", ":")) + "\n"
+
+    def encode(self, frameType, robots, boxes, stacks, isRunning):
+        if(self.binary):
+            parts = [FRAME_HEADER.pack(frameType, self.step, len(robots), len(boxes), len(stacks), isRunning)]
+            parts += [ROBOT_RECORD.pack(i, *robot) for i, robot in robots]
+            parts += [BOX_RECORD.pack(i, *box) for i, box in boxes]
+            parts += [STACK_RECORD.pack(*stack) for stack in stacks]
+            frame = b"".join(parts)
+            return FRAME_LENGTH.pack(len(frame)) + frame
+
+        return json.dumps({
+            "type": "snapshot" if frameType == SNAPSHOT else "delta",
+            "step": self.step,
+            "robots": [[i, *robot] for i, robot in robots],
+            "boxes": [[i, *box] for i, box in boxes],
+            "stacks": [list(stack) for stack in stacks],
+            "isRunning": isRunning,
+        }, separators=(",", ":")) + "\n"
@@ -0,0 +1,97 @@
+from stackindex import StackIndex
+
+# Rondas de subasta por step; los robots que pierdan en todas vuelven a pujar en el siguiente step
+AUCTION_ROUNDS = 3
+
+
+# Despachador central para Floor(asignacion="central"). En lugar de que los robots vacíos caminen
+# al azar hasta toparse con una caja y de que los que cargan una caja escojan la stack más cercana
+# sin saber cuántos más van hacia ella, el despachador:
+#   - guarda las cajas sueltas que nadie ha reclamado en un índice espacial y en cada step se las
+#     asigna a los robots libres con una subasta greedy: cada robot puja por su caja más cercana y
+#     cada caja se la queda la puja más corta
+#   - lleva la cuenta de los lugares reservados en cada stack (robots que ya van hacia ella), para
+#     que a un robot solo se le asigne una stack en la que todavía le va a tocar lugar
+# Solo los robots libres consultan el índice, así que el costo por step depende de cuántos robots
+# necesitan tarea y no del total de robots o de cajas.
+class Dispatcher:
+
+    def __init__(self, model):
+        self.model = model
+        self.rebuild()
+
+    # Reconstruye el estado del despachador a partir de los agentes del modelo
+    def rebuild(self):
+        model = self.model
+        claimed = {robot.targetBox for robot in model.robots if robot.targetBox is not None}
+        self.looseAt = {box.pos: box for box in model.boxes if not box.isMoving and not box.isStacked and box not in claimed}
+        self.indexBoxes()
+
+        # Lugares reservados por stack y stacks en las que todavía queda lugar sin reservar
+        self.reserved = {stack: 0 for stack in model.boxStacks}
+        for robot in model.robots:
+            if(robot.myBox is not None and robot.closestStackPos in self.reserved):
+                self.reserved[robot.closestStackPos] += 1
+        self.openStacks = StackIndex.forGrid(model.x, model.y, model.amountStacks)
+        for stack in model.boxStacks:
+            self.updateStack(stack)
+
+    # Índice espacial de las cajas sin reclamar, con cubetas del tamaño adecuado para cuántas quedan
+    def indexBoxes(self):
+        self.looseBoxes = StackIndex.forGrid(self.model.x, self.model.y, max(1, len(self.looseAt)))
+        for pos in self.looseAt:
+            self.looseBoxes.add(pos)
+        self.indexedBoxes = len(self.looseAt)
+
+    # Asigna cajas a los robots que no tienen caja ni una caja asignada
+    def assign(self):
+        if(len(self.looseBoxes) == 0):
+            return
+        # Conforme se reclaman cajas las cubetas se quedan vacías y la búsqueda tiene que revisar más
+        # anillos, así que cuando queda una cuarta parte rehacemos el índice con cubetas más grandes
+        if(len(self.looseBoxes) * 4 <= self.indexedBoxes):
+            self.indexBoxes()
+        idle = [robot for robot in self.model.robots if robot.myBox is None and robot.targetBox is None]
+
+        for _ in range(AUCTION_ROUNDS):
+            if(not idle or len(self.looseBoxes) == 0):
+                return
+            # Cada robot puja por la caja más cercana; gana la puja más corta (desempate por unique_id)
+            bids = []
+            for robot in idle:
+                boxPos = self.looseBoxes.nearest(robot.pos)
+                bids.append(((boxPos[0] - robot.pos[0])**2 + (boxPos[1] - robot.pos[1])**2, robot.unique_id, robot, boxPos))
+            bids.sort(key=lambda bid: bid[:2])
+
+            losers = []
+            for _, _, robot, boxPos in bids:
+                box = self.looseAt.pop(boxPos, None)
+                if(box is None):
+                    losers.append(robot)
+                    continue
+                self.looseBoxes.remove(boxPos)
+                robot.targetBox = box
+            idle = losers
+
+    # Reserva un lugar en la stack con lugar libre más cercana a pos
+    def reserveStack(self, pos):
+        stack = self.openStacks.nearest(pos)
+        if(stack is None):
+            return None
+        self.reserved[stack] += 1
+        self.updateStack(stack)
+        return stack
+
+    def stackCreated(self, stack):
+        self.reserved[stack] = 0
+        self.updateStack(stack)
+
+    # Un robot dejó su caja en la stack: el lugar reservado ya está ocupado
+    def boxStacked(self, stack):
+        self.reserved[stack] -= 1
+
+    def updateStack(self, stack):
+        if(self.model.boxStacks[stack] + self.reserved[stack] < self.model.stackCapacity):
+            self.openStacks.add(stack)
+        else:
+            self.openStacks.remove(stack)
@@ -0,0 +1,89 @@
+import collections
+
+# Eventos que emite Floor mientras avanza:
+#   - boxPicked: un robot recogió una caja suelta
+#   - stackCreated: un robot creó una stack nueva con su caja
+#   - boxStacked: una caja quedó en una stack (también la primera caja de una stack nueva)
+#   - stackFull: una stack llegó a su capacidad
+#   - robotIdle: un robot soltó su caja y se quedó sin tarea
+#   - robotBlocked: un robot no se pudo mover porque sus vecinos estaban ocupados
+BOX_PICKED = "boxPicked"
+STACK_CREATED = "stackCreated"
+BOX_STACKED = "boxStacked"
+STACK_FULL = "stackFull"
+ROBOT_IDLE = "robotIdle"
+ROBOT_BLOCKED = "robotBlocked"
+KINDS = (BOX_PICKED, STACK_CREATED, BOX_STACKED, STACK_FULL, ROBOT_IDLE, ROBOT_BLOCKED)
+
+# Eventos que conserva cada EventLog; un cliente que se atrase más que esto pierde los más viejos
+MAX_EVENTS = 4096
+
+
+class Event:
+    __slots__ = ("kind", "step", "robot", "pos", "box")
+
+    def __init__(self, kind, step, robot, pos, box):
+        self.kind = kind
+        # Step del modelo en el que ocurrió (el que estaba en curso al emitirlo)
+        self.step = step
+        self.robot = robot
+        self.pos = pos
+        self.box = box
+
+
+# Cuenta los eventos de cada tipo y se los pasa a los suscriptores. Las cuentas siempre se llevan
+# (cuestan una suma); los objetos Event solo se crean si alguien está suscrito.
+class EventBus:
+
+    def __init__(self):
+        self.counts = dict.fromkeys(KINDS, 0)
+        self.subscribers = []
+
+    # subscriber es cualquier función que reciba un Event; se llama dentro del step del modelo
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.remove(subscriber)
+
+    def emit(self, kind, step, robot, pos, box = None):
+        self.counts[kind] += 1
+        if(self.subscribers):
+            event = Event(kind, step, robot, pos, box)
+            for subscriber in self.subscribers:
+                subscriber(event)
+
+
+# Suscriptor que guarda los últimos eventos de un modelo con el formato de la API, cada uno con un
+# número de secuencia para que los clientes pidan solo los que no han visto. Los robots y cajas se
+# identifican por su índice en las listas de getState, igual que en los frames del streaming.
+class EventLog:
+
+    def __init__(self, model, maxEvents = MAX_EVENTS):
+        self.robotIndex = {robot: i for i, robot in enumerate(model.robots)}
+        self.boxIndex = {box: i for i, box in enumerate(model.boxes)}
+        self.events = collections.deque(maxlen=maxEvents)
+        # Número de secuencia que le tocará al siguiente evento
+        self.next = 0
+
+    def __call__(self, event):
+        self.events.append({
+            "seq": self.next,
+            "type": event.kind,
+            "step": event.step,
+            "robot": self.robotIndex[event.robot] if event.robot is not None else None,
+            "box": self.boxIndex[event.box] if event.box is not None else None,
+            "x": event.pos[0],
+            "y": event.pos[1],
+        })
+        self.next += 1
+
+    # Eventos con número de secuencia mayor o igual a seq y el número con el que seguir pidiendo
+    def since(self, seq):
+        # Copiar el deque es atómico con el GIL, así que no choca con el step que lo está llenando.
+        # next se calcula con la copia: si lo leyéramos aparte, un evento agregado entre las dos
+        # lecturas quedaría antes de next sin haberse regresado nunca
+        events = list(self.events)
+        next = events[-1]["seq"] + 1 if events else 0
+        return [event for event in events if event["seq"] >= seq], next
@@ -0,0 +1,122 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+# Fases del step de Floor que se miden cuando la instrumentación está activa:
+#   - assign: asignación de cajas del despachador central (si se usa)
+#   - shuffle: barajar el orden de activación de los robots (lo que hace RandomActivation)
+#   - neighborhood: get_neighborhood de cada robot
+#   - decide: Robot.getMove (incluye get_cell_list_contents y las búsquedas de stack)
+#   - findStack: solo las búsquedas de la stack más cercana
+#   - move: move_agent de cada robot
+#   - step: el step completo
+# ArrayFloor evalúa a todos los robots a la vez, así que solo mide step y findStack.
+# En el step simultáneo de Floor, decide es la fase de propuestas y move la de resolución de
+# conflictos con la tabla de reservaciones y la aplicación de los movimientos.
+PHASES = ("assign", "shuffle", "neighborhood", "decide", "findStack", "move", "step")
+
+# Contadores:
+#   - stackSearches: búsquedas de la stack más cercana
+#   - blockedMoves: robots que no se pudieron mover porque sus vecinos estaban ocupados
+#   - idleRobots: robots sin caja al terminar un step (sumados sobre todos los steps)
+COUNTERS = ("stackSearches", "blockedMoves", "idleRobots")
+
+
+# Tiempos por fase y contadores de una simulación. Los modelos solo la usan si se crean con
+# instrumentar=True; si no, su atributo instrumentation es None y el step no mide nada.
+class Instrumentation:
+
+    def __init__(self, profiler = None):
+        self.steps = 0
+        self.phaseTime = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        # SamplingProfiler opcional que muestrea la pila mientras se ejecutan los steps
+        self.profiler = profiler
+
+    def add(self, phase, seconds):
+        self.phaseTime[phase] += seconds
+
+    def count(self, counter, amount = 1):
+        self.counts[counter] += amount
+
+    # Suma los tiempos y contadores de otra instrumentación (p. ej. de una sesión que se eliminó)
+    def merge(self, other):
+        self.steps += other.steps
+        for phase, seconds in other.phaseTime.items():
+            self.phaseTime[phase] = self.phaseTime.get(phase, 0.0) + seconds
+        for counter, amount in other.counts.items():
+            self.counts[counter] = self.counts.get(counter, 0) + amount
+
+    def summary(self):
+        return {
+            "steps": self.steps,
+            "phases": {phase: {"seconds": seconds, "perStep": seconds / self.steps if self.steps else 0.0}
+                       for phase, seconds in self.phaseTime.items()},
+            "counts": dict(self.counts),
+        }
+
+    # Tabla de texto con el resumen, para imprimirla al final de un batch
+    def format(self):
+        lines = [f"{self.steps} steps instrumentados"]
+        total = self.phaseTime["step"] or 1
+        for phase, seconds in self.phaseTime.items():
+            perStep = seconds / self.steps * 1e6 if self.steps else 0.0
+            lines.append(f"{phase:>14}: {seconds:10.4f} s {perStep:10.1f} us/step {seconds / total * 100:6.1f} %")
+        for counter, amount in self.counts.items():
+            lines.append(f"{counter:>14}: {amount}")
+        if(self.profiler is not None):
+            lines.append("funciones más muestreadas:")
+            lines += [f"{samples:8d}  {location}" for location, samples in self.profiler.top(10)]
+        return "\n".join(lines)
+
+
+# Profiler por muestreo: un hilo revisa cada interval segundos qué función está ejecutando cada
+# hilo que esté dentro de un step instrumentado y cuenta las muestras por función. No agrega
+# costo a los steps más allá de registrar el hilo al entrar y salir. El hilo arranca con el primer
+# step, para que crear el profiler al importar la API (también en los procesos de PartitionedFloor,
+# que la vuelven a importar) no deje un hilo despertando cada interval segundos.
+class SamplingProfiler:
+
+    def __init__(self, interval = 0.001):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.threads = set()
+        self.stopped = False
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.started = False
+        self.startLock = threading.Lock()
+
+    def enter(self):
+        if(not self.started):
+            self.start()
+        self.threads.add(threading.get_ident())
+
+    def start(self):
+        with self.startLock:
+            if(not self.started):
+                self.sampler.start()
+                self.started = True
+
+    def exit(self):
+        self.threads.discard(threading.get_ident())
+
+    def sample(self):
+        while(not self.stopped):
+            time.sleep(self.interval)
+            threads = self.threads
+            if(not threads):
+                continue
+            frames = sys._current_frames()
+            for thread in list(threads):
+                frame = frames.get(thread)
+                if(frame is not None):
+                    code = frame.f_code
+                    self.samples[f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"] += 1
+
+    def top(self, count = 10):
+        return self.samples.most_common(count)
+
+    def stop(self):
+        self.stopped = True
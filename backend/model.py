@@ -1,18 +1,55 @@
+import itertools
 import random
 import time
 import math
 
-from mesa import Agent, Model
-from mesa.space import MultiGrid
+import numpy as np
+
+from mesa import Model
 from mesa.time import RandomActivation
 
-class Robot(Agent):
+from sparsegrid import SparseMultiGrid
+from arraymodel import FloorRules
+from stackindex import StackIndex
+from pathplanner import DistanceFields, firstStep, fieldCapacity, MAX_BFS_CELLS
+from recorder import TrajectoryRecorder
+from instrumentation import Instrumentation
+from dispatcher import Dispatcher
+from reservations import ReservationTable
+from events import EventBus, BOX_PICKED, STACK_CREATED, BOX_STACKED, STACK_FULL, ROBOT_IDLE, ROBOT_BLOCKED
+
+# Etiquetas enteras con el tipo de cada agente, para no comparar nombres de clases en cada step
+ROBOT = 0
+BOX = 1
+
+# Acciones que propone un robot en el step simultáneo (ver Robot.propose)
+STAY = 0
+MOVE = 1
+PICK = 2
+CREATE = 3
+DROP = 4
+
+# Los agentes no heredan de mesa.Agent: esa clase no define __slots__, así que cada agente cargaría
+# con un __dict__. Con __slots__ cada instancia solo guarda sus atributos. RandomActivation solo
+# necesita unique_id y step().
+class Robot:
+    __slots__ = ("unique_id", "model", "pos", "myBox", "closestStackPos", "lastPos", "targetBox", "blocked")
+    kind = ROBOT
+
     def __init__(self, model, pos):
-        super().__init__(model.next_id(), model)
+        self.unique_id = model.next_id()
+        self.model = model
         self.pos = pos
         self.myBox = None # Atributo que guarda una caja (agent) en caso de haberla levantado
         self.closestStackPos = (-1,-1) # Atributo que guarda la posición de la stack más cercana
         self.lastPos = self.pos
+        self.targetBox = None # Caja que el despachador central le asignó para recoger (si lo hay)
+        self.blocked = False # En el step simultáneo, True si en el step anterior perdió un conflicto
+
+    # Igual que en mesa.Agent, los robots usan el generador del modelo
+    @property
+    def random(self):
+        return self.model.random
         
     def step(self):
         # Usamos los vecinos de la posición actual considerando las diagonales
@@ -40,13 +77,18 @@ class Robot(Agent):
                     posibleMoves.append(move)
                 for agent in angentsList:
                     # Si la casilla vecina tiene una caja, la recojemos
-                    if(str(type(agent).__name__) == "Box" and not agent.isMoving and not agent.isStacked):
-                        self.myBox = agent
-                        self.myBox.isMoving = True
-                        self.myBox.height = 3.5
-
-                        self.model.grid.move_agent(self.myBox, move)
+                    if(self.canPickUp(agent)):
+                        self.pickUp(agent, move)
                         return move
+
+            # Si tenemos una caja asignada nos acercamos a ella en lugar de caminar al azar
+            if(self.targetBox is not None):
+                move = self.approach(posibleMoves, self.targetBox.pos)
+                if(move == self.pos):
+                    self.model.totalMoves -= 1
+                    self.model.emit(ROBOT_BLOCKED, self, self.pos)
+                return move
+
             try:
                 posibleMoves.remove(self.lastPos)
             except:
@@ -56,52 +98,30 @@ class Robot(Agent):
 
             if(len(posibleMoves) == 0):
                 self.model.totalMoves -= 1
+                self.model.emit(ROBOT_BLOCKED, self, self.pos)
                 return self.pos
 
             return self.random.choice(posibleMoves)
         
         else:
             if(len(self.model.boxStacks) < self.model.amountStacks):
-                self.model.boxStacks[self.myBox.pos] = 1
-                self.myBox.height = 0.0
-                self.myBox.isStacked = True
-                self.myBox = None
-                self.model.boxesStacked += 1
+                self.createStack()
                 return self.random.choice(next_moves)
             
             else:
-                # La función nos regresa la posición de la stack más cercana a nuestra box
-                if(self.closestStackPos[0] == -1 or (self.closestStackPos in self.model.boxStacks and self.model.boxStacks[self.closestStackPos] >= 5)):
-                    self.closestStackPos = self.findStack()
-                
-                bestMove = [10000.0, (0,0)]
-                for move in next_moves:
-                    # Comprobamos que no se quiera pasar sobre una caja o robot
-                    if not (move != self.closestStackPos and len(self.model.grid.get_cell_list_contents(move)) > 0):
-                        distanceTmp = math.sqrt((self.closestStackPos[0]-move[0])**2 + (self.closestStackPos[1]-move[1])**2)
-                        if(distanceTmp < bestMove[0]):
-                            bestMove = [distanceTmp, move]
+                # Comprobamos que no se quiera pasar sobre una caja o robot
+                bestMove = self.bestMoveToStack(next_moves, lambda move: len(self.model.grid.get_cell_list_contents(move)) == 0)
 
                 # Si el siguiente mejor movimiento es la stack que buscamos, ponemos allí la caja y nos olvidamos de ella
                 if(bestMove[0] == 0):
-                    # Ponemos la caja y actiualizamos sus valores
-                    self.model.grid.move_agent(self.myBox, bestMove[1])
-                    self.myBox.isStacked = True
-                    self.myBox.isMoving = False
-                    
-                    # Aumentamos la altura de la caja
-                    self.myBox.height = self.model.boxStacks[bestMove[1]]
-
-                    # Sumamos 1 elemento a dicha stack
-                    self.model.boxStacks[bestMove[1]] += 1
-                    # Aumentamos el número de cajas en stacks
-                    self.model.boxesStacked += 1
-                    
-                    # Reestablecemos la posición del stack más cercano y nos quitamos la caja
-                    self.closestStackPos = (-1,-1)
-                    self.myBox = None
+                    self.stackBox(bestMove[1])
+                    self.model.totalMoves -= 1
+                    return self.pos
 
+                # Si todos los vecinos están ocupados esperamos en nuestro lugar con la caja
+                if(bestMove[0] == math.inf):
                     self.model.totalMoves -= 1
+                    self.model.emit(ROBOT_BLOCKED, self, self.pos)
                     return self.pos
 
                 # Hacemos que la caja se mueva con nosotros
@@ -109,24 +129,217 @@ class Robot(Agent):
                 
                 return bestMove[1]
 
-    # Buscamos la stack más cercana a dicha caja
+    # Con el despachador central solo recogemos la caja que nos asignaron
+    def canPickUp(self, agent):
+        return (agent.kind == BOX and not agent.isMoving and not agent.isStacked and
+                (self.model.dispatcher is None or agent is self.targetBox))
+
+    # Levantamos la caja que está en move (el robot se mueve a esa celda)
+    def pickUp(self, box, move):
+        self.targetBox = None
+        self.myBox = box
+        self.myBox.isMoving = True
+        self.myBox.height = 3.5
+
+        self.model.grid.move_agent(self.myBox, move)
+        if(self.model.distanceFields is not None):
+            self.model.distanceFields.openCell(move)
+        self.model.idleRobots -= 1
+        self.model.emit(BOX_PICKED, self, move, box)
+
+    # Creamos una stack nueva con nuestra caja en nuestra posición actual
+    def createStack(self):
+        box = self.myBox
+        self.model.boxStacks[self.myBox.pos] = 1
+        # Con capacidad 1 la stack nace llena: nadie la va a buscar
+        full = self.model.stackCapacity <= 1
+        if(self.model.distanceFields is not None):
+            self.model.distanceFields.blockCell(self.myBox.pos)
+        if(full):
+            self.model.fullStacks += 1
+        else:
+            self.model.stackIndex.add(self.myBox.pos)
+            if(self.model.distanceFields is not None):
+                self.model.distanceFields.addStack(self.myBox.pos)
+        if(self.model.dispatcher is not None):
+            self.model.dispatcher.stackCreated(self.myBox.pos)
+        self.myBox.height = 0.0
+        self.myBox.isStacked = True
+        self.myBox = None
+        self.model.boxesStacked += 1
+
+        self.model.idleRobots += 1
+        self.model.emit(STACK_CREATED, self, box.pos, box)
+        self.model.emit(BOX_STACKED, self, box.pos, box)
+        if(full):
+            self.model.emit(STACK_FULL, self, box.pos)
+        self.model.emit(ROBOT_IDLE, self, self.pos)
+
+    # Mejor vecino para acercarnos a la stack que buscamos: [distancia, celda]. La stack siempre es
+    # candidata; las demás celdas solo si passable(celda). Si no hay ninguna regresa [inf, posición actual]
+    def bestMoveToStack(self, next_moves, passable):
+        # La función nos regresa la posición de la stack más cercana a nuestra box
+        if(self.closestStackPos[0] == -1 or (self.closestStackPos in self.model.boxStacks and self.model.boxStacks[self.closestStackPos] >= self.model.stackCapacity)):
+            self.closestStackPos = self.findStack()
+
+        bestMove = [math.inf, self.pos]
+        for move in next_moves:
+            if(move == self.closestStackPos or passable(move)):
+                distanceTmp = self.distanceTo(move)
+                if(distanceTmp < bestMove[0]):
+                    bestMove = [distanceTmp, move]
+        return bestMove
+
+    # Ponemos la caja en la stack y actualizamos sus valores
+    def stackBox(self, stackPos):
+        box = self.myBox
+        self.model.grid.move_agent(self.myBox, stackPos)
+        self.myBox.isStacked = True
+        self.myBox.isMoving = False
+
+        # Aumentamos la altura de la caja
+        self.myBox.height = self.model.boxStacks[stackPos]
+
+        # Sumamos 1 elemento a dicha stack
+        self.model.boxStacks[stackPos] += 1
+        if(self.model.dispatcher is not None):
+            self.model.dispatcher.boxStacked(stackPos)
+        # Si la stack se llenó, la sacamos del índice de stacks disponibles
+        full = self.model.boxStacks[stackPos] >= self.model.stackCapacity
+        if(full):
+            self.model.stackIndex.remove(stackPos)
+            if(self.model.distanceFields is not None):
+                self.model.distanceFields.removeStack(stackPos)
+            self.model.fullStacks += 1
+        # Aumentamos el número de cajas en stacks
+        self.model.boxesStacked += 1
+
+        # Reestablecemos la posición del stack más cercano y nos quitamos la caja
+        self.closestStackPos = (-1,-1)
+        self.myBox = None
+
+        self.model.idleRobots += 1
+        self.model.emit(BOX_STACKED, self, stackPos, box)
+        if(full):
+            self.model.emit(STACK_FULL, self, stackPos)
+        self.model.emit(ROBOT_IDLE, self, self.pos)
+
+    # Nos movemos a la celda libre más cercana a target. Si ninguna nos acerca (estamos atorados
+    # detrás de cajas o stacks), buscamos un camino que las rodee con BFS
+    def approach(self, posibleMoves, target):
+        if(len(posibleMoves) == 0):
+            self.lastPos = self.pos
+            return self.pos
+
+        # No regresamos a la celda anterior (si hay otra opción) para no oscilar entre dos celdas
+        if(len(posibleMoves) > 1 and self.lastPos in posibleMoves):
+            posibleMoves.remove(self.lastPos)
+        distance = lambda pos: (pos[0] - target[0])**2 + (pos[1] - target[1])**2
+        bestMove = min(posibleMoves, key=distance)
+        self.lastPos = self.pos
+        if(distance(bestMove) < distance(self.pos)):
+            return bestMove
+        step = firstStep(self.model.grid, self.pos, target)
+        return step if step is not None else bestMove
+
+    # Propuesta del robot para el step simultáneo de Floor (actualizacion="simultanea"). No mueve
+    # ningún agente del grid, que lee tal como quedó en el step anterior: regresa (acción, destino,
+    # caja) y el modelo resuelve los conflictos entre todas las propuestas antes de aplicarlas. Sí
+    # actualiza el estado propio del robot (lastPos, la stack a la que va) y, con el despachador
+    # central, findStack reserva lugar en una stack, así que las propuestas se piden una por una en
+    # el orden de model.robots y no se pueden calcular en paralelo. En lugar de usar el generador
+    # del modelo recibe u, un número aleatorio en [0, 1) para sus decisiones al azar.
+    #   - PICK: moverse a destino y recoger la caja que está ahí
+    #   - MOVE: moverse a destino (con la caja que carga, si tiene)
+    #   - CREATE: crear una stack donde está y moverse a destino (None si no hay a dónde)
+    #   - DROP: dejar la caja en la stack que está en destino
+    #   - STAY: quedarse en su lugar
+    def propose(self, u):
+        next_moves = self.model.grid.get_neighborhood(self.pos, moore=False)
+        # Celdas a las que podría entrar si quien está ahí se mueve en este mismo step
+        passable = [move for move in next_moves if self.passable(move)]
+        # Si perdimos un conflicto en el step anterior, damos un paso al azar para deshacer bloqueos
+        # de frente con otro robot que también quiere pasar por nuestra celda
+        detour = (STAY, self.pos, None) if len(passable) == 0 else (MOVE, passable[int(u * len(passable))], None)
+
+        if(self.myBox is None):
+            for move in next_moves:
+                for agent in self.model.grid.get_cell_list_contents(move):
+                    if(self.canPickUp(agent)):
+                        return (PICK, move, agent)
+
+            if(self.targetBox is not None):
+                if(self.blocked):
+                    self.lastPos = self.pos
+                    return detour
+                move = self.approach(passable, self.targetBox.pos)
+                return (STAY, self.pos, None) if move == self.pos else (MOVE, move, None)
+
+            posibleMoves = [move for move in passable if move != self.lastPos]
+            self.lastPos = self.pos
+            if(len(posibleMoves) == 0):
+                return (STAY, self.pos, None)
+            return (MOVE, posibleMoves[int(u * len(posibleMoves))], None)
+
+        if(len(self.model.boxStacks) < self.model.amountStacks):
+            return (CREATE, detour[1] if detour[0] == MOVE else None, None)
+        if(self.blocked):
+            return detour
+
+        bestMove = self.bestMoveToStack(next_moves, self.passable)
+        if(bestMove[0] == 0):
+            return (DROP, bestMove[1], None)
+        if(bestMove[0] == math.inf):
+            return (STAY, self.pos, None)
+        return (MOVE, bestMove[1], None)
+
+    # Una celda es transitable si solo tiene robots (con o sin caja), que podrían salir de ella. La
+    # primera caja de una stack conserva isMoving, así que también revisamos isStacked
+    def passable(self, move):
+        for agent in self.model.grid.get_cell_list_contents(move):
+            if(agent.kind == BOX and (agent.isStacked or not agent.isMoving)):
+                return False
+        return True
+
+    # Distancia de una celda vecina a la stack que buscamos, según la estrategia del modelo
+    def distanceTo(self, move):
+        # Basta con comparar la distancia al cuadrado, no necesitamos la raíz
+        euclidean = (self.closestStackPos[0]-move[0])**2 + (self.closestStackPos[1]-move[1])**2
+        if(self.model.distanceFields is None):
+            return euclidean
+
+        # Con la estrategia "bfs" usamos los pasos del camino más corto que rodea los obstáculos;
+        # si desde esa celda no hay camino, la dejamos detrás de cualquier celda que sí lo tenga
+        steps = self.model.distanceFields.distance(self.closestStackPos, move)
+        if(steps == math.inf):
+            return self.model.x * self.model.y + euclidean
+        return steps
+
+    # Buscamos la stack más cercana a dicha caja usando el índice de stacks que todavía tienen lugar
     def findStack(self):
-        minDistance = [10000.0, (0,0)]
-        distanceTmp = 0.0
-        for pos, cant in self.model.boxStacks.items():
-            if(cant < 5):
-                # Cálculo de la distancia entre los dos puntos
-                distanceTmp = math.sqrt((pos[0]-self.myBox.pos[0])**2 + (pos[1]-self.myBox.pos[1])**2)
-                if(distanceTmp < minDistance[0]):
-                    minDistance = [distanceTmp, pos]
-        
-        return minDistance[1]
+        instrumentation = self.model.instrumentation
+        # Con el despachador central la stack se reserva para que no se llene antes de que lleguemos
+        search = self.model.stackIndex.nearest if self.model.dispatcher is None else self.model.dispatcher.reserveStack
+        if(instrumentation is None):
+            closest = search(self.myBox.pos)
+        else:
+            start = time.perf_counter()
+            closest = search(self.myBox.pos)
+            instrumentation.add("findStack", time.perf_counter() - start)
+            instrumentation.count("stackSearches")
+        if(closest is None):
+            return (0,0)
+        return closest
             
 
 # Usamos esta clase para definir una Caja 
-class Box(Agent):
-     def __init__(self, model, pos):
-        super().__init__(model.next_id(), model)
+class Box:
+    __slots__ = ("unique_id", "model", "pos", "isMoving", "isStacked", "height")
+    kind = BOX
+
+    def __init__(self, model, pos):
+        self.unique_id = model.next_id()
+        self.model = model
         self.pos = pos
         
         # Atributo que indica si la caja está en movimiento
@@ -138,31 +351,64 @@ class Box(Agent):
         # Atributo que indica la altura a la que se encuentra (necesario para Unity)
         self.height = 0
 
+# La estrategia bfs necesita el grid chico y un campo de distancias por stack en memoria
+def checkBfsSize(ancho, alto, amountStacks):
+    if(ancho * alto > MAX_BFS_CELLS):
+        raise ValueError(f"La estrategia bfs solo admite grids de hasta {MAX_BFS_CELLS} celdas")
+    if(amountStacks > fieldCapacity(ancho * alto)):
+        raise ValueError(f"Con la estrategia bfs un grid de {ancho}x{alto} admite hasta {fieldCapacity(ancho * alto)} stacks, "
+                         f"no {amountStacks}; usa menos cajas, stacks más grandes o la estrategia greedy")
+
+
 class Floor(Model):
 
-    def __init__(self, cantidadCajas = 15, tiempoMaximo = 60):
+    def __init__(self, cantidadCajas = 15, tiempoMaximo = 60, estrategia = "greedy", seed = None, pasosMaximos = None,
+                 cantidadRobots = 5, ancho = 20, alto = 20, capacidadStack = 5, grabacion = None,
+                 instrumentar = False, asignacion = "aleatoria", actualizacion = "secuencial"):
         super().__init__()
+        # Toda la aleatoriedad (posiciones iniciales, orden de activación y movimientos) sale de este
+        # generador, así dos corridas con la misma semilla siguen exactamente la misma trayectoria.
+        # Lo guardamos en la instancia porque Mesa lo asigna a la clase y lo compartirían todos los modelos
+        self._seed = seed
+        self.random = random.Random(seed)
         self.schedule = RandomActivation(self)
 
-        # Establecemos el tamaño del Grid de 20x20
-        self.x = 20
-        self.y = 20
+        # Establecemos el tamaño del Grid (20x20 por defecto)
+        self.x = ancho
+        self.y = alto
 
-        # Usamos un MultiGrid para poder colocar múltiples agentes en una misma celda
-        self.grid = MultiGrid(self.x, self.y, torus=False)
+        FloorRules.checkConfiguration(cantidadCajas, cantidadRobots, ancho, alto, capacidadStack)
+
+        # Usamos un grid en el que caben múltiples agentes por celda; solo guarda las celdas ocupadas
+        # para que su memoria no dependa del tamaño del grid
+        self.grid = SparseMultiGrid(self.x, self.y)
 
         # Creamos el diccionario que guardará en su key la posición de la stack y en su value la cantidad de cajas que tiene dicha stack
         self.boxStacks = {}
         # También creamos la variable que indicará la cantidad de cajas que se han metido en una stack
         self.boxesStacked = 0
 
-        # Declaramos la cantidad de Robots, la cuál está establecida en las instrucciones de la actividad
-        amountRobots = 5
+        # Declaramos la cantidad de Robots (5 por defecto, como en las instrucciones de la actividad)
+        self.amountRobots = cantidadRobots
         # Declaramos el número de cajas en nuestro Grid como atributo de nuestra clase
         self.amountBoxes = cantidadCajas
+        # Cantidad máxima de cajas que caben en una stack
+        self.stackCapacity = capacidadStack
+
+        # Calculamos la cantidad de stacks necesarias para que quepan todas las cajas
+        self.amountStacks = self.amountBoxes // self.stackCapacity + (0 if self.amountBoxes%self.stackCapacity == 0 else 1)
 
-        # Calculamos la cantidad de stacks necesarias para el número de cajas ingresado
-        self.amountStacks = self.amountBoxes // amountRobots + (0 if self.amountBoxes%amountRobots == 0 else 1)
+        # Índice espacial con las stacks que todavía no se llenan, para encontrar la más cercana sin recorrerlas todas
+        self.stackIndex = StackIndex.forGrid(self.x, self.y, self.amountStacks)
+
+        # Estrategia con la que los robots con caja avanzan hacia su stack: "greedy" va en línea recta
+        # y "bfs" sigue el camino más corto con campos de distancia que rodean cajas y stacks
+        if(estrategia not in ("greedy", "bfs")):
+            raise ValueError(f"Estrategia desconocida: {estrategia}")
+        self.strategy = estrategia
+        if(estrategia == "bfs"):
+            checkBfsSize(self.x, self.y, self.amountStacks)
+        self.distanceFields = DistanceFields(self.x, self.y) if estrategia == "bfs" else None
 
         # Variable tipo flag que será True cuando se ejecute el primer step de la simulación
         self.simulationStarted = False
@@ -170,17 +416,33 @@ class Floor(Model):
         # Establecemos el tiempo en el que inicia la simulación
         self.startTime = 0
 
-        # Establecemos el tiempo máximo de la simulación 
+        # Establecemos el tiempo máximo de la simulación (None para no limitarla por tiempo)
         self.maxTime = tiempoMaximo
 
+        # Si se indica una cantidad máxima de steps, la simulación se detiene al alcanzarla sin importar
+        # el tiempo transcurrido, para que el resultado no dependa de la velocidad de la máquina
+        self.maxSteps = pasosMaximos
+
         # Declaramos la variable que nos indica el tiempo actual que lleva la simulación
         self.actualTime = 0
 
         # Reiniciamos el conteo de movimientos en cada llamada al constructor
         self.totalMoves = 0
 
+        # Eventos de lo que pasa en cada step (cajas recogidas y apiladas, stacks nuevas o llenas, robots
+        # sin tarea o bloqueados), para que la API y los demás suscriptores no tengan que comparar estados
+        self.events = EventBus()
+        # Contadores que se actualizan con cada evento en lugar de recorrer robots y stacks
+        self.idleRobots = cantidadRobots
+        self.fullStacks = 0
+
         # Creamos una lista con números aleatorios en el rango de la basura que desea el usuario
-        randomNumsList = random.sample(range(self.x*self.y), self.amountBoxes + amountRobots)
+        # (random.sample sobre un range no construye la lista de todas las celdas)
+        randomNumsList = self.random.sample(range(self.x*self.y), self.amountBoxes + self.amountRobots)
+
+        # Las cajas no hacen nada en su step, así que solo los robots van en el schedule
+        self.robots = []
+        self.boxes = []
 
         count = 0
         # Insertamos la basura iterativamente en posiciones aleatorias
@@ -188,28 +450,255 @@ class Floor(Model):
             posY = i // self.x
             posX = i % self.x
 
-            # Primero creamos los 5 robots
-            if(count < amountRobots):
+            # Primero creamos los robots
+            if(count < self.amountRobots):
                 robot = Robot(self, (posX, posY))
                 self.grid.place_agent(robot, robot.pos)
                 self.schedule.add(robot)
+                self.robots.append(robot)
                 count += 1
             
             # Luego creamos las cajas
             else:
                 box = Box(self, (posX, posY))
-                self.schedule.add(box)
+                self.boxes.append(box)
                 self.grid.place_agent(box, box.pos)
-          
+                if(self.distanceFields is not None):
+                    self.distanceFields.blockCell(box.pos)
+
+        # Con asignacion="central" un despachador reparte las cajas entre los robots libres y reserva
+        # lugar en las stacks; con "aleatoria" los robots buscan cajas caminando al azar
+        if(asignacion not in ("aleatoria", "central")):
+            raise ValueError(f"Asignación desconocida: {asignacion}")
+        self.assignment = asignacion
+        self.dispatcher = Dispatcher(self) if asignacion == "central" else None
+
+        # Con actualizacion="secuencial" los robots se mueven uno por uno en orden aleatorio y cada uno ve
+        # lo que hicieron los anteriores; con "simultanea" todos deciden sobre el mismo estado y una tabla
+        # de reservaciones resuelve los conflictos antes de mover a cualquiera (ver simultaneousStep)
+        if(actualizacion not in ("secuencial", "simultanea")):
+            raise ValueError(f"Actualización desconocida: {actualizacion}")
+        self.update = actualizacion
+
+        # Con instrumentar=True el step mide el tiempo de cada fase y cuenta búsquedas, bloqueos y robots sin caja
+        self.instrumentation = Instrumentation() if instrumentar else None
+
+        # Con grabacion (un directorio) se guarda la trayectoria de cada step para poder reproducirla
+        self.recorder = None
+        if(grabacion is not None):
+            self.recorder = TrajectoryRecorder(grabacion, self.x, self.y, self.amountRobots, self.amountBoxes)
+            # Copia de las posiciones y alturas de las cajas que se actualiza solo con las que cambian
+            self.boxIndex = {box: i for i, box in enumerate(self.boxes)}
+            self.recordedBoxPos = np.array([box.pos for box in self.boxes], dtype=np.int32).reshape(-1, 2)
+            self.recordedBoxHeight = np.zeros(self.amountBoxes, dtype=np.float32)
+            # Cajas que se cargan ahora y las que se soltaron desde el último frame, según los eventos
+            self.carriedBoxes = set()
+            self.droppedBoxes = []
+            self.events.subscribe(self.trackBoxes)
+            self.recordStep()
+
 
     def step(self):
         if(not self.simulationStarted):
             # Declaramos el tiempo de inicio del tiempo como ahora 
             self.startTime = time.time()
             self.simulationStarted = True
-        self.schedule.step()        
+        if(self.update == "simultanea"):
+            self.simultaneousStep()
+        elif(self.instrumentation is None):
+            if(self.dispatcher is not None):
+                self.dispatcher.assign()
+            self.schedule.step()
+        else:
+            self.instrumentedStep()
         self.actualTime = round(time.time() - self.startTime)
 
-        # Si el tiempo actual sobrepasa el tiempo en el que debe terminar la simulación o se apilaron todas las cajas, se detiene la simulación
-        if(self.startTime + self.maxTime < time.time() or self.boxesStacked == self.amountBoxes):
-            self.running = False
\ No newline at end of file
+        # Si se apilaron todas las cajas o se alcanzó el límite de la simulación, se detiene
+        if(self.boxesStacked == self.amountBoxes or self.limitReached()):
+            self.running = False
+
+        if(self.recorder is not None):
+            self.recordStep()
+
+    # Lo mismo que schedule.step() y Robot.step, pero midiendo cada fase por separado
+    def instrumentedStep(self):
+        instrumentation = self.instrumentation
+        profiler = instrumentation.profiler
+        if(profiler is not None):
+            profiler.enter()
+        clock = time.perf_counter
+        stepStart = clock()
+        if(self.dispatcher is not None):
+            self.dispatcher.assign()
+            instrumentation.add("assign", clock() - stepStart)
+
+        shuffleStart = clock()
+        agents = self.schedule._agents
+        keys = list(agents.keys())
+        self.random.shuffle(keys)
+        neighborhoodTime = decideTime = moveTime = 0.0
+        blocked = 0
+        start = clock()
+        instrumentation.add("shuffle", start - shuffleStart)
+
+        for key in keys:
+            robot = agents.get(key)
+            if(robot is None):
+                continue
+            nextMoves = self.grid.get_neighborhood(robot.pos, moore=False)
+            afterNeighborhood = clock()
+            hadBox = robot.myBox is not None
+            nextMove = robot.getMove(nextMoves)
+            afterDecide = clock()
+            # Si se queda en su lugar sin haber dejado una caja es porque no tenía a dónde moverse
+            if(nextMove == robot.pos and hadBox == (robot.myBox is not None)):
+                blocked += 1
+            self.grid.move_agent(robot, nextMove)
+            self.totalMoves += 1
+            end = clock()
+
+            neighborhoodTime += afterNeighborhood - start
+            decideTime += afterDecide - afterNeighborhood
+            moveTime += end - afterDecide
+            start = end
+
+        self.schedule.steps += 1
+        self.schedule.time += 1
+
+        instrumentation.add("neighborhood", neighborhoodTime)
+        instrumentation.add("decide", decideTime)
+        instrumentation.add("move", moveTime)
+        instrumentation.add("step", clock() - stepStart)
+        instrumentation.count("blockedMoves", blocked)
+        instrumentation.count("idleRobots", self.idleRobots)
+        instrumentation.steps += 1
+        if(profiler is not None):
+            profiler.exit()
+
+    # Step en dos fases. Primero cada robot propone su acción viendo el grid del step anterior
+    # (Robot.propose no mueve agentes, pero puede reservar stacks en el despachador), y después se aplican las propuestas en un orden de prioridad
+    # aleatorio: las stacks nuevas y las cajas que se dejan en stacks respetan la cantidad de stacks y
+    # su capacidad, y los movimientos pasan por una ReservationTable que evita que dos robots terminen
+    # en la misma celda o se crucen de frente. Con la misma semilla el resultado es el mismo.
+    def simultaneousStep(self):
+        instrumentation = self.instrumentation
+        profiler = instrumentation.profiler if instrumentation is not None else None
+        if(profiler is not None):
+            profiler.enter()
+        clock = time.perf_counter
+        stepStart = clock()
+        if(self.dispatcher is not None):
+            self.dispatcher.assign()
+        decideStart = clock()
+
+        robots = self.robots
+        draws = [self.random.random() for _ in robots]
+        proposals = [robot.propose(u) for robot, u in zip(robots, draws)]
+        order = list(range(len(robots)))
+        self.random.shuffle(order)
+        commitStart = clock()
+
+        positions = {}
+        moves = {}
+        newStacks = set()
+        for i in order:
+            robot = robots[i]
+            action, target, _ = proposals[i]
+            positions[i] = robot.pos
+            if(action == CREATE):
+                # Si ya se crearon todas las stacks en este step, el robot se queda con su caja
+                if(len(self.boxStacks) < self.amountStacks):
+                    newStacks.add(robot.pos)
+                    robot.createStack()
+                    if(target is not None):
+                        moves[i] = target
+            elif(action == DROP):
+                # Si otro robot con más prioridad llenó la stack, buscará otra en el siguiente step
+                if(self.boxStacks[target] < self.stackCapacity):
+                    robot.stackBox(target)
+            elif(action != STAY):
+                moves[i] = target
+
+        table = ReservationTable(newStacks)
+        winners = table.resolve(positions, moves, order)
+        for i, robot in enumerate(robots):
+            robot.blocked = i in moves and i not in winners
+            if(robot.blocked or proposals[i][0] == STAY):
+                self.emit(ROBOT_BLOCKED, robot, robot.pos)
+        for i in winners:
+            robot = robots[i]
+            action, target, box = proposals[i]
+            self.grid.move_agent(robot, target)
+            if(action == PICK):
+                robot.pickUp(box, target)
+            elif(robot.myBox is not None):
+                self.grid.move_agent(robot.myBox, target)
+        self.totalMoves += len(winners)
+
+        self.schedule.steps += 1
+        self.schedule.time += 1
+
+        if(instrumentation is not None):
+            end = clock()
+            instrumentation.add("assign", decideStart - stepStart)
+            instrumentation.add("decide", commitStart - decideStart)
+            instrumentation.add("move", end - commitStart)
+            instrumentation.add("step", end - stepStart)
+            instrumentation.count("blockedMoves", len(moves) - len(winners))
+            instrumentation.count("idleRobots", self.idleRobots)
+            instrumentation.steps += 1
+        if(profiler is not None):
+            profiler.exit()
+
+    # Emite un evento del step en curso
+    def emit(self, kind, robot, pos, box = None):
+        self.events.emit(kind, self.schedule.steps + 1, robot, pos, box)
+
+    def trackBoxes(self, event):
+        if(event.kind == BOX_PICKED):
+            self.carriedBoxes.add(self.boxIndex[event.box])
+        elif(event.kind == BOX_STACKED):
+            i = self.boxIndex[event.box]
+            self.carriedBoxes.discard(i)
+            self.droppedBoxes.append(i)
+
+    def recordStep(self):
+        # En un step solo cambian las cajas que se cargan y las que se acaban de soltar, así que no hace
+        # falta recorrer todas las cajas
+        for i in itertools.chain(self.carriedBoxes, self.droppedBoxes):
+            self.recordedBoxPos[i] = self.boxes[i].pos
+            self.recordedBoxHeight[i] = self.boxes[i].height
+        self.droppedBoxes.clear()
+
+        self.recorder.record([robot.pos for robot in self.robots], [robot.myBox is not None for robot in self.robots],
+                             self.recordedBoxPos, self.recordedBoxHeight, self.boxStacks, self.running)
+
+    # Con pasosMaximos el límite es la cantidad de steps; si no, el tiempo máximo en segundos
+    def limitReached(self):
+        if(self.maxSteps is not None):
+            return self.schedule.steps >= self.maxSteps
+        return self.maxTime is not None and self.startTime + self.maxTime < time.time()
+
+    # Regresamos el estado de los robots, cajas y stacks con el formato que usa la API
+    def getState(self):
+        return self.stateFromCopy(self.copyState())
+
+    # Copia del estado con solo tuplas, mucho más barata que getState; la API publica una en cada
+    # step y solo arma los diccionarios (con stateFromCopy) si alguien la lee
+    def copyState(self):
+        return (
+            [(agent.pos, agent.myBox is not None) for agent in self.robots],
+            [(agent.pos, agent.height) for agent in self.boxes],
+            list(self.boxStacks.keys()),
+            self.running,
+        )
+
+    @staticmethod
+    def stateFromCopy(copy):
+        robots, boxes, stacks, running = copy
+        return {
+            "robots": [{"x": float(pos[0]), "y": float(pos[1]), "hasBox": hasBox} for pos, hasBox in robots],
+            "boxes": [{"x": float(pos[0]), "y": float(pos[1]), "height": float(height)} for pos, height in boxes],
+            "stacks": [{"x": stack[0], "y": stack[1]} for stack in stacks],
+            "isRunning": running
+        }
@@ -0,0 +1,384 @@
+import multiprocessing
+import threading
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from arraymodel import ArrayFloor, FloorRules, EMPTY, BOX, MOVING
+
+# Versión de ArrayFloor para grids muy grandes en la que el grid se divide en franjas de renglones
+# (tiles) y cada una la avanza un proceso distinto. Todo el estado vive en un bloque de
+# multiprocessing.shared_memory, así que los procesos no se mandan robots ni cajas:
+#   - cada proceso se encarga de los robots que están en su tile al inicio del step; cuando un robot
+#     cruza el borde, en el siguiente step ya aparece en el grid del tile vecino y ese proceso lo
+#     toma (el traspaso es implícito, junto con la caja que carga)
+#   - el halo de un tile son los renglones vecinos de los tiles de al lado: los robots de su tile
+#     los leen para decidir y los robots que están en ellos pueden querer entrar al tile. En lugar
+#     de copiarlos, todos los procesos leen el mismo grid compartido, y las barreras entre fases
+#     garantizan que nadie lo modifica mientras otro lo lee
+# Cada step tiene tres fases separadas por barreras:
+#   1. propose: cada proceso decide la acción y el destino de sus robots con el grid del step anterior
+#   2. resolve: cada proceso resuelve los conflictos de las celdas, cajas y stacks de su tile (entre
+#      sus robots y los de su halo); como cada destino está en un solo tile, nadie más los toca
+#   3. apply: cada proceso mueve a sus robots
+# Entre 1 y 2 el proceso principal crea las stacks que falten, porque el límite de stacks es global;
+# después de crearlas todas esa fase no hace nada. Los contadores de cada tile se suman en el
+# proceso principal al terminar el step, así que totalMoves, boxesStacked y getState siempre
+# corresponden a un step completo.
+# Las reglas son las de ArrayFloor, salvo que la prioridad y los números aleatorios salen del
+# generador de cada tile (la trayectoria depende de la semilla y de la cantidad de particiones) y
+# que un robot con caja que no alcanza a crear stack espera al siguiente step.
+
+# Acciones que propone cada robot en la fase 1
+STAY = 0
+MOVE = 1
+PICK = 2
+CREATE = 3
+DROP = 4
+
+# Comandos del proceso principal para los procesos de los tiles
+RUN = 0
+STOP = 1
+
+# Contadores por tile que se suman al terminar cada step
+MOVES = 0
+DROPPED = 1
+
+ALIGNMENT = 8
+
+# Segundos que el proceso principal espera en cada barrera antes de dar por muerto a un tile
+PHASE_TIMEOUT = 60
+
+
+# Algún proceso de los tiles murió o dejó de responder; el modelo queda detenido
+class TileError(RuntimeError):
+    pass
+
+
+# Arreglos compartidos: nombre -> (forma, dtype)
+def sharedLayout(ancho, alto, cantidadRobots, cantidadCajas, amountStacks, particiones):
+    return {
+        "cellState": ((ancho, alto), np.int8),
+        "robotGrid": ((ancho, alto), np.int32),
+        "boxGrid": ((ancho, alto), np.int32),
+        "stackGrid": ((ancho, alto), np.int32),
+        "robotPos": ((cantidadRobots, 2), np.int32),
+        "robotLast": ((cantidadRobots, 2), np.int32),
+        "robotBox": ((cantidadRobots,), np.int32),
+        "robotTarget": ((cantidadRobots,), np.int32),
+        "boxPos": ((cantidadCajas, 2), np.int32),
+        "boxState": ((cantidadCajas,), np.int8),
+        "boxHeight": ((cantidadCajas,), np.float32),
+        "stackPos": ((amountStacks, 2), np.int32),
+        "stackCount": ((amountStacks,), np.int32),
+        # Propuestas de cada robot en el step actual
+        "priority": ((cantidadRobots,), np.float64),
+        "action": ((cantidadRobots,), np.int8),
+        "destination": ((cantidadRobots, 2), np.int32),
+        "pickBox": ((cantidadRobots,), np.int32),
+        # numStacks y el comando actual, que solo escribe el proceso principal
+        "control": ((2,), np.int64),
+        "counters": ((particiones, 2), np.int64),
+    }
+
+
+# Posición de cada arreglo dentro del bloque compartido y tamaño total del bloque
+def sharedOffsets(layout):
+    offsets = {}
+    offset = 0
+    for name, (shape, dtype) in layout.items():
+        offsets[name] = offset
+        offset += (int(np.prod(shape)) * np.dtype(dtype).itemsize + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    return offsets, offset
+
+
+# Vistas de NumPy de cada arreglo dentro del bloque compartido
+def sharedViews(buffer, layout):
+    offsets, _ = sharedOffsets(layout)
+    return {name: np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offsets[name]) for name, (shape, dtype) in layout.items()}
+
+
+class PartitionedFloor(ArrayFloor):
+
+    def __init__(self, cantidadCajas = 15, tiempoMaximo = 60, cantidadRobots = 5, ancho = 20, alto = 20, capacidadStack = 5, seed = None, pasosMaximos = None, grabacion = None,
+                 instrumentar = False, particiones = None):
+        particiones = particiones or multiprocessing.cpu_count()
+        if(not 1 <= particiones <= ancho):
+            raise ValueError(f"No se puede dividir un grid de {ancho} renglones en {particiones} particiones")
+        # El estado inicial (y el primer frame de la grabación) es el mismo que el de ArrayFloor
+        super().__init__(cantidadCajas, tiempoMaximo, cantidadRobots, ancho, alto, capacidadStack, seed, pasosMaximos, grabacion, instrumentar)
+        self.partitions = particiones
+
+        # Copiamos el estado al bloque compartido y desde aquí el modelo solo usa las vistas
+        layout = sharedLayout(self.x, self.y, self.amountRobots, self.amountBoxes, self.amountStacks, particiones)
+        offsets, size = sharedOffsets(layout)
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        self.shared = sharedViews(self.memory.buf, layout)
+        for name, view in self.shared.items():
+            if(hasattr(self, name)):
+                view[...] = getattr(self, name)
+                setattr(self, name, view)
+        self.shared["control"][:] = (0, RUN)
+        self.shared["counters"][:] = 0
+
+        # Los tiles son franjas de renglones (el primer eje de los grids, contiguo en memoria)
+        bounds = np.linspace(0, self.x, particiones + 1).astype(np.int64).tolist()
+        seeds = np.random.SeedSequence(seed).spawn(particiones)
+        # spawn en lugar de fork: el servidor tiene hilos y un fork los copiaría a medio candado
+        context = multiprocessing.get_context("spawn")
+        self.barrier = context.Barrier(particiones + 1)
+        self.workers = [context.Process(target=runTile, daemon=True,
+                                        args=(self.memory.name, layout, tile, bounds[tile], bounds[tile + 1], self.stackCapacity,
+                                              self.amountStacks, seeds[tile], self.barrier))
+                        for tile in range(particiones)]
+        for worker in self.workers:
+            worker.start()
+        # Si nadie llama a close(), al recolectar el modelo se detienen los procesos y se libera la memoria
+        self.finalizer = weakref.finalize(self, shutdown, self.memory, offsets["control"], self.workers, self.barrier)
+
+    def step(self):
+        super().step()
+        # Al terminar ya no hacen falta los procesos
+        if(not self.running):
+            self.close()
+
+    # Un step completo; ArrayFloor.step se encarga del tiempo, la instrumentación y la grabación
+    def moveRobots(self):
+        if(not all(worker.is_alive() for worker in self.workers)):
+            self.fail("Un proceso de los tiles terminó antes de tiempo")
+        control = self.shared["control"]
+        control[0] = self.numStacks
+        # 1. propose
+        self.sync()
+        self.sync()
+
+        if(self.numStacks < self.amountStacks):
+            self.createProposedStacks()
+            control[0] = self.numStacks
+        # 2. resolve
+        self.sync()
+        self.sync()
+        # 3. apply
+        self.sync()
+
+        counters = self.shared["counters"]
+        self.totalMoves += int(counters[:, MOVES].sum())
+        self.boxesStacked += int(counters[:, DROPPED].sum())
+        counters[:] = 0
+
+        if(self.instrumentation is not None):
+            self.instrumentation.count("idleRobots", int((self.robotBox < 0).sum()))
+
+    # Espera a que todos los tiles terminen la fase actual; si alguno no llega a tiempo (p. ej. porque
+    # su proceso murió) rompe la barrera para liberar a los demás y detiene el modelo
+    def sync(self):
+        try:
+            self.barrier.wait(timeout=PHASE_TIMEOUT)
+        except threading.BrokenBarrierError:
+            dead = [tile for tile, worker in enumerate(self.workers) if not worker.is_alive()]
+            self.fail(f"Los tiles {dead} terminaron antes de tiempo" if dead else f"Los tiles no terminaron la fase en {PHASE_TIMEOUT} segundos")
+
+    # El step quedó a medias: detenemos el modelo y los procesos que queden
+    def fail(self, message):
+        self.barrier.abort()
+        self.close()
+        raise TileError(message)
+
+    # Los robots que propusieron crear una stack la crean por orden de prioridad mientras falten
+    # stacks; los demás se quedan en su lugar con su caja
+    def createProposedStacks(self):
+        action = self.shared["action"]
+        candidates = np.flatnonzero(action == CREATE)
+        if(len(candidates) == 0):
+            return
+        candidates = candidates[np.argsort(self.shared["priority"][candidates], kind="stable")]
+        creators = candidates[:self.amountStacks - self.numStacks]
+        action[candidates[len(creators):]] = STAY
+        self.createStacks(creators)
+        # Los que no tienen a dónde moverse se quedan sobre su stack nueva
+        destination = self.shared["destination"]
+        stays = np.all(destination[creators] == self.robotPos[creators], axis=1)
+        action[creators] = np.where(stays, STAY, MOVE)
+
+    # Detiene los procesos de los tiles y libera la memoria compartida. El modelo se queda con una
+    # copia privada de su estado, así que getState y los checkpoints siguen funcionando
+    def close(self):
+        if(not self.finalizer.alive):
+            return
+        for name, view in self.shared.items():
+            if(hasattr(self, name)):
+                setattr(self, name, view.copy())
+        self.shared = {}
+        self.finalizer()
+        self.running = False
+
+
+def shutdown(memory, controlOffset, workers, barrier):
+    if(any(worker.is_alive() for worker in workers)):
+        control = np.ndarray((2,), dtype=np.int64, buffer=memory.buf, offset=controlOffset)
+        control[1] = STOP
+        del control
+        try:
+            barrier.wait(timeout=5)
+        except threading.BrokenBarrierError:
+            '''Algún proceso ya no responde; lo terminamos abajo'''
+        for worker in workers:
+            worker.join(timeout=5)
+            if(worker.is_alive()):
+                worker.terminate()
+    # Si el modelo se recolectó sin llamar a close() sus vistas todavía pueden existir; el bloque se
+    # desmapea cuando desaparezcan, pero el nombre se libera desde ya
+    try:
+        memory.close()
+    except BufferError:
+        '''Todavía hay vistas del bloque'''
+    memory.unlink()
+
+
+# Ciclo de cada proceso: espera a que el proceso principal inicie un step y ejecuta sus tres fases
+def runTile(name, layout, tile, start, end, stackCapacity, amountStacks, seed, barrier):
+    memory = shared_memory.SharedMemory(name=name)
+    views = sharedViews(memory.buf, layout)
+    worker = Tile(views, tile, start, end, stackCapacity, amountStacks, np.random.default_rng(seed))
+    try:
+        while(True):
+            barrier.wait()
+            if(views["control"][1] == STOP):
+                break
+            worker.propose()
+            barrier.wait()
+            barrier.wait()
+            worker.resolve()
+            barrier.wait()
+            worker.apply()
+            barrier.wait()
+    except threading.BrokenBarrierError:
+        '''El proceso principal abortó el step porque otro tile falló'''
+    del views, worker
+    memory.close()
+
+
+# Estado de un tile; las reglas de los robots son las de ArrayFloor (FloorRules), pero solo para los
+# robots que están en los renglones [start, end)
+class Tile(FloorRules):
+
+    def __init__(self, views, tile, start, end, stackCapacity, amountStacks, random):
+        self.tile = tile
+        self.start = start
+        self.end = end
+        self.stackCapacity = stackCapacity
+        self.amountStacks = amountStacks
+        self.random = random
+        for name, view in views.items():
+            setattr(self, name, view)
+        self.x, self.y = self.cellState.shape
+
+    # Solo el proceso principal crea stacks y publica cuántas hay en control
+    @property
+    def numStacks(self):
+        return int(self.control[0])
+
+    # Robots cuya posición está en los renglones [start, end)
+    def robotsIn(self, start, end):
+        ids = self.robotGrid[max(start, 0):min(end, self.x)]
+        return ids[ids >= 0].astype(np.int64)
+
+    def propose(self):
+        # El grid no cambia hasta la fase 3, así que los robots propios y los del halo se calculan una vez
+        self.owned = owned = self.robotsIn(self.start, self.end)
+        self.halo = np.concatenate((self.robotsIn(self.start - 1, self.start), self.robotsIn(self.end, self.end + 1)))
+        if(len(owned) == 0):
+            return
+        self.priority[owned] = self.random.random(len(owned))
+        self.action[owned] = STAY
+        self.destination[owned] = self.robotPos[owned]
+
+        neighbors, inside, nx, ny, cells, free = self.neighborhood(self.robotPos[owned])
+        carrying = self.robotBox[owned] >= 0
+
+        # Robots vacíos: si tienen una caja suelta al lado la recogen, si no caminan al azar
+        looseBoxes = inside & (cells == BOX) & ~carrying[:, None]
+        pickers, boxIds = self.firstLooseBoxes(looseBoxes, nx, ny)
+        if(len(pickers) > 0):
+            robots = owned[pickers]
+            self.action[robots] = PICK
+            self.pickBox[robots] = boxIds
+            self.destination[robots] = self.boxPos[boxIds]
+
+        walkers = ~carrying
+        walkers[pickers] = False
+        walkers = np.flatnonzero(walkers)
+        if(len(walkers) > 0):
+            robots = owned[walkers]
+            hasMove, moves = self.walkMoves(robots, neighbors[walkers], free[walkers])
+            self.action[robots[hasMove]] = MOVE
+            self.destination[robots[hasMove]] = moves
+
+        carriers = np.flatnonzero(carrying)
+        if(len(carriers) == 0):
+            return
+        robots = owned[carriers]
+        # Mientras falten stacks todos los robots con caja proponen crear una; el proceso principal decide quiénes
+        if(self.numStacks < self.amountStacks):
+            hasMove, moves = self.randomMoves(neighbors[carriers], free[carriers])
+            self.destination[robots[hasMove]] = moves
+            self.action[robots] = CREATE
+            return
+
+        droppers, movers, moves = self.stackMoves(robots, neighbors[carriers], inside[carriers], free[carriers])
+        self.action[droppers] = DROP
+        self.destination[droppers] = self.stackPos[self.robotTarget[droppers]]
+        self.action[movers] = MOVE
+        self.destination[movers] = moves
+
+    # Resolvemos los conflictos de los destinos que están en este tile, entre los robots del tile y
+    # los del halo (un robot solo puede llegar a un vecino, así que nadie más puede competir por ellos)
+    def resolve(self):
+        candidates = np.concatenate((self.owned, self.halo))
+        if(len(candidates) == 0):
+            return
+        destination = self.destination[candidates]
+        here = (destination[:, 0] >= self.start) & (destination[:, 0] < self.end)
+        candidates = candidates[here]
+        action = self.action[candidates]
+        priority = self.priority
+
+        # Si varios robots quieren la misma caja o la misma celda libre, se la queda el de mayor prioridad
+        pickers = candidates[action == PICK]
+        if(len(pickers) > 0):
+            self.action[pickers[~self.firstByKey(self.pickBox[pickers].astype(np.int64), priority[pickers])]] = STAY
+        movers = candidates[action == MOVE]
+        if(len(movers) > 0):
+            cellIds = self.destination[movers, 0].astype(np.int64) * self.y + self.destination[movers, 1]
+            self.action[movers[~self.firstByKey(cellIds, priority[movers])]] = STAY
+
+        droppers = candidates[action == DROP]
+        if(len(droppers) > 0):
+            self.action[droppers] = STAY
+            self.counters[self.tile, DROPPED] += len(self.dropBoxes(droppers, priority))
+
+    # Movemos a los robots del tile; las celdas de destino ya no tienen robots, así que los procesos
+    # nunca escriben en la misma celda aunque un robot cruce al tile vecino
+    def apply(self):
+        owned = self.owned
+        if(len(owned) == 0):
+            return
+        action = self.action[owned]
+
+        pickers = owned[action == PICK]
+        if(len(pickers) > 0):
+            boxes = self.pickBox[pickers]
+            self.cellState[self.boxPos[boxes, 0], self.boxPos[boxes, 1]] = EMPTY
+            self.boxGrid[self.boxPos[boxes, 0], self.boxPos[boxes, 1]] = -1
+            self.boxState[boxes] = MOVING
+            self.boxHeight[boxes] = 3.5
+            self.robotBox[pickers] = boxes
+
+        movers = owned[(action == MOVE) | (action == PICK)]
+        self.robotGrid[self.robotPos[movers, 0], self.robotPos[movers, 1]] = -1
+        self.robotPos[movers] = self.destination[movers]
+        self.robotGrid[self.robotPos[movers, 0], self.robotPos[movers, 1]] = movers
+        loaded = movers[self.robotBox[movers] >= 0]
+        self.boxPos[self.robotBox[loaded]] = self.robotPos[loaded]
+        self.counters[self.tile, MOVES] += len(movers)
@@ -0,0 +1,204 @@
+import heapq
+import math
+from collections import OrderedDict, deque
+
+import numpy as np
+
+# Desplazamientos de la vecindad de Von Neumann
+OFFSETS = ((-1, 0), (0, -1), (0, 1), (1, 0))
+
+# Distancia de las celdas desde las que no se llega a la stack
+UNREACHABLE = np.iinfo(np.int32).max
+
+# Memoria máxima para los campos guardados; si hay más stacks con campo, se descartan los que se
+# consultaron hace más tiempo y se recalculan si alguien los vuelve a pedir
+MAX_FIELD_BYTES = 256 * 1024 * 1024
+
+# Grid más grande (en celdas) con el que se puede usar la estrategia "bfs"
+MAX_BFS_CELLS = 1000000
+
+
+# Cantidad de campos que caben a la vez en MAX_FIELD_BYTES en un grid de cells celdas. La estrategia
+# "bfs" solo se acepta si cabe uno por stack: si no, los campos se descartan y se recalculan con
+# BFS completos en cada step y cada celda que cambia tiene que corregirlos todos
+def fieldCapacity(cells):
+    return MAX_FIELD_BYTES // (cells * np.dtype(np.int32).itemsize)
+
+
+# Campos de distancia (uno por stack disponible) calculados con BFS sobre el grid. Cada campo
+# guarda, para cada celda, cuántos pasos faltan para llegar junto a la stack rodeando cajas y
+# otras stacks, por lo que el siguiente paso de un robot se obtiene consultando a sus vecinos.
+# Los robots no se consideran obstáculos aquí porque se mueven en cada step; quien consulta el
+# campo solo debe descartar las celdas ocupadas en ese momento.
+# Los campos son arreglos int32 y solo se calculan para las stacks que algún robot consulta. Cuando
+# una celda se libera o se bloquea, solo se corrigen las distancias que cambian.
+class DistanceFields:
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        cells = width * height
+        # Celdas por las que no se puede pasar (cajas sueltas y stacks)
+        self.blocked = np.zeros(cells, dtype=np.bool_)
+        # Stacks disponibles y campos ya calculados (del menos al más recientemente consultado)
+        self.stacks = set()
+        self.fields = OrderedDict()
+        self.maxFields = max(1, fieldCapacity(cells))
+
+        # Vecinos de cada celda (-1 fuera del grid), para expandir el BFS con NumPy
+        x = np.arange(cells) % width
+        y = np.arange(cells) // width
+        self.neighborTable = np.full((cells, 4), -1, dtype=np.int32)
+        for k, (dx, dy) in enumerate(OFFSETS):
+            inside = (x + dx >= 0) & (x + dx < width) & (y + dy >= 0) & (y + dy < height)
+            self.neighborTable[inside, k] = ((y + dy) * width + x + dx)[inside]
+
+    def index(self, pos):
+        return pos[1] * self.width + pos[0]
+
+    def neighbors(self, i):
+        x = i % self.width
+        y = i // self.width
+        for dx, dy in OFFSETS:
+            nx = x + dx
+            ny = y + dy
+            if(0 <= nx < self.width and 0 <= ny < self.height):
+                yield ny * self.width + nx
+
+    # Calculamos desde cero el campo de una stack, expandiendo el BFS un nivel a la vez
+    def build(self, stackPos):
+        field = np.full(self.width * self.height, UNREACHABLE, dtype=np.int32)
+        start = self.index(stackPos)
+        field[start] = 0
+        frontier = np.array([start], dtype=np.int32)
+        distance = 0
+        while(len(frontier) > 0):
+            distance += 1
+            candidates = self.neighborTable[frontier].ravel()
+            candidates = candidates[candidates >= 0]
+            candidates = np.unique(candidates[~self.blocked[candidates] & (field[candidates] == UNREACHABLE)])
+            field[candidates] = distance
+            frontier = candidates
+
+        self.fields[stackPos] = field
+        if(len(self.fields) > self.maxFields):
+            self.fields.popitem(last=False)
+        return field
+
+    # Expandimos el BFS desde las celdas de la cola, bajando las distancias que se puedan mejorar
+    def propagate(self, field, queue):
+        blocked = self.blocked
+        while queue:
+            i = queue.popleft()
+            nextDistance = field.item(i) + 1
+            for n in self.neighbors(i):
+                if(not blocked[n] and nextDistance < field.item(n)):
+                    field[n] = nextDistance
+                    queue.append(n)
+
+    def addStack(self, stackPos):
+        self.blockCell(stackPos)
+        self.stacks.add(stackPos)
+
+    # Cuando una stack se llena ya nadie la busca, así que olvidamos su campo
+    def removeStack(self, stackPos):
+        self.stacks.discard(stackPos)
+        self.fields.pop(stackPos, None)
+
+    # Una celda que se libera (p. ej. se recoge una caja) solo puede acortar caminos, así que
+    # basta con relajar los campos a partir de ella
+    def openCell(self, pos):
+        i = self.index(pos)
+        if(not self.blocked[i]):
+            return
+        self.blocked[i] = False
+        for stackPos, field in self.fields.items():
+            if(i == self.index(stackPos)):
+                continue
+            best = min(field.item(n) for n in self.neighbors(i))
+            if(best != UNREACHABLE and best + 1 < field.item(i)):
+                field[i] = best + 1
+                self.propagate(field, deque([i]))
+
+    # Una celda que se bloquea solo alarga los caminos que pasaban por ella
+    def blockCell(self, pos):
+        i = self.index(pos)
+        if(self.blocked[i]):
+            return
+        self.blocked[i] = True
+        for stackPos, field in self.fields.items():
+            if(i != self.index(stackPos)):
+                self.invalidate(field, i)
+
+    # Recalcula las celdas de un campo cuyo camino más corto pasaba por la celda i (recién bloqueada)
+    def invalidate(self, field, i):
+        if(field.item(i) == UNREACHABLE):
+            return
+        # Recorremos por niveles las celdas que dependían de i: una celda a distancia d depende de i si
+        # ninguno de sus vecinos a distancia d - 1 queda fuera de las afectadas. Como la cola va por
+        # niveles, al revisar una celda ya conocemos a todas las afectadas del nivel anterior
+        affected = {i}
+        queue = deque([i])
+        while queue:
+            j = queue.popleft()
+            distance = field.item(j) + 1
+            for n in self.neighbors(j):
+                if(n in affected or field.item(n) != distance):
+                    continue
+                if(any(field.item(m) == distance - 1 and m not in affected for m in self.neighbors(n))):
+                    continue
+                affected.add(n)
+                queue.append(n)
+
+        for j in affected:
+            field[j] = UNREACHABLE
+        # Las afectadas toman la mejor distancia de sus vecinos que no cambiaron y desde ahí se
+        # vuelve a expandir, en orden de distancia
+        heap = []
+        for j in affected:
+            if(self.blocked[j]):
+                continue
+            best = min(field.item(n) for n in self.neighbors(j))
+            if(best != UNREACHABLE):
+                heap.append((best + 1, j))
+        heapq.heapify(heap)
+        while heap:
+            distance, j = heapq.heappop(heap)
+            if(distance >= field.item(j)):
+                continue
+            field[j] = distance
+            for n in self.neighbors(j):
+                if(not self.blocked[n] and distance + 1 < field.item(n)):
+                    heapq.heappush(heap, (distance + 1, n))
+
+    # Distancia (en pasos) de una celda a la stack indicada
+    def distance(self, stackPos, pos):
+        if(stackPos not in self.stacks):
+            return math.inf
+        field = self.fields.get(stackPos)
+        if(field is None):
+            field = self.build(stackPos)
+        else:
+            self.fields.move_to_end(stackPos)
+        steps = field.item(self.index(pos))
+        return math.inf if steps == UNREACHABLE else steps
+
+
+# Primer paso del camino más corto de start hasta una celda vecina de target, pasando solo por
+# celdas vacías del grid. Se usa cuando acercarse en línea recta no funciona (p. ej. el robot quedó
+# en un hueco entre stacks), así que explora como máximo limit celdas; regresa None si no lo encuentra
+def firstStep(grid, start, target, limit = 4096):
+    parents = {start: None}
+    queue = deque([start])
+    while queue and len(parents) < limit:
+        pos = queue.popleft()
+        for neighbor in grid.get_neighborhood(pos, moore=False):
+            if(neighbor == target):
+                # Regresamos por el camino hasta el paso que sale de start
+                while(parents[pos] is not None and parents[pos] != start):
+                    pos = parents[pos]
+                return pos if pos != start else None
+            if(neighbor not in parents and grid.is_cell_empty(neighbor)):
+                parents[neighbor] = pos
+                queue.append(neighbor)
+    return None
@@ -0,0 +1,161 @@
+import bisect
+import json
+import os
+
+import numpy as np
+
+# Grabación de trayectorias en un directorio con un archivo binario por columna, a los que solo
+# se les agregan datos al final:
+#   - meta.json: dimensiones del grid, cantidad de robots y cajas, y dtype/ancho de cada columna
+#   - robotX, robotY, robotHasBox, boxX, boxY, boxHeight, running: un renglón por frame (el frame 0
+#     es el estado inicial y el frame k el estado después de k steps) con un valor por agente
+#   - stacks: un renglón (frame, x, y) por cada stack nueva; las stacks nunca se mueven, así que
+#     no hace falta repetirlas en cada frame
+# Los frames se acumulan en memoria y se escriben por bloques de chunkSteps, así que grabar un
+# step solo cuesta copiar las posiciones. Los archivos solo se abren mientras se escribe un bloque,
+# para que cada simulación que se graba no tenga un descriptor abierto por columna todo el tiempo. Para leer se usa np.memmap: consultar un frame solo
+# toca las páginas de ese renglón, sin cargar la trayectoria completa.
+
+VERSION = 1
+
+COLUMNS = {
+    "robotX": ("u2", "cantidadRobots"),
+    "robotY": ("u2", "cantidadRobots"),
+    "robotHasBox": ("?", "cantidadRobots"),
+    "boxX": ("u2", "cantidadCajas"),
+    "boxY": ("u2", "cantidadCajas"),
+    "boxHeight": ("<f4", "cantidadCajas"),
+    "running": ("?", None),
+}
+STACKS = "stacks"
+STACK_DTYPE = np.dtype("<i4")
+
+
+class TrajectoryRecorder:
+
+    def __init__(self, path, ancho, alto, cantidadRobots, cantidadCajas, chunkSteps = 64):
+        if(max(ancho, alto) > np.iinfo(np.uint16).max + 1):
+            raise ValueError(f"El grid de {ancho}x{alto} es demasiado grande para grabarse")
+
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunkSteps = chunkSteps
+        self.frames = 0
+        self.stackCount = 0
+        self.closed = False
+
+        meta = {"version": VERSION, "ancho": ancho, "alto": alto, "cantidadRobots": cantidadRobots,
+                "cantidadCajas": cantidadCajas, "columns": {}}
+        for name, (dtype, width) in COLUMNS.items():
+            meta["columns"][name] = {"dtype": np.dtype(dtype).str, "width": meta[width] if width else 1}
+        with open(os.path.join(path, "meta.json"), "w") as metaFile:
+            json.dump(meta, metaFile)
+
+        # Creamos las columnas vacías para que la grabación se pueda leer desde el primer bloque
+        for name in [*COLUMNS, STACKS]:
+            open(os.path.join(path, name), "wb").close()
+        # Frames y stacks que todavía no se escriben
+        self.pending = []
+        self.pendingStacks = []
+
+    # Agrega el frame actual. stacks son las posiciones de todas las stacks en el orden en que se
+    # crearon; solo se guardan las que no estaban en el frame anterior
+    def record(self, robotPos, robotHasBox, boxPos, boxHeight, stacks, running):
+        # np.array siempre copia: el modelo sigue modificando sus arreglos después de grabarlos. Las
+        # columnas se separan hasta escribir el bloque, para que grabar un frame cueste lo mínimo
+        self.pending.append((np.array(robotPos, dtype=np.uint16), np.array(robotHasBox, dtype=np.bool_),
+                             np.array(boxPos, dtype=np.uint16), np.array(boxHeight, dtype=np.float32), running))
+
+        if(len(stacks) > self.stackCount):
+            for x, y in list(stacks)[self.stackCount:]:
+                self.pendingStacks.append((self.frames, x, y))
+            self.stackCount = len(stacks)
+
+        self.frames += 1
+        # Al terminar la simulación ya no habrá más frames
+        if(not running):
+            self.close()
+        elif(len(self.pending) >= self.chunkSteps):
+            self.flush()
+
+    def flush(self):
+        if(self.pending):
+            robotPos, robotHasBox, boxPos, boxHeight, running = zip(*self.pending)
+            robotPos = np.stack(robotPos).reshape(len(self.pending), -1, 2)
+            boxPos = np.stack(boxPos).reshape(len(self.pending), -1, 2)
+            columns = {
+                "robotX": robotPos[:, :, 0],
+                "robotY": robotPos[:, :, 1],
+                "robotHasBox": np.stack(robotHasBox),
+                "boxX": boxPos[:, :, 0],
+                "boxY": boxPos[:, :, 1],
+                "boxHeight": np.stack(boxHeight),
+                "running": np.array(running, dtype=np.bool_),
+            }
+            for name, column in columns.items():
+                self.append(name, np.ascontiguousarray(column).tobytes())
+            self.pending.clear()
+
+        if(self.pendingStacks):
+            self.append(STACKS, np.array(self.pendingStacks, dtype=STACK_DTYPE).tobytes())
+            self.pendingStacks.clear()
+
+    def append(self, name, data):
+        with open(os.path.join(self.path, name), "ab") as recordFile:
+            recordFile.write(data)
+
+    def close(self):
+        if(not self.closed):
+            self.flush()
+            self.closed = True
+
+
+# Lectura de una grabación. Se puede abrir mientras se sigue grabando; refresh() vuelve a
+# mapear los archivos para ver los frames escritos después
+class TrajectoryReader:
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as metaFile:
+            self.meta = json.load(metaFile)
+        if(self.meta["version"] != VERSION):
+            raise ValueError(f"Versión de grabación no soportada: {self.meta['version']}")
+        self.path = path
+        self.refresh()
+
+    def __len__(self):
+        return self.frames
+
+    def refresh(self):
+        # Un bloque se escribe columna por columna, así que solo contamos los frames completos en todas
+        self.frames = min(os.path.getsize(os.path.join(self.path, name)) // (np.dtype(column["dtype"]).itemsize * column["width"])
+                          for name, column in self.meta["columns"].items())
+        self.columns = {name: self.map(name, column["dtype"], (self.frames, column["width"]))
+                        for name, column in self.meta["columns"].items()}
+        stackCount = os.path.getsize(os.path.join(self.path, STACKS)) // (STACK_DTYPE.itemsize * 3)
+        self.stacks = self.map(STACKS, STACK_DTYPE, (stackCount, 3))
+        self.stackFrames = self.stacks[:, 0].tolist()
+
+    def map(self, name, dtype, shape):
+        # np.memmap no puede mapear archivos vacíos
+        if(0 in shape):
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode="r", shape=shape)
+
+    # Estado del frame con el mismo formato que getState de los modelos
+    def frame(self, index):
+        if(not 0 <= index < self.frames):
+            raise IndexError(f"La grabación solo tiene {self.frames} frames")
+        columns = self.columns
+        robots = [{"x": float(x), "y": float(y), "hasBox": hasBox} for x, y, hasBox in
+                  zip(columns["robotX"][index].tolist(), columns["robotY"][index].tolist(), columns["robotHasBox"][index].tolist())]
+        boxes = [{"x": float(x), "y": float(y), "height": height} for x, y, height in
+                 zip(columns["boxX"][index].tolist(), columns["boxY"][index].tolist(), columns["boxHeight"][index].tolist())]
+        stackCount = bisect.bisect_right(self.stackFrames, index)
+        stacks = [{"x": x, "y": y} for _, x, y in self.stacks[:stackCount].tolist()]
+
+        return {
+            "robots": robots,
+            "boxes": boxes,
+            "stacks": stacks,
+            "isRunning": bool(columns["running"][index, 0]),
+        }
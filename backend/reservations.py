@@ -0,0 +1,49 @@
+# Tabla de reservaciones espacio-tiempo para el step en dos fases de Floor. Cada robot propone a
+# qué celda quiere ir en el siguiente instante (t+1) y la tabla decide quién se mueve:
+#   - conflicto de vértice: dos robots quieren la misma celda en t+1, se la queda el de mayor
+#     prioridad (el que aparece primero en order)
+#   - conflicto de arista (intercambio): dos robots quieren cruzarse de frente entre las mismas
+#     dos celdas; ninguno de los dos se mueve
+#   - celdas ocupadas en t+1: un robot que se queda en su lugar (porque no quería moverse o
+#     porque perdió un conflicto) sigue ocupando su celda, así que quien quería entrar en ella
+#     tampoco se mueve; esto se propaga hasta que ya no cambia nada
+#   - celdas bloqueadas: celdas en las que en este step aparece un obstáculo (p. ej. una stack nueva)
+# Un robot sí puede entrar a la celda que otro robot deja libre en el mismo step (seguirlo), y las
+# rotaciones de 3 o más robots son válidas porque nadie se cruza de frente.
+class ReservationTable:
+
+    def __init__(self, blocked = ()):
+        self.blocked = set(blocked)
+        # Celda reservada en t+1 -> robot que la reservó
+        self.vertices = {}
+        # Aristas (origen, destino) reservadas entre t y t+1
+        self.edges = set()
+        self.conflicts = 0
+
+    # positions: posición en t de todos los robots; moves: destino de los robots que quieren moverse;
+    # order: robots en orden de prioridad. Regresa el conjunto de robots que sí se mueven
+    def resolve(self, positions, moves, order):
+        winners = set()
+        for robot in order:
+            if(robot not in moves):
+                continue
+            origin = positions[robot]
+            target = moves[robot]
+            if(target in self.blocked or target in self.vertices or (target, origin) in self.edges):
+                self.conflicts += 1
+                continue
+            self.vertices[target] = robot
+            self.edges.add((origin, target))
+            winners.add(robot)
+
+        # Quien se queda en su celda la sigue ocupando en t+1: si un robot que sí se movía la había
+        # reservado, pierde su movimiento y a su vez se queda en su celda
+        staying = [robot for robot in positions if robot not in winners]
+        while(staying):
+            robot = staying.pop()
+            mover = self.vertices.get(positions[robot])
+            if(mover is not None and mover != robot and mover in winners):
+                winners.remove(mover)
+                self.conflicts += 1
+                staying.append(mover)
+        return winners
@@ -0,0 +1,330 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+from instrumentation import Instrumentation
+from events import EventLog, KINDS
+from partitioned import PartitionedFloor, TileError
+
+logger = logging.getLogger(__name__)
+
+# Estado de la simulación en un step. Nadie lo modifica después de publicarlo, así que cualquier
+# cantidad de lectores lo puede usar sin candados. Se publica la copia barata del modelo
+# (copyState) y el estado con el formato de la API y su JSON se generan una sola vez, la primera
+# vez que alguien los pide.
+class Snapshot:
+
+    def __init__(self, step, model):
+        self.step = step
+        self.copy = model.copyState()
+        self.build = model.stateFromCopy
+        self._state = None
+        self._json = None
+
+    @property
+    def state(self):
+        if(self._state is None):
+            self._state = self.build(self.copy)
+        return self._state
+
+    @property
+    def json(self):
+        if(self._json is None):
+            self._json = json.dumps(self.state, separators=(",", ":")).encode()
+        return self._json
+
+
+# Libera lo que un modelo tiene abierto fuera del proceso
+def closeModel(model):
+    # Escribimos lo que falte de la grabación para que se pueda reproducir completa
+    if(model.recorder is not None):
+        model.recorder.close()
+    # PartitionedFloor tiene procesos y memoria compartida que hay que liberar
+    if(isinstance(model, PartitionedFloor)):
+        model.close()
+
+
+# Una simulación hospedada por el servidor. La avanzan los workers de SessionManager a un ritmo
+# fijo de steps por segundo (o tan rápido como se pueda si ticksPerSecond es 0/None) y después de
+# cada step publica un Snapshot nuevo; las lecturas solo toman el último snapshot publicado, así
+# que su costo no depende de cuántos observadores haya ni de lo que tarde un step.
+class Session:
+
+    def __init__(self, id, model, ticksPerSecond = 5):
+        self.id = id
+        self.model = model
+        self.interval = 1 / ticksPerSecond if ticksPerSecond else 0
+        self.steps = 0
+        self.snapshot = Snapshot(0, model)
+        self.closed = False
+        self.lastAccess = time.monotonic()
+        self.nextTick = time.perf_counter()
+        # Solo la usan quienes quieren esperar un step nuevo (p. ej. el streaming)
+        self.newStep = threading.Condition()
+        # Protege al modelo mientras se avanza o se copia (checkpoints y forks)
+        self.modelLock = threading.Lock()
+        # Últimos eventos del modelo, para /<id>/events y el streaming (None si el motor no emite eventos)
+        self.events = None
+        if(model.events is not None):
+            self.events = model.events.subscribe(EventLog(model))
+
+    # Marcamos la sesión como usada (para la expiración por inactividad)
+    def touch(self):
+        self.lastAccess = time.monotonic()
+
+    def step(self):
+        try:
+            with self.modelLock:
+                # Un worker pudo tomar la sesión justo antes de que se cerrara o de que /advance la
+                # terminara mientras esperaba el candado
+                if(self.closed or not self.model.running):
+                    return
+                self.model.step()
+                self.steps += 1
+                self.snapshot = Snapshot(self.steps, self.model)
+        finally:
+            # También si el step falló, para que quien espera vea que la sesión terminó
+            with self.newStep:
+                self.newStep.notify_all()
+
+    # Avanza hasta steps steps seguidos (o hasta que termine la simulación) sin esperar los ticks y
+    # publica el estado final. Con every=k también llama a sample(step, model) cada k steps, con el
+    # modelo bloqueado, para que quien llama procese el estado sin guardar todos los muestreados.
+    # Regresa los steps que avanzó y el tiempo que tardó
+    def advance(self, steps, every = None, sample = None):
+        try:
+            with self.modelLock:
+                start = time.perf_counter()
+                count = 0
+                while(count < steps and self.model.running and not self.closed):
+                    self.model.step()
+                    count += 1
+                    self.steps += 1
+                    if(every and count % every == 0):
+                        sample(self.steps, self.model)
+                wallTime = time.perf_counter() - start
+                if(count > 0):
+                    self.snapshot = Snapshot(self.steps, self.model)
+        finally:
+            with self.newStep:
+                self.newStep.notify_all()
+        return count, wallTime
+
+    # Un step falló: detenemos el modelo y publicamos su estado para que los lectores vean que terminó
+    def stop(self):
+        with self.modelLock:
+            self.model.running = False
+            self.snapshot = Snapshot(self.steps, self.model)
+        with self.newStep:
+            self.newStep.notify_all()
+
+    # Corre fn(model) sin que un worker avance el modelo al mismo tiempo
+    def withModel(self, fn):
+        with self.modelLock:
+            return fn(self.model)
+
+    def close(self):
+        self.closed = True
+        with self.modelLock:
+            closeModel(self.model)
+        with self.newStep:
+            self.newStep.notify_all()
+
+    @property
+    def finished(self):
+        return not self.model.running or self.closed
+
+    # Espera hasta que se publique un snapshot posterior a step (o hasta timeout) y regresa el último
+    def waitForStep(self, step, timeout = None):
+        with self.newStep:
+            self.newStep.wait_for(lambda: self.snapshot.step > step or self.finished, timeout)
+        return self.snapshot
+
+
+class SessionLimitError(Exception):
+    pass
+
+
+# Hospeda muchas sesiones en un proceso. Un grupo fijo de hilos avanza las sesiones según el
+# momento en que les toca su siguiente step (una cola de prioridad), en lugar de un hilo por
+# sesión. Las sesiones sin accesos por más de idleTimeout segundos se eliminan, y al llegar a
+# maxSessions se eliminan primero las terminadas que llevan más tiempo sin usarse.
+class SessionManager:
+
+    def __init__(self, workers = None, maxSessions = 1000, idleTimeout = 600, evictInterval = 10, onRemove = None):
+        self.maxSessions = maxSessions
+        self.idleTimeout = idleTimeout
+        # Función que recibe cada sesión eliminada (con DELETE o por expiración) después de cerrarla
+        self.onRemove = onRemove
+        self.sessions = {}
+        self.createdTotal = 0
+        self.evictedTotal = 0
+        # Tiempos y contadores acumulados de las sesiones instrumentadas que ya se eliminaron
+        self.retiredInstrumentation = Instrumentation()
+        # Eventos de cada tipo que emitieron las sesiones que ya se eliminaron
+        self.retiredEvents = dict.fromkeys(KINDS, 0)
+        # Sesiones eliminadas que falta cerrar; se cierran después de soltar el candado porque
+        # cerrar una sesión espera a que termine su step en curso
+        self.evicted = []
+
+        # Cola de (siguiente tick, desempate, sesión) con las sesiones que siguen corriendo
+        self.queue = []
+        self.counter = itertools.count()
+        self.lock = threading.Condition()
+        self.stopped = False
+
+        # Los hilos arrancan con la primera sesión, para que importar la API (p. ej. desde un proceso
+        # de PartitionedFloor o de un batch) no deje hilos corriendo
+        self.workers = [threading.Thread(target=self.work, daemon=True) for _ in range(workers or os.cpu_count())]
+        self.janitor = threading.Thread(target=self.evictLoop, args=(evictInterval,), daemon=True)
+        self.started = False
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def create(self, id, model, ticksPerSecond = 5):
+        try:
+            with self.lock:
+                self.evictIdle()
+                if(len(self.sessions) >= self.maxSessions and not self.evictLeastRecentlyUsed()):
+                    raise SessionLimitError(f"Se alcanzó el máximo de {self.maxSessions} simulaciones")
+
+                if(not self.started):
+                    for thread in self.workers + [self.janitor]:
+                        thread.start()
+                    self.started = True
+                session = Session(id, model, ticksPerSecond)
+                self.sessions[id] = session
+                self.createdTotal += 1
+                self.schedule(session)
+        finally:
+            self.closeEvicted()
+        return session
+
+    # Regresa la sesión (o None si no existe) sin tomar ningún candado
+    def get(self, id):
+        session = self.sessions.get(id)
+        if(session is not None):
+            session.touch()
+        return session
+
+    def delete(self, id):
+        with self.lock:
+            session = self.sessions.pop(id, None)
+            if(session is not None):
+                self.retire(session)
+        if(session is not None):
+            self.closeRemoved(session)
+        return session is not None
+
+    def closeRemoved(self, session):
+        session.close()
+        if(self.onRemove is not None):
+            self.onRemove(session)
+
+    # Conservamos las métricas de una sesión que se elimina (se llama con el candado tomado)
+    def retire(self, session):
+        if(session.model.instrumentation is not None):
+            self.retiredInstrumentation.merge(session.model.instrumentation)
+        if(session.model.events is not None):
+            for kind, count in session.model.events.counts.items():
+                self.retiredEvents[kind] += count
+
+    # Suma de la instrumentación de las sesiones activas y de las que ya se eliminaron
+    def instrumentation(self):
+        total = Instrumentation()
+        with self.lock:
+            total.merge(self.retiredInstrumentation)
+            for session in self.sessions.values():
+                if(session.model.instrumentation is not None):
+                    total.merge(session.model.instrumentation)
+        return total
+
+    # Eventos de cada tipo emitidos por las sesiones activas y por las que ya se eliminaron
+    def eventCounts(self):
+        with self.lock:
+            total = dict(self.retiredEvents)
+            for session in self.sessions.values():
+                if(session.model.events is not None):
+                    for kind, count in session.model.events.counts.items():
+                        total[kind] += count
+        return total
+
+    def schedule(self, session):
+        heapq.heappush(self.queue, (session.nextTick, next(self.counter), session))
+        self.lock.notify()
+
+    # Ciclo de cada worker: toma la sesión a la que le toca su siguiente step, la avanza y la
+    # vuelve a formar. Mientras un worker la avanza no está en la cola, así que nadie más la toca.
+    def work(self):
+        while(True):
+            with self.lock:
+                while(not self.stopped and (not self.queue or self.queue[0][0] > time.perf_counter())):
+                    timeout = self.queue[0][0] - time.perf_counter() if self.queue else None
+                    self.lock.wait(timeout)
+                if(self.stopped):
+                    return
+                _, _, session = heapq.heappop(self.queue)
+
+            if(session.finished):
+                continue
+            try:
+                session.step()
+            except TileError:
+                '''El modelo ya quedó detenido, así que la sesión no se vuelve a formar'''
+            except Exception:
+                # Cualquier otro error (p. ej. un OSError de la grabación) detiene solo a esta sesión;
+                # el worker sigue atendiendo a las demás
+                logger.exception("Falló el step de la sesión %s", session.id)
+                session.stop()
+
+            if(not session.finished):
+                # Si vamos atrasados no intentamos recuperar los ticks perdidos; las sesiones sin ritmo
+                # fijo se vuelven a formar al final para no acaparar a los workers
+                session.nextTick = max(session.nextTick + session.interval, time.perf_counter())
+                with self.lock:
+                    self.schedule(session)
+
+    def evictLoop(self, interval):
+        while(not self.stopped):
+            time.sleep(interval)
+            with self.lock:
+                self.evictIdle()
+            self.closeEvicted()
+
+    # Elimina las sesiones sin accesos por más de idleTimeout segundos (se llama con el candado tomado)
+    def evictIdle(self):
+        limit = time.monotonic() - self.idleTimeout
+        for id in [id for id, session in self.sessions.items() if session.lastAccess < limit]:
+            self.evict(id)
+
+    # Elimina la sesión terminada que lleva más tiempo sin usarse (se llama con el candado tomado)
+    def evictLeastRecentlyUsed(self):
+        finished = [session for session in self.sessions.values() if session.finished]
+        if(not finished):
+            return False
+        self.evict(min(finished, key=lambda session: session.lastAccess).id)
+        return True
+
+    # Quita la sesión del manager (se llama con el candado tomado); closeEvicted la cierra después
+    def evict(self, id):
+        session = self.sessions.pop(id)
+        self.retire(session)
+        self.evicted.append(session)
+        self.evictedTotal += 1
+
+    # Cierra las sesiones eliminadas (se llama sin el candado tomado)
+    def closeEvicted(self):
+        with self.lock:
+            sessions, self.evicted = self.evicted, []
+        for session in sessions:
+            self.closeRemoved(session)
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
@@ -0,0 +1,94 @@
+import itertools
+
+
+# Grid de Mesa que solo guarda las celdas ocupadas. MultiGrid crea una lista por celda y un set
+# con todas las celdas vacías, y además cachea la vecindad de cada posición consultada, así que
+# su memoria crece con el área del grid; aquí solo crece con la cantidad de agentes, lo que
+# permite grids de 1000x1000. Implementa la parte de la interfaz de MultiGrid (sin torus) que
+# usan los modelos y la visualización.
+class SparseMultiGrid:
+
+    def __init__(self, width, height, torus = False):
+        if(torus):
+            raise ValueError("SparseMultiGrid no soporta grids toroidales")
+        self.width = width
+        self.height = height
+        self.torus = False
+        # Diccionario con únicamente las celdas no vacías: posición -> agente si la celda tiene uno
+        # solo (el caso más común) o lista de agentes si tiene varios, para no crear una lista por celda
+        self.cells = {}
+
+    def out_of_bounds(self, pos):
+        x, y = pos
+        return x < 0 or x >= self.width or y < 0 or y >= self.height
+
+    def place_agent(self, agent, pos):
+        cell = self.cells.get(pos)
+        if(cell is None):
+            self.cells[pos] = agent
+        elif(type(cell) is list):
+            cell.append(agent)
+        else:
+            self.cells[pos] = [cell, agent]
+        agent.pos = pos
+
+    def remove_agent(self, agent):
+        self.removeFromCell(agent.pos, agent)
+        agent.pos = None
+
+    def move_agent(self, agent, pos):
+        self.removeFromCell(agent.pos, agent)
+        self.place_agent(agent, pos)
+
+    def removeFromCell(self, pos, agent):
+        cell = self.cells[pos]
+        if(cell is agent):
+            del self.cells[pos]
+            return
+        cell.remove(agent)
+        if(len(cell) == 1):
+            self.cells[pos] = cell[0]
+
+    # Agentes de una celda como lista
+    def cellContents(self, pos):
+        cell = self.cells.get(pos)
+        if(cell is None):
+            return []
+        if(type(cell) is list):
+            return list(cell)
+        return [cell]
+
+    def is_cell_empty(self, pos):
+        return pos not in self.cells
+
+    # Vecinos de pos en el mismo orden que MultiGrid.get_neighborhood
+    def get_neighborhood(self, pos, moore, include_center = False, radius = 1):
+        x, y = pos
+        # Caso más común (el que usan los robots): vecindad de Von Neumann de radio 1
+        if(not moore and not include_center and radius == 1):
+            return [(nx, ny) for nx, ny in ((x - 1, y), (x, y - 1), (x, y + 1), (x + 1, y))
+                    if 0 <= nx < self.width and 0 <= ny < self.height]
+
+        neighborhood = []
+        for dx in range(-radius, radius + 1):
+            for dy in range(-radius, radius + 1):
+                if(dx == 0 and dy == 0 and not include_center):
+                    continue
+                if(not moore and abs(dx) + abs(dy) > radius):
+                    continue
+                nx = x + dx
+                ny = y + dy
+                if(0 <= nx < self.width and 0 <= ny < self.height):
+                    neighborhood.append((nx, ny))
+        return neighborhood
+
+    def iter_cell_list_contents(self, cell_list):
+        # Igual que Mesa, aceptamos una sola posición además de una lista de posiciones
+        if(isinstance(cell_list, tuple) and len(cell_list) == 2 and isinstance(cell_list[0], int)):
+            cell_list = [cell_list]
+        return itertools.chain.from_iterable(self.cellContents(pos) for pos in cell_list if pos in self.cells)
+
+    def get_cell_list_contents(self, cell_list):
+        if(isinstance(cell_list, tuple) and len(cell_list) == 2 and isinstance(cell_list[0], int)):
+            return self.cellContents(cell_list)
+        return list(self.iter_cell_list_contents(cell_list))
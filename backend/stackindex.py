@@ -0,0 +1,79 @@
+import math
+
+
+# Índice espacial de las stacks que todavía tienen lugar. El grid se divide en cubetas cuadradas
+# de lado bucketSize y cada stack se guarda en la cubeta que le corresponde; la búsqueda de la
+# más cercana revisa anillos de cubetas alrededor de la posición hasta que ya no pueda haber
+# una stack más cerca, por lo que no depende del total de stacks.
+class StackIndex:
+
+    def __init__(self, width, height, bucketSize = 8):
+        self.bucketSize = max(1, bucketSize)
+        self.bucketsX = (width - 1) // self.bucketSize + 1
+        self.bucketsY = (height - 1) // self.bucketSize + 1
+        self.buckets = {}
+        self.size = 0
+
+    # Escogemos un tamaño de cubeta para que en promedio haya una stack por cubeta
+    @classmethod
+    def forGrid(cls, width, height, amountStacks):
+        return cls(width, height, int(math.sqrt(width * height / max(1, amountStacks))))
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, pos):
+        return pos in self.buckets.get(self.bucketOf(pos), ())
+
+    def bucketOf(self, pos):
+        return (pos[0] // self.bucketSize, pos[1] // self.bucketSize)
+
+    def add(self, pos):
+        bucket = self.buckets.setdefault(self.bucketOf(pos), set())
+        if(pos not in bucket):
+            bucket.add(pos)
+            self.size += 1
+
+    def remove(self, pos):
+        key = self.bucketOf(pos)
+        bucket = self.buckets.get(key)
+        if(bucket is not None and pos in bucket):
+            bucket.remove(pos)
+            self.size -= 1
+            if(len(bucket) == 0):
+                del self.buckets[key]
+
+    # Regresa la stack disponible más cercana a pos (distancia euclidiana) o None si no hay ninguna
+    def nearest(self, pos):
+        if(self.size == 0):
+            return None
+
+        centerX, centerY = self.bucketOf(pos)
+        maxRing = max(centerX, self.bucketsX - 1 - centerX, centerY, self.bucketsY - 1 - centerY)
+        best = None
+        bestDistance = math.inf
+
+        for ring in range(maxRing + 1):
+            # Cualquier stack en este anillo o más lejos está al menos a (ring - 1) * bucketSize de distancia
+            if(best is not None and (ring - 1) * self.bucketSize >= math.sqrt(bestDistance)):
+                break
+            for key in self.ringBuckets(centerX, centerY, ring):
+                for stack in self.buckets.get(key, ()):
+                    distance = (stack[0] - pos[0])**2 + (stack[1] - pos[1])**2
+                    if(distance < bestDistance or (distance == bestDistance and stack < best)):
+                        bestDistance = distance
+                        best = stack
+
+        return best
+
+    # Llaves de las cubetas que forman el borde del cuadrado de radio ring alrededor de (cx, cy)
+    def ringBuckets(self, cx, cy, ring):
+        if(ring == 0):
+            yield (cx, cy)
+            return
+        for bx in range(cx - ring, cx + ring + 1):
+            yield (bx, cy - ring)
+            yield (bx, cy + ring)
+        for by in range(cy - ring + 1, cy + ring):
+            yield (cx - ring, by)
+            yield (cx + ring, by)
@@ -0,0 +1,161 @@
+import json
+import os
+import time
+
+import pytest
+
+import api
+import checkpoint
+import runner
+from arraymodel import ArrayFloor
+from events import KINDS, BOX_PICKED, STACK_CREATED, BOX_STACKED
+from model import Floor
+
+
+@pytest.fixture
+def client():
+    return api.app.test_client()
+
+
+def createSession(client, **form):
+    response = client.post("/", data=form)
+    assert response.status_code == 201
+    return response.headers["Location"]
+
+
+# /advance toma el modelo mientras los workers lo siguen avanzando con sus ticks; al terminar la
+# simulación ningún worker debe darle un step más
+@pytest.mark.parametrize("tps", [0, 0.001])
+def testAdvanceRacingWorkersStopsAtCompletion(client, tps):
+    for seed in range(10):
+        location = createSession(client, seed=seed, tps=tps)
+        session = api.games.get(location[1:])
+        result = client.post(location + "/advance", data={"modo": "resultados"}).get_json()
+        assert result["completed"]
+        # Le damos tiempo a un worker que estuviera esperando el candado
+        time.sleep(0.02)
+        assert session.snapshot.step == result["completionStep"]
+        assert session.model.totalMoves == result["totalMoves"]
+        assert client.delete(location).status_code == 204
+
+
+@pytest.mark.parametrize("form", [
+    {"ancho": 0},
+    {"alto": -3},
+    {"capacidadStack": 0},
+    {"capacidadStack": -1},
+    {"cantidadRobots": -1},
+    {"cantidadCajas": -3},
+    {"cantidadCajas": 500},
+])
+@pytest.mark.parametrize("engine", ["mesa", "array"])
+def testInvalidConfigurationIsRejected(client, form, engine):
+    response = client.post("/", data={"engine": engine, **form})
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+# Las coordenadas de los frames binarios son uint16; con un grid más ancho se rechaza antes de transmitir
+def testBinaryFramesRejectWideGrids(client):
+    location = createSession(client, engine="array", ancho=70000, alto=10, tps=0.001)
+    assert client.post(location + "/advance?steps=1&modo=frames&every=1&format=binary").status_code == 400
+    assert client.get(location + "/stream?format=binary").status_code == 400
+    assert client.post(location + "/advance?steps=1&modo=frames&every=1").status_code == 200
+    assert client.delete(location).status_code == 204
+
+
+def testRestoreRejectsGridsOverTheLimit(client, monkeypatch):
+    monkeypatch.setattr(api, "maxGridCells", 100)
+    data = checkpoint.dumps(ArrayFloor(10, None, 5, 20, 20, seed=1))
+    response = client.post("/restore", data=data)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def testPartitionedSessionsCannotBeForkedOrCheckpointed(client):
+    location = createSession(client, engine="particionado", particiones=1, tps=0.001)
+    assert client.post(location + "/fork").status_code == 409
+    assert client.get(location + "/checkpoint").status_code == 409
+    assert client.delete(location).status_code == 204
+
+
+def testPartitionsAreCappedAtCpuCount(client):
+    response = client.post("/", data={"engine": "particionado", "particiones": os.cpu_count() + 1})
+    assert response.status_code == 400
+
+
+# Solo cuentan las simulaciones particionadas que todavía tienen procesos
+def testPartitionedSessionsAreLimited(client, monkeypatch):
+    monkeypatch.setattr(api, "maxPartitionedSessions", 1)
+    location = createSession(client, engine="particionado", particiones=1, tps=0.001)
+    assert client.post("/", data={"engine": "particionado", "particiones": 1}).status_code == 503
+    other = createSession(client, engine="array", tps=0.001)
+    assert client.delete(location).status_code == 204
+    assert client.delete(other).status_code == 204
+    location = createSession(client, engine="particionado", particiones=1, tps=0.001)
+    assert client.delete(location).status_code == 204
+
+
+# Encabezados malformados que antes llegaban hasta restoreFloor y regresaban 500
+@pytest.mark.parametrize("change", [
+    {"arrays": [1, 2]},
+    {"arrays": [{"name": "robots", "dtype": "<i8", "shape": "ab", "offset": 0}]},
+    {"cantidadRobots": -1},
+])
+def testRestoreRejectsMalformedHeaders(client, change):
+    data = checkpoint.dumps(Floor(seed=1))
+    _, version, engine, length = checkpoint.PREAMBLE.unpack_from(data, 0)
+    header = json.loads(data[checkpoint.PREAMBLE.size:checkpoint.PREAMBLE.size + length])
+    header.update(change)
+    headerBytes = json.dumps(header).encode()
+    data = checkpoint.PREAMBLE.pack(checkpoint.MAGIC, version, engine, len(headerBytes)) + headerBytes
+    response = client.post("/restore", data=data)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+# Un archivo que no se puede cargar se salta sin impedir que se restauren los demás
+def testStartupSkipsUnreadableCheckpoints(tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "checkpointDir", str(tmp_path))
+    (tmp_path / "a-roto.ckpt").write_bytes(b"no es un checkpoint")
+    (tmp_path / "b-vacio.ckpt").write_bytes(b"")
+    checkpoint.save(Floor(seed=1), str(tmp_path / "c-bueno.ckpt"))
+    api.restoreCheckpoints()
+    assert api.games.get("c-bueno") is not None
+    assert api.games.get("a-roto") is None
+    assert api.games.delete("c-bueno")
+
+
+# Si no se puede crear la grabación la API responde 503 con el motivo en lugar de un 500
+def testRecordingErrorsAreReported(client, tmp_path, monkeypatch):
+    notADirectory = tmp_path / "archivo"
+    notADirectory.write_text("")
+    monkeypatch.setattr(api, "recordingDir", str(notADirectory))
+    response = client.post("/", data={"grabar": 1})
+    assert response.status_code == 503
+    assert "No se pudo crear la simulación" in response.get_json()["error"]
+
+
+def eventMetrics(client):
+    lines = client.get("/metrics").get_data(as_text=True).splitlines()
+    prefix = "simulation_events_total{type=\""
+    return {line[len(prefix):line.index("\"}")]: int(line.split()[-1]) for line in lines if line.startswith(prefix)}
+
+
+# Los eventos de una simulación que termina llegan a /<id>/events y a /metrics, y /metrics los
+# sigue contando después de eliminarla
+def testEventCountsReachMetrics(client, monkeypatch):
+    games = runner.SessionManager(workers=1)
+    monkeypatch.setattr(api, "games", games)
+    try:
+        location = createSession(client, seed=2, cantidadCajas=17, tps=0.001)
+        assert client.post(location + "/advance", data={"modo": "resultados"}).get_json()["completed"]
+        events = client.get(location + "/events").get_json()["events"]
+        counts = {kind: sum(1 for event in events if event["type"] == kind) for kind in KINDS}
+        assert counts[BOX_PICKED] == counts[BOX_STACKED] == 17
+        assert counts[STACK_CREATED] == 4
+        assert eventMetrics(client) == counts
+        assert client.delete(location).status_code == 204
+        assert eventMetrics(client) == counts
+    finally:
+        games.stop()
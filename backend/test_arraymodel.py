@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from arraymodel import ArrayFloor, BOX, STACK, LOOSE, MOVING, STACKED
+from model import Floor
+
+
+# Cada caja está en un solo lugar: suelta en su celda del grid, cargada por exactamente un robot o
+# apilada en una stack que no pasa de su capacidad
+def checkBoxes(model):
+    loose = np.flatnonzero(model.boxState == LOOSE)
+    moving = np.flatnonzero(model.boxState == MOVING)
+    stacked = np.flatnonzero(model.boxState == STACKED)
+    assert len(loose) + len(moving) + len(stacked) == model.amountBoxes
+
+    assert (model.cellState[model.boxPos[loose, 0], model.boxPos[loose, 1]] == BOX).all()
+    assert (model.boxGrid[model.boxPos[loose, 0], model.boxPos[loose, 1]] == loose).all()
+    assert (model.cellState == BOX).sum() == len(loose)
+
+    carried = model.robotBox[model.robotBox >= 0]
+    assert sorted(carried.tolist()) == moving.tolist()
+    assert (model.boxPos[carried] == model.robotPos[model.robotBox >= 0]).all()
+
+    assert model.boxesStacked == len(stacked) == model.stackCount.sum()
+    assert (model.stackCount[:model.numStacks] >= 1).all()
+    assert (model.stackCount <= model.stackCapacity).all()
+    assert (model.cellState == STACK).sum() == model.numStacks <= model.amountStacks
+
+
+@pytest.mark.parametrize("capacidadStack", [1, 3, 5])
+def testBoxesAreConservedAndStacksRespectCapacity(capacidadStack):
+    model = ArrayFloor(40, None, 8, 15, 15, capacidadStack, seed=1, pasosMaximos=20000)
+    checkBoxes(model)
+    while(model.running):
+        model.step()
+        checkBoxes(model)
+    assert model.boxesStacked == 40
+    assert model.numStacks == model.amountStacks
+
+
+# Con la misma configuración y semilla ArrayFloor y Floor terminan, con todas las cajas apiladas en
+# la misma cantidad de stacks. Las trayectorias no son iguales porque usan generadores distintos
+@pytest.mark.parametrize("seed", range(3))
+def testCompletesLikeFloor(seed):
+    arrayModel = ArrayFloor(23, None, 5, 20, 20, 4, seed=seed, pasosMaximos=20000)
+    floor = Floor(23, None, seed=seed, pasosMaximos=20000, cantidadRobots=5, ancho=20, alto=20, capacidadStack=4)
+    for model in (arrayModel, floor):
+        while(model.running):
+            model.step()
+
+    assert arrayModel.steps < 20000 and floor.schedule.steps < 20000
+    assert arrayModel.boxesStacked == floor.boxesStacked == 23
+    assert len(arrayModel.boxStacks) == len(floor.boxStacks) == 6
+    assert sum(arrayModel.boxStacks.values()) == sum(floor.boxStacks.values()) == 23
+
+
+# Con la misma semilla la trayectoria es la misma
+def testDeterministicPerSeed():
+    def run():
+        model = ArrayFloor(30, None, 6, 15, 15, seed=7, pasosMaximos=300)
+        while(model.running):
+            model.step()
+        return model.steps, model.totalMoves, model.getState()
+    assert run() == run()
@@ -0,0 +1,188 @@
+import json
+
+import pytest
+
+import checkpoint
+from model import Floor
+from arraymodel import ArrayFloor
+from partitioned import PartitionedFloor
+
+
+# Avanza el modelo hasta que termine y regresa lo que pasó en cada step
+def trajectory(model):
+    steps = []
+    while(model.running):
+        model.step()
+        steps.append((model.totalMoves, model.boxesStacked, model.getState()))
+    return steps
+
+
+@pytest.mark.parametrize("config", [
+    {},
+    {"estrategia": "bfs", "cantidadCajas": 40},
+    {"asignacion": "central", "cantidadCajas": 40},
+    {"actualizacion": "simultanea", "cantidadRobots": 20, "cantidadCajas": 60},
+])
+def testFloorRoundTripContinuesIdentically(config):
+    model = Floor(seed=3, tiempoMaximo=None, pasosMaximos=3000, **config)
+    for _ in range(40):
+        model.step()
+    copy = checkpoint.loads(checkpoint.dumps(model))
+    assert copy.getState() == model.getState()
+    assert trajectory(copy) == trajectory(model)
+
+
+def testArrayFloorRoundTripContinuesIdentically():
+    model = ArrayFloor(60, None, 10, 30, 30, seed=4, pasosMaximos=3000)
+    for _ in range(40):
+        model.step()
+    copy = checkpoint.loads(checkpoint.dumps(model))
+    assert copy.getState() == model.getState()
+    assert trajectory(copy) == trajectory(model)
+
+
+def testSaveAndLoadFile(tmp_path):
+    model = Floor(seed=1, tiempoMaximo=None, pasosMaximos=3000)
+    for _ in range(10):
+        model.step()
+    path = tmp_path / "session.ckpt"
+    checkpoint.save(model, str(path))
+    copy = checkpoint.load(str(path))
+    assert copy.getState() == model.getState()
+    assert copy.events.counts == model.events.counts
+
+
+def testRejectsCorruptData():
+    data = bytearray(checkpoint.dumps(Floor(seed=1)))
+    data[:4] = b"XXXX"
+    with pytest.raises(checkpoint.CheckpointError):
+        checkpoint.loads(bytes(data))
+
+
+# Reemplaza el encabezado JSON de un checkpoint (los offsets de los arreglos dejan de ser válidos)
+def withHeader(data, header):
+    _, version, engine, _ = checkpoint.PREAMBLE.unpack_from(data, 0)
+    headerBytes = json.dumps(header).encode()
+    return checkpoint.PREAMBLE.pack(checkpoint.MAGIC, version, engine, len(headerBytes)) + headerBytes
+
+
+def readHeader(data):
+    _, _, _, headerLength = checkpoint.PREAMBLE.unpack_from(data, 0)
+    return json.loads(data[checkpoint.PREAMBLE.size:checkpoint.PREAMBLE.size + headerLength])
+
+
+def testRejectsGridsOverTheLimitBeforeBuildingTheModel():
+    data = checkpoint.dumps(ArrayFloor(10, None, 5, 20, 20, seed=1))
+    header = readHeader(data)
+    header.update({"ancho": 30000, "alto": 30000})
+    with pytest.raises(checkpoint.CheckpointError):
+        checkpoint.loads(withHeader(data, header), maxCells=1000 * 1000)
+
+
+@pytest.mark.parametrize("header", [[], "checkpoint", {"ancho": "20", "alto": 20}])
+def testRejectsMalformedHeaders(header):
+    with pytest.raises(checkpoint.CheckpointError):
+        checkpoint.loads(withHeader(checkpoint.dumps(Floor(seed=1)), header))
+
+
+# Aplica change a la lista de arreglos de un checkpoint, moviendo sus datos para que los offsets
+# originales sigan siendo válidos aunque el encabezado cambie de tamaño
+def withArrays(data, change):
+    header = readHeader(data)
+    _, _, engine, headerLength = checkpoint.PREAMBLE.unpack_from(data, 0)
+    start = checkpoint.align(checkpoint.PREAMBLE.size + headerLength)
+    original = header["arrays"]
+    delta = 0
+    while(True):
+        header["arrays"] = change([dict(description, offset=description["offset"] + delta) for description in original])
+        headerBytes = json.dumps(header).encode()
+        newStart = checkpoint.align(checkpoint.PREAMBLE.size + len(headerBytes))
+        if(newStart - start == delta):
+            break
+        delta = newStart - start
+    preamble = checkpoint.PREAMBLE.pack(checkpoint.MAGIC, checkpoint.VERSION, engine, len(headerBytes))
+    return (preamble + headerBytes).ljust(newStart, b"\0") + data[start:]
+
+
+def testWithArraysKeepsCheckpointValid():
+    model = Floor(seed=1)
+    assert checkpoint.loads(withArrays(checkpoint.dumps(model), lambda arrays: arrays)).getState() == model.getState()
+
+
+@pytest.mark.parametrize("change", [
+    lambda arrays: 5,
+    lambda arrays: [1, 2],
+    lambda arrays: arrays + [dict(arrays[0])],
+    lambda arrays: arrays[1:],
+    lambda arrays: [dict(arrays[0], name="otro")] + arrays[1:],
+    lambda arrays: [dict(arrays[0], dtype="<f8")] + arrays[1:],
+    lambda arrays: [dict(arrays[0], shape="abc")] + arrays[1:],
+    lambda arrays: [dict(arrays[0], shape=[999, 8])] + arrays[1:],
+    lambda arrays: [dict(arrays[0], offset=-8)] + arrays[1:],
+    lambda arrays: [dict(arrays[0], offset=10 ** 9)] + arrays[1:],
+])
+def testRejectsMalformedArrayDescriptions(change):
+    with pytest.raises(checkpoint.CheckpointError):
+        checkpoint.loads(withArrays(checkpoint.dumps(Floor(seed=1)), change))
+
+
+# Cambios al encabezado de un checkpoint bien formado
+INVALID_CONFIGURATIONS = [
+    {"cantidadRobots": -1},
+    {"cantidadCajas": "15"},
+    {"capacidadStack": 0},
+    {"amountStacks": 99},
+    {"boxesStacked": 1000},
+    {"pasosMaximos": "mucho"},
+    {"running": 1},
+    {"random": "semilla"},
+]
+
+
+@pytest.mark.parametrize("engine, change",
+    [("mesa", change) for change in INVALID_CONFIGURATIONS + [{"random": [3, [1, 2], None]}, {"currentId": -5}]] +
+    [("array", change) for change in INVALID_CONFIGURATIONS + [{"random": {"bit_generator": "PCG64"}}, {"numStacks": 99}]])
+def testRejectsInvalidConfiguration(engine, change):
+    model = Floor(seed=1) if engine == "mesa" else ArrayFloor(15, None, 5, 20, 20, seed=1)
+    for _ in range(30):
+        model.step()
+    if(engine == "mesa"):
+        header, arrays = checkpoint.describeFloor(model)
+    else:
+        header, arrays = checkpoint.describeArrayFloor(model)
+    header.update(change)
+    with pytest.raises(checkpoint.CheckpointError):
+        checkpoint.loads(checkpoint.pack(checkpoint.FLOOR if engine == "mesa" else checkpoint.ARRAY_FLOOR, header, arrays))
+
+
+def testRejectsPositionsOutsideTheGrid():
+    header, arrays = checkpoint.describeArrayFloor(ArrayFloor(15, None, 5, 20, 20, seed=1))
+    arrays["robotPos"] = arrays["robotPos"].copy()
+    arrays["robotPos"][0] = (20, 0)
+    with pytest.raises(checkpoint.CheckpointError):
+        checkpoint.loads(checkpoint.pack(checkpoint.ARRAY_FLOOR, header, arrays))
+
+
+# Si la escritura falla, el checkpoint anterior queda intacto y no quedan archivos temporales
+def testSaveKeepsPreviousCheckpointOnFailure(tmp_path, monkeypatch):
+    path = tmp_path / "session.ckpt"
+    checkpoint.save(Floor(seed=1), str(path))
+    previous = path.read_bytes()
+    def fail(descriptor):
+        raise OSError("No queda espacio en el disco")
+    monkeypatch.setattr(checkpoint.os, "fsync", fail)
+    with pytest.raises(OSError):
+        checkpoint.save(Floor(seed=2), str(path))
+    assert path.read_bytes() == previous
+    assert [entry.name for entry in tmp_path.iterdir()] == ["session.ckpt"]
+
+
+def testPartitionedFloorCannotBeSavedOrForked():
+    model = PartitionedFloor(10, None, 5, 20, 20, seed=1, particiones=2)
+    try:
+        with pytest.raises(checkpoint.CheckpointError):
+            checkpoint.dumps(model)
+        with pytest.raises(checkpoint.CheckpointError):
+            checkpoint.fork(model)
+    finally:
+        model.close()
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from delta import DeltaEncoder, FRAME_HEADER, ROBOT_RECORD, BOX_RECORD, STACK_RECORD, FRAME_LENGTH, SNAPSHOT, DELTA, MAX_BINARY_SIDE
+
+
+def state(robots, boxes, stacks, isRunning = True):
+    return {
+        "robots": [{"x": float(x), "y": float(y), "hasBox": hasBox} for x, y, hasBox in robots],
+        "boxes": [{"x": float(x), "y": float(y), "height": float(height)} for x, y, height in boxes],
+        "stacks": [{"x": x, "y": y} for x, y in stacks],
+        "isRunning": isRunning,
+    }
+
+
+# Separa un frame binario en su encabezado y sus registros
+def decode(frame):
+    (length,) = FRAME_LENGTH.unpack_from(frame)
+    assert length == len(frame) - FRAME_LENGTH.size
+    offset = FRAME_LENGTH.size
+    header = FRAME_HEADER.unpack_from(frame, offset)
+    offset += FRAME_HEADER.size
+    _, _, robotCount, boxCount, stackCount, _ = header
+    records = []
+    for record, count in ((ROBOT_RECORD, robotCount), (BOX_RECORD, boxCount), (STACK_RECORD, stackCount)):
+        records.append([record.unpack_from(frame, offset + i * record.size) for i in range(count)])
+        offset += count * record.size
+    assert offset == len(frame)
+    return header, records
+
+
+def testBinaryLayout():
+    # Tamaños fijos del formato (sin relleno entre campos)
+    assert (FRAME_HEADER.size, ROBOT_RECORD.size, BOX_RECORD.size, STACK_RECORD.size, FRAME_LENGTH.size) == (18, 9, 12, 4, 4)
+
+    encoder = DeltaEncoder(binary=True)
+    first = encoder.snapshot(state([(1, 2, False), (3, 4, True)], [(3, 4, 3.5), (7, 8, 0.0)], []), 5)
+    header, (robots, boxes, stacks) = decode(first)
+    assert header == (SNAPSHOT, 5, 2, 2, 0, True)
+    assert robots == [(0, 1, 2, False), (1, 3, 4, True)]
+    assert boxes == [(0, 3, 4, 3.5), (1, 7, 8, 0.0)]
+    assert stacks == []
+
+    # El delta solo lleva al robot y la caja que cambiaron y la stack nueva
+    second = encoder.delta(state([(1, 2, False), (3, 5, True)], [(3, 5, 3.5), (7, 8, 0.0)], [(9, 9)], False), 6)
+    header, (robots, boxes, stacks) = decode(second)
+    assert header == (DELTA, 6, 1, 1, 1, False)
+    assert robots == [(1, 3, 5, True)]
+    assert boxes == [(0, 3, 5, 3.5)]
+    assert stacks == [(9, 9)]
+
+
+def testJsonFrames():
+    states = [state([(0, 0, False)], [(1, 0, 0.0)], []), state([(1, 0, True)], [(1, 0, 3.5)], [(2, 2)])]
+    text = DeltaEncoder()
+    lines = [json.loads(text.snapshot(states[0], 0)), json.loads(text.delta(states[1], 1))]
+    assert lines[0] == {"type": "snapshot", "step": 0, "robots": [[0, 0, 0, False]], "boxes": [[0, 1, 0, 0.0]], "stacks": [], "isRunning": True}
+    assert lines[1] == {"type": "delta", "step": 1, "robots": [[0, 1, 0, True]], "boxes": [[0, 1, 0, 3.5]], "stacks": [[2, 2]], "isRunning": True}
+
+
+def testBinaryRejectsGridsWiderThanRecords():
+    DeltaEncoder(binary=True, ancho=MAX_BINARY_SIDE, alto=10)
+    DeltaEncoder(binary=False, ancho=MAX_BINARY_SIDE + 1, alto=10)
+    with pytest.raises(ValueError):
+        DeltaEncoder(binary=True, ancho=MAX_BINARY_SIDE + 1, alto=10)
@@ -0,0 +1,41 @@
+from collections import Counter
+
+import pytest
+
+from model import Floor
+
+
+def centralFloor(seed, actualizacion):
+    return Floor(40, None, seed=seed, pasosMaximos=5000, cantidadRobots=8, ancho=15, alto=15,
+                 asignacion="central", actualizacion=actualizacion)
+
+
+# Revisa después de cada step que:
+#   - cada caja esté asignada a lo más a un robot, y que ninguna asignada esté cargada, apilada o
+#     todavía entre las cajas sin reclamar del despachador
+#   - ninguna stack tenga más cajas más lugares reservados que su capacidad
+#   - los lugares reservados de cada stack sean justo los robots con caja que van hacia ella, es
+#     decir, que el lugar se libere cuando el robot deja su caja
+@pytest.mark.parametrize("actualizacion", ["secuencial", "simultanea"])
+@pytest.mark.parametrize("seed", range(4))
+def testDispatcherInvariants(seed, actualizacion):
+    model = centralFloor(seed, actualizacion)
+    dispatcher = model.dispatcher
+    while(model.running):
+        model.step()
+
+        targets = [robot.targetBox for robot in model.robots if robot.targetBox is not None]
+        assert len({box.unique_id for box in targets}) == len(targets)
+        carried = {robot.myBox for robot in model.robots if robot.myBox is not None}
+        for box in targets:
+            assert box not in carried
+            assert not box.isStacked
+            assert box.pos not in dispatcher.looseAt
+
+        heading = Counter(robot.closestStackPos for robot in model.robots if robot.myBox is not None)
+        for stack, height in model.boxStacks.items():
+            assert height + dispatcher.reserved[stack] <= model.stackCapacity
+            assert dispatcher.reserved[stack] == heading[stack]
+
+    assert model.boxesStacked == len(model.boxes)
+    assert sum(dispatcher.reserved.values()) == 0
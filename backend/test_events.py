@@ -0,0 +1,100 @@
+import collections
+import types
+
+import pytest
+
+from events import Event, EventLog, KINDS, BOX_PICKED, STACK_CREATED, BOX_STACKED, STACK_FULL, ROBOT_IDLE
+from model import Floor
+
+
+# Deque que, como el step del modelo en otro hilo, recibe un evento justo después de que since lo copia
+class RacingDeque(collections.deque):
+
+    def __init__(self, *args, onCopy = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.onCopy = onCopy
+
+    def __iter__(self):
+        items = list(super().__iter__())
+        if(self.onCopy is not None):
+            onCopy, self.onCopy = self.onCopy, None
+            onCopy()
+        return iter(items)
+
+
+def testSinceNeverSkipsEventsAppendedDuringTheCopy():
+    robot = object()
+    log = EventLog(types.SimpleNamespace(robots=[robot], boxes=[]))
+    emit = lambda step: log(Event(BOX_PICKED, step, robot, (0, 0), None))
+    emit(1)
+    log.events = RacingDeque(log.events, maxlen=log.events.maxlen, onCopy=lambda: emit(2))
+
+    events, next = log.since(0)
+    assert [event["step"] for event in events] == [1]
+    events, next = log.since(next)
+    assert [event["step"] for event in events] == [2]
+    assert next == 2
+
+
+def testSinceWithoutEvents():
+    log = EventLog(types.SimpleNamespace(robots=[], boxes=[]))
+    assert log.since(0) == ([], 0)
+
+
+def recordedRun(capacidadStack, actualizacion):
+    model = Floor(17, None, seed=2, pasosMaximos=5000, capacidadStack=capacidadStack, actualizacion=actualizacion)
+    initialBoxes = model.getState()["boxes"]
+    log = model.events.subscribe(EventLog(model, maxEvents=100000))
+    while(model.running):
+        model.step()
+    return model, initialBoxes, list(log.events)
+
+
+# Con una semilla fija, cada caja se recoge una vez de donde estaba y se apila una vez (creando su
+# stack o en una que ya existía) por el mismo robot, que después queda sin tarea; cada stack avisa
+# una vez que se llenó justo con la caja que la llenó, y al terminar todas las cajas están apiladas
+@pytest.mark.parametrize("actualizacion", ["secuencial", "simultanea"])
+@pytest.mark.parametrize("capacidadStack", [1, 5])
+def testFloorEventSequence(capacidadStack, actualizacion):
+    model, initialBoxes, events = recordedRun(capacidadStack, actualizacion)
+    final = model.getState()
+    assert not model.running and model.boxesStacked == 17
+    assert [event["seq"] for event in events] == list(range(len(events)))
+    assert all(a["step"] <= b["step"] for a, b in zip(events, events[1:]))
+    assert events[-1]["step"] <= model.schedule.steps
+
+    byBox = collections.defaultdict(list)
+    for event in events:
+        if(event["box"] is not None):
+            byBox[event["box"]].append(event)
+    assert sorted(byBox) == list(range(17))
+    for box, boxEvents in byBox.items():
+        kinds = [event["type"] for event in boxEvents]
+        assert kinds in ([BOX_PICKED, BOX_STACKED], [BOX_PICKED, STACK_CREATED, BOX_STACKED])
+        picked, stacked = boxEvents[0], boxEvents[-1]
+        assert (picked["x"], picked["y"]) == (initialBoxes[box]["x"], initialBoxes[box]["y"])
+        assert (stacked["x"], stacked["y"]) == (final["boxes"][box]["x"], final["boxes"][box]["y"])
+        assert picked["robot"] == stacked["robot"]
+        assert picked["step"] < stacked["step"]
+
+    created = [(event["x"], event["y"]) for event in events if event["type"] == STACK_CREATED]
+    assert sorted(created) == sorted(model.boxStacks)
+
+    heights = collections.Counter()
+    for i, event in enumerate(events):
+        pos = (event["x"], event["y"])
+        if(event["type"] == BOX_STACKED):
+            heights[pos] += 1
+            if(heights[pos] == capacidadStack):
+                assert [e["type"] for e in events[i + 1:i + 3]] == [STACK_FULL, ROBOT_IDLE]
+            else:
+                assert events[i + 1]["type"] == ROBOT_IDLE
+        elif(event["type"] == STACK_FULL):
+            assert heights[pos] == capacidadStack
+        elif(event["type"] == ROBOT_IDLE):
+            assert events[i - 1]["robot"] == event["robot"]
+
+    fullStacks = [pos for pos, count in model.boxStacks.items() if count == capacidadStack]
+    assert sorted((event["x"], event["y"]) for event in events if event["type"] == STACK_FULL) == sorted(fullStacks)
+    assert model.fullStacks == len(fullStacks)
+    assert model.events.counts == {kind: sum(1 for event in events if event["type"] == kind) for kind in KINDS}
@@ -0,0 +1,13 @@
+from instrumentation import SamplingProfiler
+
+
+# Crear el profiler no arranca su hilo; lo arranca el primer step instrumentado
+def testSamplerStartsOnFirstEnter():
+    profiler = SamplingProfiler()
+    assert not profiler.sampler.is_alive()
+    profiler.enter()
+    profiler.exit()
+    assert profiler.sampler.is_alive()
+    profiler.enter()
+    profiler.exit()
+    profiler.stop()
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from arraymodel import STACKED
+from partitioned import PartitionedFloor
+
+
+# Invariantes de ocupación que deben valer al terminar cada step, sin importar qué tile movió a cada robot
+def checkOccupancy(model):
+    positions = model.robotPos
+    # Cada robot está en una celda distinta y robotGrid apunta exactamente a esas celdas
+    assert len({tuple(pos) for pos in positions.tolist()}) == len(positions)
+    assert (model.robotGrid[positions[:, 0], positions[:, 1]] == np.arange(len(positions))).all()
+    assert (model.robotGrid >= 0).sum() == len(positions)
+    # Las cajas que cargan los robots están en la misma celda que ellos
+    carrying = model.robotBox >= 0
+    assert (model.boxPos[model.robotBox[carrying]] == positions[carrying]).all()
+    # Ninguna caja se pierde ni se cuenta dos veces
+    assert model.boxesStacked == (model.boxState == STACKED).sum() == model.stackCount.sum()
+    assert (model.stackCount <= model.stackCapacity).all()
+
+
+def run(particiones):
+    model = PartitionedFloor(300, None, 30, 40, 40, seed=3, pasosMaximos=400, particiones=particiones)
+    try:
+        while(model.running):
+            model.step()
+            checkOccupancy(model)
+        return model.steps, model.totalMoves, model.boxesStacked, model.getState()
+    finally:
+        model.close()
+
+
+@pytest.mark.parametrize("particiones", [1, 3])
+def testOccupancyInvariants(particiones):
+    steps, totalMoves, boxesStacked, _ = run(particiones)
+    assert steps == 400 or boxesStacked == 300
+    assert totalMoves > 0
+
+
+# Con la misma semilla y cantidad de particiones la trayectoria es la misma
+def testDeterministicPerSeedAndPartitions():
+    assert run(2) == run(2)
+
+
+def testRejectsMorePartitionsThanRows():
+    with pytest.raises(ValueError):
+        PartitionedFloor(10, None, 5, 4, 20, particiones=5)
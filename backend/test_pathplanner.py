@@ -0,0 +1,50 @@
+import random
+
+import numpy as np
+import pytest
+
+from model import Floor
+from pathplanner import DistanceFields
+
+
+# Campo calculado desde cero con las mismas celdas bloqueadas
+def freshField(fields, stackPos):
+    fresh = DistanceFields(fields.width, fields.height)
+    fresh.blocked = fields.blocked.copy()
+    return fresh.build(stackPos)
+
+
+# Las correcciones incrementales de openCell y blockCell (con invalidate) dejan cada campo igual que
+# si se calculara de nuevo con BFS
+@pytest.mark.parametrize("seed", range(5))
+def testIncrementalRepairMatchesFreshBuild(seed):
+    rng = random.Random(seed)
+    width, height = 15, 12
+    fields = DistanceFields(width, height)
+    cells = [(x, y) for x in range(width) for y in range(height)]
+    stacks = rng.sample(cells, 3)
+    for stackPos in stacks:
+        fields.addStack(stackPos)
+    for pos in rng.sample(cells, 40):
+        if(pos not in stacks):
+            fields.blockCell(pos)
+    # Consultamos las stacks para que sus campos queden guardados y se corrijan en cada cambio
+    for stackPos in stacks:
+        fields.distance(stackPos, (0, 0))
+
+    for _ in range(200):
+        pos = rng.choice(cells)
+        if(pos in stacks):
+            continue
+        if(fields.blocked[fields.index(pos)]):
+            fields.openCell(pos)
+        else:
+            fields.blockCell(pos)
+        for stackPos in stacks:
+            assert np.array_equal(fields.fields[stackPos], freshField(fields, stackPos))
+
+
+# Con más stacks de las que caben en memoria los campos se recalcularían en cada step
+def testBfsRejectsMoreStacksThanFieldsFit():
+    with pytest.raises(ValueError):
+        Floor(5000, None, "bfs", cantidadRobots=1000, ancho=1000, alto=1000)
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from arraymodel import ArrayFloor
+from model import Floor
+from recorder import TrajectoryRecorder, TrajectoryReader
+
+
+def createModel(engine, path):
+    if(engine == "array"):
+        return ArrayFloor(20, None, 5, 12, 12, seed=4, pasosMaximos=2000, grabacion=path)
+    return Floor(20, None, seed=4, pasosMaximos=2000, cantidadRobots=5, ancho=12, alto=12, grabacion=path)
+
+
+# Cada frame que se lee de la grabación es igual al estado que tenía el modelo en ese step
+@pytest.mark.parametrize("engine", ["mesa", "array"])
+def testRecordThenReplay(tmp_path, engine):
+    path = str(tmp_path / "grabacion")
+    model = createModel(engine, path)
+    states = [model.getState()]
+    while(model.running):
+        model.step()
+        states.append(model.getState())
+
+    reader = TrajectoryReader(path)
+    assert len(reader) == len(states)
+    for index, state in enumerate(states):
+        assert reader.frame(index) == state
+    with pytest.raises(IndexError):
+        reader.frame(len(states))
+
+
+# Mientras se graba solo están en disco los bloques completos; refresh() ve los que se escriben después
+def testReaderSeesFlushedChunks(tmp_path):
+    path = str(tmp_path / "grabacion")
+    model = ArrayFloor(20, None, 5, 12, 12, seed=4, pasosMaximos=2000, grabacion=path)
+    model.recorder.chunkSteps = 8
+    reader = TrajectoryReader(path)
+    assert len(reader) == 0
+    for _ in range(10):
+        model.step()
+    reader.refresh()
+    assert len(reader) == 8
+    model.recorder.close()
+    reader.refresh()
+    assert len(reader) == 11
+
+
+# La grabación no deja archivos abiertos entre bloques
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="requiere /proc/self/fd")
+def testNoFilesStayOpen(tmp_path):
+    before = len(os.listdir("/proc/self/fd"))
+    recorders = [TrajectoryRecorder(str(tmp_path / str(i)), 10, 10, 3, 4, chunkSteps=2) for i in range(5)]
+    for recorder in recorders:
+        for _ in range(3):
+            recorder.record([(0, 0)] * 3, [False] * 3, [(1, 1)] * 4, [0.0] * 4, [], True)
+    assert len(os.listdir("/proc/self/fd")) == before
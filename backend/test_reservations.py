@@ -0,0 +1,55 @@
+from model import Floor
+from reservations import ReservationTable
+
+
+# Dos robots que quieren cruzarse de frente entre las mismas dos celdas se quedan en su lugar
+def testSwapIsRejected():
+    table = ReservationTable()
+    positions = {"a": (0, 0), "b": (1, 0)}
+    winners = table.resolve(positions, {"a": (1, 0), "b": (0, 0)}, ["a", "b"])
+    assert winners == set()
+    assert table.conflicts >= 1
+
+
+# Un robot puede entrar a la celda que otro deja libre en el mismo step
+def testFollowIsAllowed():
+    table = ReservationTable()
+    positions = {"a": (0, 0), "b": (1, 0)}
+    winners = table.resolve(positions, {"a": (1, 0), "b": (2, 0)}, ["a", "b"])
+    assert winners == {"a", "b"}
+
+
+# Si el de adelante no se puede mover, el que lo seguía tampoco
+def testFollowCascadesWhenLeaderStays():
+    table = ReservationTable(blocked=[(2, 0)])
+    positions = {"a": (0, 0), "b": (1, 0)}
+    winners = table.resolve(positions, {"a": (1, 0), "b": (2, 0)}, ["a", "b"])
+    assert winners == set()
+
+
+# Con dos robots que quieren la misma celda se la queda el de mayor prioridad
+def testVertexConflictKeepsFirstInOrder():
+    table = ReservationTable()
+    positions = {"a": (0, 0), "b": (2, 0)}
+    winners = table.resolve(positions, {"a": (1, 0), "b": (1, 0)}, ["b", "a"])
+    assert winners == {"b"}
+
+
+# Una rotación de cuatro robots es válida porque nadie se cruza de frente
+def testRotationIsAllowed():
+    table = ReservationTable()
+    positions = {"a": (0, 0), "b": (1, 0), "c": (1, 1), "d": (0, 1)}
+    moves = {"a": (1, 0), "b": (1, 1), "c": (0, 1), "d": (0, 0)}
+    assert table.resolve(positions, moves, ["a", "b", "c", "d"]) == {"a", "b", "c", "d"}
+
+
+# En el step simultáneo ningún robot entra a una celda que ya tenía una stack, aunque solo tenga una caja
+def testRobotsDoNotEnterStacks():
+    for seed in range(5):
+        model = Floor(seed=seed, tiempoMaximo=None, pasosMaximos=3000, cantidadRobots=20, cantidadCajas=60,
+                      actualizacion="simultanea")
+        while(model.running):
+            stacks = set(model.boxStacks)
+            before = {robot: robot.pos for robot in model.robots}
+            model.step()
+            assert not [robot for robot in model.robots if robot.pos != before[robot] and robot.pos in stacks]
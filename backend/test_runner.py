@@ -0,0 +1,21 @@
+from arraymodel import ArrayFloor
+from runner import SessionManager
+
+
+# Un step que falla detiene su sesión sin matar al worker, que sigue avanzando a las demás
+def testFailingStepStopsOnlyItsSession():
+    manager = SessionManager(workers=1)
+    try:
+        broken = ArrayFloor(10, None, 5, 10, 10, seed=1, pasosMaximos=100)
+        def fail():
+            raise OSError("No queda espacio en el disco")
+        broken.step = fail
+        failed = manager.create("roto", broken, 0)
+        failed.waitForStep(0, timeout=5)
+        assert failed.finished
+        assert not failed.snapshot.state["isRunning"]
+
+        healthy = manager.create("sano", ArrayFloor(10, None, 5, 10, 10, seed=1, pasosMaximos=100), 0)
+        assert healthy.waitForStep(5, timeout=5).step > 5
+    finally:
+        manager.stop()
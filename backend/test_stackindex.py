@@ -0,0 +1,52 @@
+import random
+
+from stackindex import StackIndex
+
+
+def bruteForce(stacks, pos):
+    return min(stacks, key=lambda stack: ((stack[0] - pos[0])**2 + (stack[1] - pos[1])**2, stack))
+
+
+def testNearestMatchesBruteForce():
+    generator = random.Random(0)
+    index = StackIndex(100, 60, bucketSize=7)
+    stacks = set()
+    while(len(stacks) < 40):
+        stacks.add((generator.randrange(100), generator.randrange(60)))
+    for stack in stacks:
+        index.add(stack)
+    for _ in range(500):
+        pos = (generator.randrange(100), generator.randrange(60))
+        assert index.nearest(pos) == bruteForce(stacks, pos)
+
+
+# Una stack en la cubeta vecina pero más cerca que la de la propia cubeta no se debe perder por
+# cortar los anillos demasiado pronto
+def testRingCutoffKeepsCloserStackInNextRing():
+    index = StackIndex(40, 40, bucketSize=10)
+    index.add((9, 5))
+    index.add((19, 5))
+    index.add((1, 5))
+    assert index.nearest((10, 5)) == (9, 5)
+    assert index.nearest((18, 5)) == (19, 5)
+
+
+# Con una stack cerca no hace falta revisar los anillos lejanos
+def testRingCutoffStopsEarly():
+    index = StackIndex(1000, 1000, bucketSize=10)
+    index.add((500, 500))
+    index.add((999, 999))
+    visited = []
+    ringBuckets = index.ringBuckets
+    index.ringBuckets = lambda cx, cy, ring: visited.append(ring) or ringBuckets(cx, cy, ring)
+    assert index.nearest((501, 501)) == (500, 500)
+    assert max(visited) <= 2
+
+
+def testRemoveAndEmpty():
+    index = StackIndex(20, 20)
+    index.add((3, 3))
+    index.add((3, 3))
+    assert len(index) == 1 and (3, 3) in index
+    index.remove((3, 3))
+    assert len(index) == 0 and index.nearest((0, 0)) is None
@@ -0,0 +1,18 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import robots
+
+
+# El servidor de visualización se puede crear con la versión de Mesa instalada y dibuja el grid
+# con el tamaño de la simulación
+def testServerRendersConfiguredGrid():
+    server = robots.createServer(30, 12)
+    server.reset_model()
+    assert (server.model.x, server.model.y) == (30, 12)
+    grid = server.visualization_elements[0]
+    assert (grid.grid_width, grid.grid_height) == (30, 12)
+    cells = [portrayal for layer in grid.render(server.model).values() for portrayal in layer]
+    assert len(cells) == server.model.amountBoxes + server.model.amountRobots
@@ -26,6 +26,17 @@ class Stack{
     public float y;
 }
 
+[System.Serializable]
+// Clase con la configuración de la simulación que regresa la API al crearla
+class SimulationConfig{
+    public int cantidadCajas;
+    public int cantidadRobots;
+    public int ancho;
+    public int alto;
+    public int capacidadStack;
+    public int cantidadStacks;
+}
+
 // Clase que cuenta con todo el contenido
 class Agents{
     public List<Robot> robots;
@@ -50,16 +61,28 @@ public class MovementModel : MonoBehaviour{
     public GameObject boxPrefab;
     public GameObject stackPrefab;
 
+    // Parámetros con los que se crea la simulación (se pueden cambiar desde el inspector de Unity)
+    public int cantidadCajas = 15;
+    public int cantidadRobots = 5;
+    public int ancho = 20;
+    public int alto = 20;
+
     string simulationURL = null;
-    int numRobots = 5; // Hardcoded porque no lo puedo mandar desde el ConnectToMesa
-    int numBoxes = 15; // Hardcoded porque no lo puedo mandar desde el ConnectToMesa
+    // Se obtienen de la configuración que regresa la API al crear la simulación
+    int numRobots;
+    int numBoxes;
     int numStacks;
 
     // Start is called before the first frame update
     void Start(){
         StartCoroutine(ConnectToMesa());
+    }
 
-        numStacks = (int)(numBoxes / numRobots) + (numBoxes%numRobots == 0 ? 0 : 1);
+    // Creamos los objetos de la escena una vez que conocemos la configuración de la simulación
+    void CreateObjects(SimulationConfig config){
+        numRobots = config.cantidadRobots;
+        numBoxes = config.cantidadCajas;
+        numStacks = config.cantidadStacks;
 
         robotsGame = new GameObject[numRobots];
         lightsGame = new GameObject[numRobots];
@@ -95,6 +118,10 @@ public class MovementModel : MonoBehaviour{
     // Función que permite hacer la conexión con la API y obtener el ID del juego a través del método post
     IEnumerator ConnectToMesa(){
         WWWForm form = new WWWForm();
+        form.AddField("cantidadCajas", cantidadCajas);
+        form.AddField("cantidadRobots", cantidadRobots);
+        form.AddField("ancho", ancho);
+        form.AddField("alto", alto);
 
         using(UnityWebRequest www = UnityWebRequest.Post("http://localhost:5000/", form)){
             yield return www.SendWebRequest();
@@ -102,6 +129,7 @@ public class MovementModel : MonoBehaviour{
             if (www.result != UnityWebRequest.Result.Success)
                 Debug.Log(www.error);
             else{
+                CreateObjects(JsonUtility.FromJson<SimulationConfig>(www.downloadHandler.text));
                 simulationURL = www.GetResponseHeader("Location");
 
                 Debug.Log("Connected to simulation through Web API");
@@ -1,248 +1,55 @@
-# Código de simulación con representación gráfica a traves del ModularServer de Mesa
+# Representación gráfica de la simulación a traves del ModularServer de Mesa. La simulación es la
+# misma de backend/model.py (la que usan la API, los batches y los benchmarks); aquí solo está la
+# visualización, que se carga al lanzar el servidor y no al importar este archivo.
 
-import random
-import time
-import math
+import os
+import sys
 
-from mesa import Agent, Model
-from mesa.space import MultiGrid
-from mesa.time import RandomActivation
-from mesa.visualization.modules import CanvasGrid
-from mesa.visualization.modules import TextElement
-from mesa.visualization.ModularVisualization import ModularServer
-from mesa.visualization.UserParam import UserSettableParameter
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
 
+from model import Floor, BOX
 
-class Robot(Agent):
-    def __init__(self, model, pos):
-        super().__init__(model.next_id(), model)
-        self.pos = pos
-        self.myBox = None # Atributo que guarda una caja (agent) en caso de haberla levantado
-        self.closestStackPos = (-1,-1) # Atributo que guarda la posición de la stack más cercana
-        self.lastPos = self.pos
-        
-    def step(self):
-        # Usamos los vecinos de la posición actual considerando las diagonales
-        next_moves = self.model.grid.get_neighborhood(self.pos, moore=False)
-        # Seleccionamos alguno de los vecinos de forma aleatoria y nos movemos a él
-        
-        # It has to select a neighbor that is not a stack/robot/box
-        next_move = self.getMove(next_moves)
 
-        # Movemos el robot a su nueva posición
-        self.model.grid.move_agent(self, next_move)
-
-        # Aumentamos el total de movimientos de los robots
-        self.model.totalMoves += 1
-
-    def getMove(self, next_moves):
-
-        # Si no han sido creadas las stacks suficientes, creamos otra con esa caja (en su posición actual)
-        if(self.myBox == None):
-            posibleMoves = []
-            for move in next_moves:
-                
-                angentsList = self.model.grid.get_cell_list_contents(move)
-                if(len(angentsList) == 0):
-                    posibleMoves.append(move)
-                for agent in angentsList:
-                    # Si la casilla vecina tiene una caja, la recojemos
-                    if(str(type(agent).__name__) == "Box" and not agent.isMoving and not agent.isStacked):
-                        self.myBox = agent
-                        self.myBox.isMoving = True
-                        self.myBox.height = 3.5
-
-                        self.model.grid.move_agent(self.myBox, move)
-                        return move
-            try:
-                posibleMoves.remove(self.lastPos)
-            except:
-                '''It was not possible to remove the lastPos'''
-
-            self.lastPos = self.pos
-
-            if(len(posibleMoves) == 0):
-                self.model.totalMoves -= 1
-                return self.pos
-
-            return self.random.choice(posibleMoves)
-        
-        else:
-            if(len(self.model.boxStacks) < self.model.amountStacks):
-                self.model.boxStacks[self.myBox.pos] = 1
-                self.myBox.height = 0.0
-                self.myBox.isStacked = True
-                self.myBox = None
-                self.model.boxesStacked += 1
-                return self.random.choice(next_moves)
-            
-            else:
-                # La función nos regresa la posición de la stack más cercana a nuestra box
-                if(self.closestStackPos[0] == -1 or (self.closestStackPos in self.model.boxStacks and self.model.boxStacks[self.closestStackPos] >= 5)):
-                    self.closestStackPos = self.findStack()
-                
-                bestMove = [10000.0, (0,0)]
-                for move in next_moves:
-                    # Comprobamos que no se quiera pasar sobre una caja o robot
-                    if not (move != self.closestStackPos and len(self.model.grid.get_cell_list_contents(move)) > 0):
-                        distanceTmp = math.sqrt((self.closestStackPos[0]-move[0])**2 + (self.closestStackPos[1]-move[1])**2)
-                        if(distanceTmp < bestMove[0]):
-                            bestMove = [distanceTmp, move]
-
-                # Si el siguiente mejor movimiento es la stack que buscamos, ponemos allí la caja y nos olvidamos de ella
-                if(bestMove[0] == 0):
-                    # Ponemos la caja y actiualizamos sus valores
-                    self.model.grid.move_agent(self.myBox, bestMove[1])
-                    self.myBox.isStacked = True
-                    self.myBox.isMoving = False
-                    
-                    # Aumentamos la altura de la caja
-                    self.myBox.height = self.model.boxStacks[bestMove[1]]
-
-                    # Sumamos 1 elemento a dicha stack
-                    self.model.boxStacks[bestMove[1]] += 1
-                    # Aumentamos el número de cajas en stacks
-                    self.model.boxesStacked += 1
-                    
-                    # Reestablecemos la posición del stack más cercano y nos quitamos la caja
-                    self.closestStackPos = (-1,-1)
-                    self.myBox = None
-
-                    self.model.totalMoves -= 1
-                    return self.pos
-
-                # Hacemos que la caja se mueva con nosotros
-                self.model.grid.move_agent(self.myBox, bestMove[1])
-                
-                return bestMove[1]
-
-    # Buscamos la stack más cercana a dicha caja
-    def findStack(self):
-        minDistance = [10000.0, (0,0)]
-        distanceTmp = 0.0
-        for pos, cant in self.model.boxStacks.items():
-            if(cant < 5):
-                # Cálculo de la distancia entre los dos puntos
-                distanceTmp = math.sqrt((pos[0]-self.myBox.pos[0])**2 + (pos[1]-self.myBox.pos[1])**2)
-                if(distanceTmp < minDistance[0]):
-                    minDistance = [distanceTmp, pos]
-        
-        return minDistance[1]
-            
-
-# Usamos esta clase para definir una Caja 
-class Box(Agent):
-     def __init__(self, model, pos):
-        super().__init__(model.next_id(), model)
-        self.pos = pos
-        
-        # Atributo que indica si la caja está en movimiento
-        self.isMoving = False
-        
-        # Atributo que indica si la caja ya está apilada
-        self.isStacked = False
-        
-        # Atributo que indica la altura a la que se encuentra (necesario para Unity)
-        self.height = 0
-
-class Floor(Model):
-
-    def __init__(self, cantidadCajas = 15, tiempoMaximo = 60):
-        super().__init__()
-        self.schedule = RandomActivation(self)
-
-        # Establecemos el tamaño del Grid de 20x20
-        self.x = 20
-        self.y = 20
-
-        # Usamos un MultiGrid para poder colocar múltiples agentes en una misma celda
-        self.grid = MultiGrid(self.x, self.y, torus=False)
-
-        # Creamos el diccionario que guardará en su key la posición de la stack y en su value la cantidad de cajas que tiene dicha stack
-        self.boxStacks = {}
-        # También creamos la variable que indicará la cantidad de cajas que se han metido en una stack
-        self.boxesStacked = 0
-
-        # Declaramos la cantidad de Robots, la cuál está establecida en las instrucciones de la actividad
-        amountRobots = 5
-        # Declaramos el número de cajas en nuestro Grid como atributo de nuestra clase
-        self.amountBoxes = cantidadCajas
-
-        # Calculamos la cantidad de stacks necesarias para el número de cajas ingresado
-        self.amountStacks = self.amountBoxes // amountRobots + (0 if self.amountBoxes%amountRobots == 0 else 1)
-
-        # Variable tipo flag que será True cuando se ejecute el primer step de la simulación
-        self.simulationStarted = False
-
-        # Establecemos el tiempo en el que inicia la simulación
-        self.startTime = 0
-
-        # Establecemos el tiempo máximo de la simulación 
-        self.maxTime = tiempoMaximo
-
-        # Declaramos la variable que nos indica el tiempo actual que lleva la simulación
-        self.actualTime = 0
-
-        # Reiniciamos el conteo de movimientos en cada llamada al constructor
-        self.totalMoves = 0
+def agent_portrayal(agent):
+    # si el agente es una caja, retornamos un cuadro rojo si la caja está en una stack o gris si no
+    if agent.kind == BOX:
+         return {"Shape": "rect", "w": 1, "h": 1, "Filled": "true", "Color": "Red" if agent.isStacked else "Gray", "Layer": 0}
+    # si no es una caja, es un robot, por lo que retornamos un cuadro azul
+    return {"Shape": "rect", "w": 1, "h": 1, "Filled": "true", "Color": "Blue", "Layer": 0}
 
-        # Creamos una lista con números aleatorios en el rango de la basura que desea el usuario
-        randomNumsList = random.sample(range(self.x*self.y), self.amountBoxes + amountRobots)
 
-        count = 0
-        # Insertamos la basura iterativamente en posiciones aleatorias
-        for i in randomNumsList:
-            posY = i // self.x
-            posX = i % self.x
+# Crea el servidor de visualización. El tamaño del grid queda fijo porque el CanvasGrid se dibuja
+# con ese tamaño; la cantidad de cajas y el tiempo máximo se pueden cambiar desde la página
+def createServer(ancho = 20, alto = 20, port = 8573):
+    from mesa.visualization import CanvasGrid, ModularServer, NumberInput, TextElement
 
-            # Primero creamos los 5 robots
-            if(count < amountRobots):
-                robot = Robot(self, (posX, posY))
-                self.grid.place_agent(robot, robot.pos)
-                self.schedule.add(robot)
-                count += 1
-            
-            # Luego creamos las cajas
-            else:
-                box = Box(self, (posX, posY))
-                self.schedule.add(box)
-                self.grid.place_agent(box, box.pos)
-          
+    # Mostramos la información recopilada
+    class TextResults(TextElement):
+        def render(self, model):
+            return f"""
+                <br>Tiempo que lleva la simulación: <b>{model.actualTime} segundos </b>
+                <hr>
+                Número de movimientos realizados por todos los agentes: <b>{model.totalMoves} movimientos</b>
+            """
 
-    def step(self):
-        if(not self.simulationStarted):
-            # Declaramos el tiempo de inicio del tiempo como ahora 
-            self.startTime = time.time()
-            self.simulationStarted = True
-        self.schedule.step()        
-        self.actualTime = round(time.time() - self.startTime)
+    # El canvas mide 500 px en su lado más largo y conserva la proporción del grid
+    scale = 500 / max(ancho, alto)
+    grid = CanvasGrid(agent_portrayal, ancho, alto, round(ancho * scale), round(alto * scale))
 
-        # Si el tiempo actual sobrepasa el tiempo en el que debe terminar la simulación o se apilaron todas las cajas, se detiene la simulación
-        if(self.startTime + self.maxTime < time.time() or self.boxesStacked == self.amountBoxes):
-            self.running = False
+    server = ModularServer(Floor, [grid, TextResults()], "Robots Apiladores", {
+        "ancho": ancho,
+        "alto": alto,
+        "cantidadCajas": NumberInput("Número de cajas", value=15),
+        "tiempoMaximo": NumberInput("Tiempo máximo de simulación (segundos)", value=30),
+    })
+    server.port = port
+    return server
 
-# Mostramos la información recopilada
-class TextResults(TextElement):
-    def render(self, model):
-        return f"""
-            <br>Tiempo que lleva la simulación: <b>{model.actualTime} segundos </b>
-            <hr>
-            Número de movimientos realizados por todos los agentes: <b>{model.totalMoves} movimientos</b>
-        """
 
-def agent_portrayal(agent):
-    # si el tipo de clase recibido es Box, retornamos un cuadro rojo si la caja está en una stack o gris si no
-    if str(type(agent).__name__) == "Box":
-         return {"Shape": "rect", "w": 1, "h": 1, "Filled": "true", "Color": "Red" if agent.isStacked else "Gray", "Layer": 0}
-    # si no es una caja, es un robot, por lo que retornamos un cuadro azul
-    return {"Shape": "rect", "w": 1, "h": 1, "Filled": "true", "Color": "Blue", "Layer": 0}
+# Crea el servidor de visualización y lo lanza (bloquea hasta que se detenga)
+def launch(ancho = 20, alto = 20, port = 8573):
+    createServer(ancho, alto, port).launch()
 
-# Establecemos el tamaño del CanvasGrid que sea de 20*20 celdas
-grid = CanvasGrid(agent_portrayal, 20, 20, 500, 500)
 
-server = ModularServer(Floor, [grid, TextResults()], "Robots Apiladores", {
-    "cantidadCajas": UserSettableParameter("number", "Número de cajas", value=15), 
-    "tiempoMaximo": UserSettableParameter("number", "Tiempo máximo de simulación (segundos)", value=30),
-})
-server.port = 8573
-server.launch()
\ No newline at end of file
+if __name__ == "__main__":
+    launch()